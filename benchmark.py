@@ -0,0 +1,210 @@
+"""
+CNN 训练/推理吞吐基准测试。
+
+对每种支持的架构（通过 cnn_engine.ModelBuilder.build_model 构建），在批大小 × 线程数网格上测量：
+samples/sec、单步 forward/backward/optimizer.step 毫秒数、纯推理吞吐、峰值 RSS 和模型构建耗时。
+使用合成的 1x28x28 数据，无需下载数据集即可离线运行；结果写为 JSON，可在不同提交之间对比以发现性能回退。
+
+用法:
+    python benchmark.py                                   # 默认网格，结果写入 ./benchmark_results/
+    python benchmark.py --archs CustomCNN,SENet --batch-sizes 64,128 --threads 1,4
+    python benchmark.py --compare old.json new.json       # 对比两次结果，超过阈值的回退会被标出
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from typing import Dict, Any, List
+
+DEFAULT_ARCHITECTURES = ['CustomCNN', 'ResNet18', 'DenseNet121', 'SENet']
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _run_point(arch: str, batch_size: int, num_threads: int, steps: int, warmup: int) -> Dict[str, Any]:
+    """在独立子进程中测量单个 (架构, 批大小, 线程数) 组合。"""
+    import torch
+    import torch.nn as nn
+    import torch.optim as optim
+    from cnn_engine import ModelBuilder, DEFAULT_ARCHITECTURE_CONFIGS
+
+    torch.set_num_threads(num_threads)
+    torch.manual_seed(0)
+
+    result: Dict[str, Any] = {'architecture': arch, 'batchSize': batch_size, 'threads': num_threads}
+    try:
+        build_start = time.perf_counter()
+        model = ModelBuilder.build_model(DEFAULT_ARCHITECTURE_CONFIGS[arch], num_classes=10)
+        result['buildMs'] = (time.perf_counter() - build_start) * 1000
+        result['parameters'] = sum(p.numel() for p in model.parameters())
+
+        inputs = torch.randn(batch_size, 1, 28, 28)
+        labels = torch.randint(0, 10, (batch_size,))
+        criterion = nn.CrossEntropyLoss()
+        optimizer = optim.Adam(model.parameters(), lr=1e-3)
+
+        # --- 训练步：分别计时 forward / backward / optimizer.step ---
+        model.train()
+        forward_s = backward_s = step_s = 0.0
+        for i in range(warmup + steps):
+            t0 = time.perf_counter()
+            optimizer.zero_grad()
+            outputs, _ = model(inputs)
+            loss = criterion(outputs, labels)
+            t1 = time.perf_counter()
+            loss.backward()
+            t2 = time.perf_counter()
+            optimizer.step()
+            t3 = time.perf_counter()
+            if i >= warmup:
+                forward_s += t1 - t0
+                backward_s += t2 - t1
+                step_s += t3 - t2
+        train_total_s = forward_s + backward_s + step_s
+        result.update({
+            'trainSamplesPerSec': batch_size * steps / train_total_s,
+            'forwardMs': forward_s / steps * 1000,
+            'backwardMs': backward_s / steps * 1000,
+            'optimizerStepMs': step_s / steps * 1000,
+            'trainStepMs': train_total_s / steps * 1000,
+        })
+
+        # --- 推理 ---
+        model.eval()
+        with torch.inference_mode():
+            for _ in range(warmup):
+                model(inputs)
+            t0 = time.perf_counter()
+            for _ in range(steps):
+                model(inputs)
+            infer_s = time.perf_counter() - t0
+        result.update({
+            'inferSamplesPerSec': batch_size * steps / infer_s,
+            'inferBatchMs': infer_s / steps * 1000,
+        })
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['peakRssMb'] = _peak_rss_mb()
+    return result
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except Exception:
+        return 'unknown'
+
+
+def run_benchmarks(archs: List[str], batch_sizes: List[int], threads: List[int], steps: int,
+                   warmup: int) -> Dict[str, Any]:
+    import torch
+
+    results = []
+    # 每个测量点使用新的 spawn 子进程，保证线程设置和峰值 RSS 互不影响
+    ctx = multiprocessing.get_context('spawn')
+    for arch in archs:
+        for num_threads in threads:
+            for batch_size in batch_sizes:
+                with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                    point = pool.submit(_run_point, arch, batch_size, num_threads, steps, warmup).result()
+                results.append(point)
+                if 'error' in point:
+                    print(f"{arch:<12} bs={batch_size:<4} threads={num_threads:<3} ERROR {point['error']}")
+                else:
+                    print(f"{arch:<12} bs={batch_size:<4} threads={num_threads:<3} "
+                          f"train {point['trainSamplesPerSec']:9.1f} samples/s "
+                          f"(fwd {point['forwardMs']:.1f} / bwd {point['backwardMs']:.1f} / "
+                          f"step {point['optimizerStepMs']:.1f} ms)  "
+                          f"infer {point['inferSamplesPerSec']:9.1f} samples/s  "
+                          f"build {point['buildMs']:.0f} ms  rss {point['peakRssMb']:.0f} MB", flush=True)
+
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'torch': torch.__version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpuCount': os.cpu_count(),
+            'steps': steps,
+            'warmup': warmup,
+        },
+        'results': results,
+    }
+
+
+def compare_results(old_path: str, new_path: str, threshold: float) -> int:
+    """打印两次基准结果的吞吐变化，返回超过阈值的回退数量。"""
+    with open(old_path, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, encoding='utf-8') as f:
+        new = json.load(f)
+
+    def key(point):
+        return point['architecture'], point['batchSize'], point['threads']
+
+    old_points = {key(p): p for p in old['results'] if 'error' not in p}
+    regressions = 0
+    print(f"{old['meta'].get('commit')} -> {new['meta'].get('commit')}")
+    for point in new['results']:
+        base = old_points.get(key(point))
+        if base is None or 'error' in point:
+            continue
+        for metric in ('trainSamplesPerSec', 'inferSamplesPerSec'):
+            change = (point[metric] - base[metric]) / base[metric]
+            flag = ''
+            if change < -threshold:
+                flag = '  <-- REGRESSION'
+                regressions += 1
+            print(f"{point['architecture']:<12} bs={point['batchSize']:<4} threads={point['threads']:<3} "
+                  f"{metric:<20} {base[metric]:9.1f} -> {point[metric]:9.1f} ({change:+.1%}){flag}")
+    return regressions
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(',') if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CNN 训练/推理吞吐基准测试')
+    parser.add_argument('--archs', default=','.join(DEFAULT_ARCHITECTURES), help='逗号分隔的架构列表')
+    parser.add_argument('--batch-sizes', type=_int_list, default=[32, 128], help='逗号分隔的批大小列表')
+    parser.add_argument('--threads', type=_int_list, default=sorted({1, os.cpu_count() or 1}),
+                        help='逗号分隔的 intra-op 线程数列表')
+    parser.add_argument('--steps', type=int, default=10, help='每个测量点计时的步数')
+    parser.add_argument('--warmup', type=int, default=3, help='每个测量点的预热步数')
+    parser.add_argument('--output', default=None, help='结果 JSON 路径，默认 ./benchmark_results/<commit>-<时间>.json')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='对比两个结果文件')
+    parser.add_argument('--threshold', type=float, default=0.1, help='判定为回退的吞吐下降比例')
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare_results(*args.compare, threshold=args.threshold) else 0)
+
+    archs = [a for a in args.archs.split(',') if a]
+    unknown = [a for a in archs if a not in DEFAULT_ARCHITECTURES]
+    if unknown:
+        parser.error(f"未知架构: {', '.join(unknown)}")
+
+    report = run_benchmarks(archs, args.batch_sizes, args.threads, args.steps, args.warmup)
+    output = args.output or os.path.join(
+        'benchmark_results', f"{report['meta']['commit']}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"结果已写入 {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,2371 @@
+"""
+CNN 训练引擎：模型构建、MNIST 张量缓存、训练器以及训练工作进程的入口函数。
+依赖 torch / torchvision，只在训练工作进程（以及首次推理时的主进程）中导入，Web 服务启动时不加载。
+"""
+import io
+import copy
+import json
+import shutil
+import hashlib
+import base64
+import binascii
+import platform
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torchvision import datasets, models
+from PIL import Image
+import os
+import time
+import bisect
+import statistics
+import contextlib
+import importlib.util
+import queue
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, List, Tuple, Optional
+
+from model_artifacts import architecture_config_hash, LRUArtifactCache, model_registry, training_checkpoint_dir
+from model_cost import (ADMISSION_MAX_MEMORY_MB, autotune_micro_batches, estimate_training_cost, EXPORT_VARIANTS,
+                        resolve_training_subset)
+from server_metrics import Histogram, STEP_SECONDS_BUCKETS
+
+# --- 1. PyTorch 模型构建器和自定义模块 ---
+
+# 激活函数映射
+ACTIVATION_MAP = {
+    'ReLU': nn.ReLU,
+    'Sigmoid': nn.Sigmoid,
+    'Tanh': nn.Tanh,
+    'LeakyReLU': nn.LeakyReLU,
+    'PReLU': nn.PReLU
+}
+
+
+class SqueezeExcitation(nn.Module):
+    """
+    Squeeze-and-Excitation (SE) Block
+    """
+
+    def __init__(self, channel, reduction=16):
+        super(SqueezeExcitation, self).__init__()
+        self.avg_pool = nn.AdaptiveAvgPool2d(1)
+        self.fc = nn.Sequential(
+            nn.Linear(channel, channel // reduction, bias=False),
+            nn.ReLU(inplace=True),
+            nn.Linear(channel // reduction, channel, bias=False),
+            nn.Sigmoid()
+        )
+
+    def forward(self, x):
+        b, c, _, _ = x.size()
+        y = self.avg_pool(x).view(b, c)
+        y = self.fc(y).view(b, c, 1, 1)
+        return x * y.expand_as(x)
+
+
+class CustomCNN(nn.Module):
+    def __init__(self, config: Dict[str, Any]):
+        super(CustomCNN, self).__init__()
+        self.features = nn.Sequential()
+        in_channels = 1  # MNIST input
+        current_dim = 28  # MNIST image size
+
+        custom_layers_config = config.get('modelArchitecture', {}).get('customLayers', [])
+
+        for i, layer_conf in enumerate(custom_layers_config):
+            out_channels = layer_conf['numFilters']
+            kernel_size = layer_conf['kernelSize']
+            stride = layer_conf['stride']
+            padding = layer_conf['padding']
+            activation_name = layer_conf['activation']
+            use_batchnorm = layer_conf['batchNorm']
+
+            conv_out_dim = (current_dim - kernel_size + 2 * padding) // stride + 1
+            if conv_out_dim <= 0:
+                raise ValueError(
+                    f"Layer {i + 1} (Conv) configuration leads to invalid output dimension after convolution. "
+                    f"Input dim: {current_dim}, Kernel: {kernel_size}, Stride: {stride}, Padding: {padding}. "
+                    f"Output dim would be {conv_out_dim}.")
+
+            self.features.add_module(f'conv{i + 1}',
+                                     nn.Conv2d(in_channels, out_channels, kernel_size=kernel_size, stride=stride,
+                                               padding=padding))
+
+            if use_batchnorm:
+                self.features.add_module(f'bn{i + 1}', nn.BatchNorm2d(out_channels))
+
+            activation_fn = ACTIVATION_MAP.get(activation_name, nn.ReLU)
+            self.features.add_module(f'act{i + 1}', activation_fn())
+
+            if conv_out_dim >= 2:
+                self.features.add_module(f'pool{i + 1}', nn.MaxPool2d(kernel_size=2, stride=2))
+                current_dim = conv_out_dim // 2
+            else:
+                logging.warning(
+                    f"Feature map dimension {conv_out_dim} too small for pooling in layer {i + 1}. Skipping MaxPool2d.")
+                current_dim = conv_out_dim
+
+            in_channels = out_channels
+            current_dim = max(1, current_dim)
+
+        # 与 model_cost 的静态形状推导一致，无需 dummy forward
+        fc_input_features = in_channels * current_dim * current_dim
+
+        fc_config = config.get('modelArchitecture', {}).get('fcLayer', {})
+        num_neurons = fc_config.get('numNeurons', 64)
+
+        self.classifier = nn.Sequential(
+            nn.Flatten(),
+            nn.Linear(fc_input_features, num_neurons),
+            nn.ReLU(),
+            nn.Linear(num_neurons, 10)
+        )
+
+        # 构建时确定第一层卷积，forward 中不再逐层查找。
+        # 用 object.__setattr__ 保存普通引用，避免被重复注册为子模块。
+        first_conv = next((m for m in self.features if isinstance(m, nn.Conv2d)), None)
+        object.__setattr__(self, '_first_conv', first_conv)
+
+    def forward(self, x: torch.Tensor):
+        first_conv_layer_weights = self._first_conv.weight if self._first_conv is not None else None
+        x = self.features(x)
+        x = self.classifier(x)
+        return x, first_conv_layer_weights
+
+
+class PretrainedModel(nn.Module):
+    def __init__(self, base_arch: str, num_classes: int, fc_neurons: int, senet_reduction: int = 8):
+        super(PretrainedModel, self).__init__()
+        self.base_arch = base_arch
+
+        if base_arch == 'ResNet18':
+            self.model = models.resnet18(weights=None)
+            self.model.conv1 = nn.Conv2d(1, 64, kernel_size=7, stride=2, padding=3, bias=False)
+            num_ftrs = self.model.fc.in_features
+            self.model.fc = nn.Sequential(
+                nn.Linear(num_ftrs, fc_neurons),
+                nn.ReLU(),
+                nn.Linear(fc_neurons, num_classes)
+            )
+        elif base_arch == 'DenseNet121':
+            self.model = models.densenet121(weights=None)
+            # 28x28 输入经过原始 7x7/s2 卷积和池化后只剩 7x7，第三个 Transition 会把特征图池化到 0x0。
+            # 改用 3x3/s1 卷积（保留 pool0），四个 DenseBlock 依次工作在 14/7/3/1 的特征图上。
+            self.model.features.conv0 = nn.Conv2d(1, 64, kernel_size=3, stride=1, padding=1, bias=False)
+            num_ftrs = self.model.classifier.in_features
+            self.model.classifier = nn.Sequential(
+                nn.Linear(num_ftrs, fc_neurons),
+                nn.ReLU(),
+                nn.Linear(fc_neurons, num_classes)
+            )
+        elif base_arch == 'SENet':
+            # Calculate num_features_before_fc based on fixed sequential structure for SENet example
+            # Assuming 28x28 input -> 2 MaxPool2d (kernel=2, stride=2) -> 7x7 feature map size before Flatten
+            num_features_before_fc = 64 * 7 * 7
+
+            self.model = nn.Sequential(
+                nn.Conv2d(1, 32, kernel_size=3, padding=1),
+                nn.BatchNorm2d(32),
+                nn.ReLU(inplace=True),
+                SqueezeExcitation(32, reduction=senet_reduction),
+                nn.MaxPool2d(kernel_size=2, stride=2),
+
+                nn.Conv2d(32, 64, kernel_size=3, padding=1),
+                nn.BatchNorm2d(64),
+                nn.ReLU(inplace=True),
+                SqueezeExcitation(64, reduction=senet_reduction),
+                nn.MaxPool2d(kernel_size=2, stride=2),
+
+                nn.Flatten(),
+                nn.Linear(num_features_before_fc, fc_neurons),  # This line was causing syntax error previously.
+                nn.ReLU(inplace=True),
+                nn.Linear(fc_neurons, num_classes)
+            )
+        else:
+            raise ValueError(f"不支持的基础架构: {base_arch}")
+
+        # 构建时确定第一层卷积（见 CustomCNN 中的说明）
+        if base_arch == 'ResNet18':
+            first_conv = self.model.conv1
+        elif base_arch == 'DenseNet121':
+            first_conv = self.model.features.conv0
+        else:
+            first_conv = self.model[0] if isinstance(self.model[0], nn.Conv2d) else None
+        object.__setattr__(self, '_first_conv', first_conv)
+
+    def forward(self, x: torch.Tensor):
+        first_conv_layer_weights = self._first_conv.weight if self._first_conv is not None else None
+        x = self.model(x)
+        return x, first_conv_layer_weights
+
+
+class ModelBuilder:
+    @staticmethod
+    def build_model(config: Dict[str, Any], num_classes: int = 10):
+        base_arch = config.get('modelArchitecture', {}).get('baseArchitecture', 'CustomCNN')
+        fc_neurons = config.get('modelArchitecture', {}).get('fcLayer', {}).get('numNeurons', 64)
+
+        if base_arch == 'CustomCNN':
+            return CustomCNN(config)
+        elif base_arch in ['ResNet18', 'DenseNet121']:
+            return PretrainedModel(base_arch, num_classes, fc_neurons)
+        elif base_arch == 'SENet':
+            senet_reduction = config.get('modelArchitecture', {}).get('senetConfig', {}).get('reduction', 8)
+            return PretrainedModel(base_arch, num_classes, fc_neurons, senet_reduction)
+        else:
+            raise ValueError(f"未知模型架构: {base_arch}")
+
+
+def get_model_summary_text(model: nn.Module, input_size: Tuple[int, ...] = (1, 28, 28)):
+    """
+    使用 torchinfo 生成模型文本摘要。
+    input_size 应为 (channels, height, width)。
+    """
+    try:
+        from torchinfo import summary
+
+        device = 'cpu'
+        try:
+            param = next(model.parameters(), None)
+            if param is not None:
+                device = str(param.device)
+        except Exception:
+            pass
+
+        # verbose=0 时 torchinfo 不打印，直接取返回的 ModelStatistics 文本，无需替换 sys.stdout
+        summary_text = str(summary(model, input_size=(1,) + input_size, verbose=0, device=device))
+
+        if not summary_text.strip():
+            logging.warning("torchinfo generated empty summary. Falling back to str(model).")
+            summary_text = str(model)
+
+        logging.info(f"Generated model text summary (first 500 chars):\n{summary_text[:500]}...")
+        return summary_text
+    except ImportError:
+        logging.warning(
+            "torchinfo 库未安装。为了获得详细的模型摘要，请运行 'pip install torchinfo'。将使用简单的模型结构字符串。")
+        summary_text = str(model)
+        logging.info(f"Generated model text summary (str(model), first 500 chars):\n{summary_text[:500]}...")
+        return summary_text
+    except Exception as e:
+        logging.error(f"生成模型文本摘要时发生意外错误: {e}", exc_info=True)
+        return f"Error generating model text summary: {e}. Check backend logs for details."
+
+
+def model_to_json_graph(model: nn.Module, input_shape: Tuple[int, ...] = (1, 28, 28)):
+    """
+    将 PyTorch 模型转换为 JSON 格式的图结构，以便在前端可视化。
+    每个节点代表一个模块，包含其类型、名称、参数量、真实的输入/输出形状和调用顺序，并记录其父模块ID。
+    形状通过前向钩子在一次 torch.no_grad() 的前向传播中统一采集，同级模块按实际调用顺序串联。
+    """
+    start_time = time.perf_counter()
+
+    # CustomCNN 的 features/classifier 是顶层模块；PretrainedModel 的结构保存在内部的 model 属性中
+    root = model.model if isinstance(model, PretrainedModel) else model
+
+    # name -> {"order", "input_shape", "output_shape"}
+    records: Dict[str, Dict[str, Any]] = {}
+
+    def _shape_of(value) -> Optional[List[int]]:
+        if isinstance(value, (tuple, list)):
+            value = next((v for v in value if isinstance(v, torch.Tensor)), None)
+        if isinstance(value, torch.Tensor):
+            return list(value.shape[1:])  # Remove batch dimension
+        return None
+
+    def _make_pre_hook(name: str):
+        def pre_hook(_module, inputs):
+            if name not in records:  # 被重复调用的模块（如 ResNet 中复用的 ReLU）只记录第一次调用
+                records[name] = {"order": len(records), "input_shape": _shape_of(inputs), "output_shape": None}
+
+        return pre_hook
+
+    def _make_hook(name: str):
+        def hook(_module, _inputs, output):
+            if records[name]["output_shape"] is None:
+                records[name]["output_shape"] = _shape_of(output)
+
+        return hook
+
+    named_modules = [(name, module) for name, module in root.named_modules() if name]
+    handles = []
+    for name, module in named_modules:
+        handles.append(module.register_forward_pre_hook(_make_pre_hook(name)))
+        handles.append(module.register_forward_hook(_make_hook(name)))
+
+    was_training = model.training
+    try:
+        param = next(model.parameters(), None)
+        device = param.device if param is not None else torch.device('cpu')
+        model.eval()
+        with torch.no_grad():
+            model(torch.zeros(1, *input_shape, device=device))
+    except Exception as e:
+        logging.warning(f"Hooked forward pass failed while building model graph: {e}. Shapes may be incomplete.")
+    finally:
+        for handle in handles:
+            handle.remove()
+        model.train(was_training)
+
+    nodes = []
+    edges = []
+
+    input_node_id = "node_input"
+    nodes.append({
+        "id": input_node_id,
+        "label": f"Input\nShape: {input_shape}",
+        "full_name": "Input",
+        "type": "Input",
+        "input_shape": list(input_shape),
+        "output_shape": list(input_shape),
+        "parameters": 0,
+        "has_children": False,
+        "parent_id": None,  # Top-level node
+        "level": 0  # Level 0 for the input node
+    })
+
+    node_ids: Dict[str, str] = {}
+    children_by_parent: Dict[str, List[str]] = {"": []}
+    for index, (name, module) in enumerate(named_modules):
+        node_vis_id = f"node_{index + 1}"
+        node_ids[name] = node_vis_id
+        parent_name, _, local_name = name.rpartition('.')
+        children_by_parent.setdefault(parent_name, []).append(name)
+        children_by_parent.setdefault(name, [])
+
+        record = records.get(name, {})
+        module_type = module.__class__.__name__
+        nodes.append({
+            "id": node_vis_id,
+            "label": f"{local_name}\n({module_type})",
+            "full_name": name,
+            "type": module_type,
+            "input_shape": record.get("input_shape"),
+            "output_shape": record.get("output_shape"),
+            "parameters": sum(p.numel() for p in module.parameters(recurse=False) if p.requires_grad),
+            "has_children": next(module.children(), None) is not None,
+            "parent_id": node_ids[parent_name] if parent_name else None,
+            "level": name.count('.') + 1,
+            "call_order": record.get("order")
+        })
+
+    # 同级模块按实际调用顺序连线；未被调用的模块排在最后，保持定义顺序
+    never_called = len(records)
+    for parent_name, child_names in children_by_parent.items():
+        ordered = sorted(child_names, key=lambda n: records.get(n, {}).get("order", never_called))
+        prev_vis_id = None
+        for child_name in ordered:
+            child_vis_id = node_ids[child_name]
+            if prev_vis_id:
+                edges.append({"from": prev_vis_id, "to": child_vis_id, "type": "sequential_flow"})
+            elif parent_name:
+                edges.append({"from": node_ids[parent_name], "to": child_vis_id, "type": "parent_child"})
+            else:
+                edges.append({"from": input_node_id, "to": child_vis_id, "type": "sequential_flow"})
+            prev_vis_id = child_vis_id
+
+    elapsed_ms = (time.perf_counter() - start_time) * 1000
+    logging.info(f"Generated graph data with {len(nodes)} nodes and {len(edges)} edges in {elapsed_ms:.1f} ms.")
+    return {"nodes": nodes, "edges": edges}
+
+
+# --- 模型模板与编译缓存 ---
+MODEL_TEMPLATE_CACHE_MAX_ENTRIES = int(os.environ.get('MODEL_TEMPLATE_CACHE_MAX_ENTRIES', 8))
+COMPILED_MODEL_CACHE_MAX_ENTRIES = int(os.environ.get('COMPILED_MODEL_CACHE_MAX_ENTRIES', 4))
+
+# 训练工作进程：按架构哈希缓存初始权重模板
+model_template_cache = LRUArtifactCache(MODEL_TEMPLATE_CACHE_MAX_ENTRIES)
+# 训练工作进程：按 架构哈希 + 编译模式 + 执行模式 缓存已编译的模型实例，重复任务跳过重新编译
+compiled_model_cache = LRUArtifactCache(COMPILED_MODEL_CACHE_MAX_ENTRIES)
+
+
+def pristine_state_dict(config: Dict[str, Any], arch_hash: str) -> Dict[str, torch.Tensor]:
+    """返回该架构的初始权重模板（只读，调用方需通过 load_state_dict 复制使用）。"""
+    template = model_template_cache.get(arch_hash)
+    if template is None:
+        template = build_model_from_template(config, arch_hash).state_dict()
+    return template
+
+
+def build_model_from_template(config: Dict[str, Any], arch_hash: str, num_classes: int = 10) -> nn.Module:
+    """
+    通过 ModelBuilder 构建模型，并复用同一架构的初始 state_dict 模板。
+    命中时在 meta 设备上构建模块结构，跳过逐层的参数初始化，再直接装入模板权重的副本。
+    """
+    template = model_template_cache.get(arch_hash)
+    if template is None:
+        model = ModelBuilder.build_model(config, num_classes=num_classes)
+        model_template_cache.put(arch_hash, {k: v.detach().clone() for k, v in model.state_dict().items()})
+        return model
+
+    state_dict = {k: v.clone() for k, v in template.items()}
+    try:
+        with torch.device('meta'):
+            model = ModelBuilder.build_model(config, num_classes=num_classes)
+        model.load_state_dict(state_dict, assign=True)
+    except Exception as e:
+        logging.warning(f"Meta-device build from template failed ({e}); falling back to a regular build.")
+        model = ModelBuilder.build_model(config, num_classes=num_classes)
+        model.load_state_dict(state_dict)
+    return model
+
+
+# --- 2. MNIST 数据集缓存 ---
+MNIST_ROOT = './data'
+MNIST_CACHE_DIR = os.path.join(MNIST_ROOT, 'MNIST', 'cache')
+TRAINING_SUBSET_CACHE_MAX_ENTRIES = 8
+
+
+class MNISTTensorCache:
+    """
+    进程级 MNIST 张量缓存。
+    首次使用时通过 torchvision 读取原始数据，将图像 (uint8, N x 28 x 28) 与标签导出为 ./data/MNIST/cache 下的 .npy 文件；
+    之后每个进程都以只读内存映射方式打开同一份文件，数据页由操作系统在会话和工作进程之间共享。
+    归一化在取批次时完成，不再逐样本经过 PIL 解码。
+    """
+    _splits: Dict[bool, Tuple[np.ndarray, torch.Tensor]] = {}
+    _class_indices: Dict[bool, List[torch.Tensor]] = {}
+    _subsets = LRUArtifactCache(max_entries=TRAINING_SUBSET_CACHE_MAX_ENTRIES)
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _cache_paths(train: bool) -> Tuple[str, str]:
+        split = 'train' if train else 'test'
+        return (os.path.join(MNIST_CACHE_DIR, f'{split}_images_u8.npy'),
+                os.path.join(MNIST_CACHE_DIR, f'{split}_labels.npy'))
+
+    @staticmethod
+    def _atomic_save(path: str, array: np.ndarray):
+        # 多个工作进程可能同时首次导出，先写临时文件再原子替换
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(array))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def _materialize(cls, train: bool):
+        images_path, labels_path = cls._cache_paths(train)
+        if os.path.exists(images_path) and os.path.exists(labels_path):
+            return
+        logging.info(f"正在导出 MNIST {'训练' if train else '测试'}集张量缓存到 {MNIST_CACHE_DIR} ...")
+        os.makedirs(MNIST_CACHE_DIR, exist_ok=True)
+        raw_dataset = datasets.MNIST(root=MNIST_ROOT, train=train, download=True)
+        cls._atomic_save(labels_path, raw_dataset.targets.numpy().astype(np.int64))
+        cls._atomic_save(images_path, raw_dataset.data.numpy().astype(np.uint8))
+
+    @classmethod
+    def get_split(cls, train: bool = True) -> Tuple[np.ndarray, torch.Tensor]:
+        """返回 (只读内存映射的 uint8 图像数组, int64 标签张量)。"""
+        with cls._lock:
+            if train not in cls._splits:
+                cls._materialize(train)
+                images_path, labels_path = cls._cache_paths(train)
+                images = np.load(images_path, mmap_mode='r')
+                labels = torch.from_numpy(np.load(labels_path))
+                cls._splits[train] = (images, labels)
+            return cls._splits[train]
+
+    @classmethod
+    def _get_class_indices(cls, train: bool) -> List[torch.Tensor]:
+        """每个类别的样本索引（升序），每个进程只计算一次。"""
+        _, labels = cls.get_split(train)
+        with cls._lock:
+            if train not in cls._class_indices:
+                order = torch.argsort(labels, stable=True)
+                counts = torch.bincount(labels, minlength=10).tolist()
+                cls._class_indices[train] = list(torch.split(order, counts))
+            return cls._class_indices[train]
+
+    @classmethod
+    def subset_indices(cls, subset_size: int, strategy: str = 'stratified', pool_size: Optional[int] = None,
+                       train: bool = True, seed: int = 0) -> torch.Tensor:
+        """
+        从前 pool_size 个样本中选出 subset_size 个训练样本的索引（升序，便于顺序读取内存映射）。
+        stratified 按各类别在样本池中的占比分配名额（最大余数法），类内随机抽取；结果按参数缓存，
+        之后每个 epoch 只需对这份索引张量做一次 randperm。
+        """
+        _, labels = cls.get_split(train)
+        pool_size = len(labels) if pool_size is None else min(pool_size, len(labels))
+        subset_size = min(subset_size, pool_size)
+        key = f"{int(train)}:{subset_size}:{strategy}:{pool_size}:{seed}"
+        cached = cls._subsets.get(key)
+        if cached is not None:
+            return cached
+
+        generator = torch.Generator()
+        generator.manual_seed(seed)
+        if subset_size == pool_size or strategy == 'first':
+            indices = torch.arange(subset_size)
+        elif strategy == 'random':
+            indices = torch.randperm(pool_size, generator=generator)[:subset_size].sort().values
+        elif strategy == 'stratified':
+            per_class = [idx[idx < pool_size] for idx in cls._get_class_indices(train)]
+            exact = [len(idx) * subset_size / pool_size for idx in per_class]
+            quotas = [int(q) for q in exact]
+            by_remainder = sorted(range(len(per_class)), key=lambda c: exact[c] - quotas[c], reverse=True)
+            for c in by_remainder[:subset_size - sum(quotas)]:
+                quotas[c] += 1
+            indices = torch.cat([idx[torch.randperm(len(idx), generator=generator)[:quota]]
+                                 for idx, quota in zip(per_class, quotas)]).sort().values
+        else:
+            raise ValueError(f"不支持的抽样方式: {strategy}")
+        cls._subsets.put(key, indices)
+        return indices
+
+
+def normalize_mnist_batch(images_u8: torch.Tensor) -> torch.Tensor:
+    """uint8 (B x 28 x 28) -> float (B x 1 x 28 x 28)，等价于 ToTensor + Normalize((0.5,), (0.5,))。"""
+    return images_u8.unsqueeze(1).float().mul_(2.0 / 255.0).sub_(1.0)
+
+
+class BatchIndexSampler:
+    """
+    按批次产出（可打乱的）样本索引张量，替代逐样本的 Subset/DataLoader 采样。
+    数据并行时各进程使用相同的 seed + epoch 打乱顺序，再按 rank 交错分片，保证每个进程的批次数相同。
+    """
+
+    def __init__(self, indices: torch.Tensor, batch_size: int, shuffle: bool = True, drop_last: bool = False,
+                 num_replicas: int = 1, rank: int = 0, seed: Optional[int] = None):
+        self.indices = indices.long()
+        self.batch_size = max(1, int(batch_size))
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.num_replicas = max(1, num_replicas)
+        self.rank = rank
+        self.seed = seed
+        self.epoch = 0
+        self.start_batch = 0
+
+    def set_epoch(self, epoch: int, start_batch: int = 0):
+        """start_batch > 0 时跳过本 epoch 的前若干批次（从检查点恢复时使用，需要固定 seed 才能复现顺序）。"""
+        self.epoch = epoch
+        self.start_batch = max(0, start_batch)
+
+    def _num_samples(self) -> int:
+        return len(self.indices) // self.num_replicas if self.num_replicas > 1 else len(self.indices)
+
+    def __len__(self):
+        if self.drop_last:
+            return self._num_samples() // self.batch_size
+        return (self._num_samples() + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        if self.shuffle:
+            generator = None
+            if self.seed is not None:
+                generator = torch.Generator()
+                generator.manual_seed(self.seed + self.epoch)
+            order = self.indices[torch.randperm(len(self.indices), generator=generator)]
+        else:
+            order = self.indices
+        if self.num_replicas > 1:
+            order = order[self.rank:self.num_replicas * self._num_samples():self.num_replicas]
+        for start in range(self.start_batch * self.batch_size, len(self) * self.batch_size, self.batch_size):
+            yield order[start:start + self.batch_size]
+
+
+class MNISTBatchLoader:
+    """
+    从共享缓存中按索引批量取数据，每个批次只做一次内存拷贝和一次向量化归一化。
+    prefetch > 0 时由后台线程提前准备至多 prefetch 个批次，与训练步重叠。
+    """
+
+    def __init__(self, images: np.ndarray, labels: torch.Tensor, indices: torch.Tensor, batch_size: int,
+                 shuffle: bool = True, pin_memory: bool = False, prefetch: int = 0, **sampler_kwargs):
+        self.images = images
+        self.labels = labels
+        self.sampler = BatchIndexSampler(indices, batch_size, shuffle=shuffle, **sampler_kwargs)
+        self.pin_memory = pin_memory
+        self.prefetch = max(0, int(prefetch or 0))
+
+    def __len__(self):
+        return len(self.sampler)
+
+    def set_epoch(self, epoch: int, start_batch: int = 0):
+        self.sampler.set_epoch(epoch, start_batch)
+
+    def _batches(self):
+        for batch_indices in self.sampler:
+            inputs = normalize_mnist_batch(torch.from_numpy(self.images[batch_indices.numpy()]))
+            targets = self.labels[batch_indices]
+            if self.pin_memory:
+                inputs, targets = inputs.pin_memory(), targets.pin_memory()
+            yield inputs, targets
+
+    def __iter__(self):
+        if not self.prefetch:
+            yield from self._batches()
+            return
+
+        ready: "queue.Queue" = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        end = object()
+
+        def produce():
+            try:
+                for item in self._batches():
+                    while not stop.is_set():
+                        try:
+                            ready.put(item, timeout=0.1)
+                            break
+                        except queue.Full:
+                            continue
+                    if stop.is_set():
+                        return
+            except Exception as e:
+                item = e
+            else:
+                item = end
+            while not stop.is_set():
+                try:
+                    ready.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        producer = threading.Thread(target=produce, name='mnist-prefetch', daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = ready.get()
+                if item is end:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # 训练中途停止时让后台线程退出
+            stop.set()
+            producer.join()
+
+
+# --- 3. 核心训练器类 ---
+PROFILE_TRACE_DIR = os.environ.get('PROFILE_TRACE_DIR', './profiles')
+SWEEP_VALIDATION_SIZE = 5000
+EVAL_BATCH_SIZE = int(os.environ.get('EVAL_BATCH_SIZE', 1000))
+# 后台测试集评估线程的 intra-op 线程数；CPU 训练时它与训练线程共用任务的核心预算，只占其中一小部分
+EVAL_NUM_THREADS = int(os.environ.get('EVAL_NUM_THREADS', 1))
+# 特征图流：未指定层时默认取前若干个卷积层；空间尺寸上限；探针图像取测试集中的固定样本
+FEATURE_MAP_DEFAULT_LAYERS = 4
+FEATURE_MAP_MAX_SIZE = 14
+FEATURE_MAP_PROBE_INDEX = 0
+# 批大小/加载器自动调优的结果按 (架构, 有效批大小, 执行模式, 机器) 缓存在磁盘上，跨进程和重启复用
+AUTOTUNE_CACHE_DIR = os.environ.get('AUTOTUNE_CACHE_DIR', './autotune_cache')
+AUTOTUNE_MAX_MEMORY_MB = float(os.environ.get('AUTOTUNE_MAX_MEMORY_MB', ADMISSION_MAX_MEMORY_MB))
+AUTOTUNE_PREFETCH = 2
+# 训练后导出：推理服务能直接加载的变体（onnx 只作为对外部署的产物），以及延迟基准的批大小
+EXPORT_SERVABLE_VARIANTS = ('float32', 'torchscript', 'dynamic', 'static')
+EXPORT_BENCHMARK_BATCH_SIZES = (1, 64)
+EXPORT_BENCHMARK_WARMUP = 3
+EXPORT_CALIBRATION_BATCH_SIZE = 64
+
+
+def _machine_fingerprint(device: str) -> str:
+    if device == 'cuda':
+        hardware = torch.cuda.get_device_name()
+    else:
+        hardware = platform.processor() or platform.machine()
+    return f"{platform.node()}|{hardware}|torch {torch.__version__}|threads {torch.get_num_threads()}"
+
+
+def _autotune_cache_path(key: Dict[str, Any]) -> str:
+    digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+    return os.path.join(AUTOTUNE_CACHE_DIR, f'{digest}.json')
+
+
+class TrainingProgressReporter:
+    """
+    控制轮次内进度汇报的节奏：每 every_batches 个批次或每 interval_ms 毫秒汇报一次（任一满足即可，0 表示关闭该条件）。
+    判断是否到期只读取主机时钟，不触发设备同步。
+    """
+
+    def __init__(self, every_batches: int = 0, interval_ms: float = 1000):
+        self.every_batches = max(0, int(every_batches or 0))
+        self.interval_s = max(0.0, float(interval_ms or 0)) / 1000.0
+        self._last_time = time.perf_counter()
+        self._last_batch = 0
+        self._last_samples = 0
+
+    def start_epoch(self):
+        self._last_time = time.perf_counter()
+        self._last_batch = 0
+        self._last_samples = 0
+
+    def is_due(self, batch_index: int) -> bool:
+        if self.every_batches and batch_index - self._last_batch >= self.every_batches:
+            return True
+        return bool(self.interval_s) and time.perf_counter() - self._last_time >= self.interval_s
+
+    def report(self, epoch: int, batch_index: int, total_batches: int, loss_sum: float, correct: int,
+               samples: int) -> Dict[str, Any]:
+        now = time.perf_counter()
+        elapsed = max(now - self._last_time, 1e-9)
+        samples_per_sec = (samples - self._last_samples) / elapsed
+        self._last_time, self._last_batch, self._last_samples = now, batch_index, samples
+        return {
+            'epoch': epoch,
+            'batch': batch_index,
+            'totalBatches': total_batches,
+            'loss': loss_sum / max(samples, 1),
+            'accuracy': correct / max(samples, 1) * 100,
+            'samplesPerSec': round(samples_per_sec, 1),
+        }
+
+
+class PhaseProfiler:
+    """
+    可选的分阶段计时器：记录 data / forward / backward / optimizer / visualize / emit 各阶段的墙钟耗时直方图。
+    未启用时 phase() 返回共享的空上下文，不产生计时开销；启用且在 CUDA 上时，每个阶段结束前同步设备以得到真实耗时。
+    """
+    # 直方图桶上界（毫秒），最后一个桶收集所有更大的值
+    BUCKET_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, float('inf'))
+    _NULL_CONTEXT = contextlib.nullcontext()
+
+    def __init__(self, enabled: bool = False, device: str = 'cpu'):
+        self.enabled = enabled
+        self._sync_cuda = enabled and device == 'cuda'
+        self._phases: Dict[str, Dict[str, Any]] = {}
+        self._data_start = time.perf_counter()
+
+    def start_epoch(self):
+        self._phases = {}
+        self._data_start = time.perf_counter()
+
+    def mark_data_start(self):
+        """标记一个训练步结束；到下一次 phase('data') 结束之间的时间（取批次 + 拷贝到设备）计入 data 阶段。"""
+        if self.enabled:
+            self._data_start = time.perf_counter()
+
+    def record(self, name: str, elapsed_ms: float):
+        stats = self._phases.get(name)
+        if stats is None:
+            stats = self._phases[name] = {'count': 0, 'totalMs': 0.0, 'maxMs': 0.0,
+                                          'histogram': [0] * len(self.BUCKET_BOUNDS_MS)}
+        stats['count'] += 1
+        stats['totalMs'] += elapsed_ms
+        stats['maxMs'] = max(stats['maxMs'], elapsed_ms)
+        stats['histogram'][bisect.bisect_left(self.BUCKET_BOUNDS_MS, elapsed_ms)] += 1
+
+    def phase(self, name: str):
+        if not self.enabled:
+            return self._NULL_CONTEXT
+        return self._timed_phase(name)
+
+    @contextlib.contextmanager
+    def _timed_phase(self, name: str):
+        start = self._data_start if name == 'data' else time.perf_counter()
+        try:
+            yield
+        finally:
+            if self._sync_cuda:
+                torch.cuda.synchronize()
+            self.record(name, (time.perf_counter() - start) * 1000)
+
+    def epoch_summary(self) -> Dict[str, Any]:
+        total_ms = sum(stats['totalMs'] for stats in self._phases.values()) or 1e-9
+        return {
+            'bucketBoundsMs': [b for b in self.BUCKET_BOUNDS_MS if b != float('inf')],
+            'phases': {
+                name: {
+                    'count': stats['count'],
+                    'totalMs': round(stats['totalMs'], 3),
+                    'meanMs': round(stats['totalMs'] / stats['count'], 3),
+                    'maxMs': round(stats['maxMs'], 3),
+                    'share': round(stats['totalMs'] / total_ms, 4),
+                    'histogram': list(stats['histogram']),
+                } for name, stats in self._phases.items()
+            },
+        }
+
+
+class AsyncEvaluator:
+    """
+    在训练进程内的后台线程中评估每个 epoch 的权重快照（MNIST 测试集，inference_mode，大批次）。
+    训练线程只负责复制一次 state_dict，随即进入下一个 epoch；评估结果一就绪就通过 emit 发送。
+    单线程执行器保证各 epoch 的结果按顺序产出，且同一时刻只有一份评估模型。
+    每次评估期间 intra-op 线程数单独限制为 num_threads，不与训练线程争抢整个核心预算，评估结束后恢复；
+    finish() 阻塞等待最后一个 epoch 评估的时间记在 wait_ms 中，随训练完成消息汇报。
+    """
+
+    def __init__(self, config: Dict[str, Any], arch_hash: str, device: str, emit, batch_size: int = EVAL_BATCH_SIZE,
+                 num_threads: int = EVAL_NUM_THREADS):
+        self.config = config
+        self.arch_hash = arch_hash
+        self.device = device
+        self.emit = emit
+        self.batch_size = batch_size
+        self.num_threads = max(1, num_threads)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='eval')
+        self._model: Optional[nn.Module] = None
+        self._futures: List = []
+        self.wait_ms = 0.0
+
+    def submit(self, epoch: int, model: nn.Module):
+        snapshot = {k: v.detach().clone() for k, v in model.state_dict().items()}
+        self._futures.append(self._executor.submit(self._evaluate, epoch, snapshot))
+
+    def _evaluate(self, epoch: int, snapshot: Dict[str, torch.Tensor]) -> Optional[Dict[str, Any]]:
+        # set_num_threads 还会改变进程级的默认值（MKL 与之后新建的线程），只在本次评估期间生效，结束后恢复
+        previous_threads = torch.get_num_threads()
+        torch.set_num_threads(self.num_threads)
+        try:
+            eval_start = time.perf_counter()
+            if self._model is None:
+                self._model = build_model_from_template(self.config, self.arch_hash, num_classes=10).to(self.device)
+            self._model.load_state_dict(snapshot)
+            self._model.eval()
+
+            test_images, test_labels = MNISTTensorCache.get_split(train=False)
+            test_loader = MNISTBatchLoader(test_images, test_labels, torch.arange(len(test_labels)), self.batch_size,
+                                           shuffle=False)
+            criterion = nn.CrossEntropyLoss(reduction='sum')
+            loss_sum = torch.zeros((), device=self.device)
+            correct = torch.zeros((), dtype=torch.long, device=self.device)
+            with torch.inference_mode():
+                for inputs, labels in test_loader:
+                    inputs, labels = inputs.to(self.device), labels.to(self.device)
+                    outputs, _ = self._model(inputs)
+                    loss_sum += criterion(outputs, labels)
+                    correct += (outputs.argmax(dim=1) == labels).sum()
+
+            result = {
+                'epoch': epoch,
+                'loss': loss_sum.item() / len(test_labels),
+                'accuracy': correct.item() / len(test_labels) * 100,
+                'evalMs': (time.perf_counter() - eval_start) * 1000,
+            }
+            self.emit({'validation': result,
+                       'status': f"Epoch {epoch} 测试集评估: Loss: {result['loss']:.4f}, Acc: {result['accuracy']:.2f}%"})
+            return result
+        except Exception as e:
+            logging.error(f"测试集评估失败 (epoch {epoch}): {e}", exc_info=True)
+            return None
+        finally:
+            torch.set_num_threads(previous_threads)
+
+    def finish(self) -> Optional[Dict[str, Any]]:
+        """等待所有已提交的评估完成并释放线程，返回最后一个 epoch 的评估结果。"""
+        wait_start = time.perf_counter()
+        results = [future.result() for future in self._futures]
+        self.wait_ms = (time.perf_counter() - wait_start) * 1000
+        self.close()
+        return results[-1] if results else None
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _clone_to_cpu(state: Any) -> Any:
+    """递归复制 state_dict 中的张量到 CPU，得到与训练中继续更新的参数互不影响的快照。"""
+    if isinstance(state, torch.Tensor):
+        return state.detach().to('cpu', copy=True)
+    if isinstance(state, dict):
+        return {k: _clone_to_cpu(v) for k, v in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(_clone_to_cpu(v) for v in state)
+    return state
+
+
+class EpochTotals:
+    """
+    一个 epoch 内累计的损失和 / 正确数 / 样本数。累加器保留在设备上，只在汇报时同步一次，
+    避免每个批次 .item() 造成的流水线停顿。commit() 在每次优化器更新后记下当时的累计值：
+    梯度累积组中途停止时，组内已前向但尚未更新进模型的微批恢复后会重新训练，检查点只能保存 committed()。
+    """
+
+    def __init__(self, device, initial: Optional[Dict[str, float]] = None):
+        self.loss_sum = torch.zeros((), device=device)
+        self.correct = torch.zeros((), dtype=torch.long, device=device)
+        self.samples = 0
+        if initial is not None:
+            self.loss_sum += initial['lossSum']
+            self.correct += int(initial['correct'])
+            self.samples = int(initial['samples'])
+        self._committed = (self.loss_sum.clone(), self.correct.clone(), self.samples)
+
+    def add(self, loss: torch.Tensor, outputs: torch.Tensor, labels: torch.Tensor):
+        self.loss_sum += loss.detach() * labels.size(0)
+        self.correct += (outputs.detach().argmax(dim=1) == labels).sum()
+        self.samples += labels.size(0)
+
+    def commit(self):
+        self._committed = (self.loss_sum.clone(), self.correct.clone(), self.samples)
+
+    def committed(self) -> Dict[str, float]:
+        loss_sum, correct, samples = self._committed
+        return {'lossSum': loss_sum.item(), 'correct': correct.item(), 'samples': samples}
+
+
+class AsyncCheckpointWriter:
+    """
+    训练检查点（模型、优化器、GradScaler、采样器位置与当前 epoch 的累计指标）的异步写入器。
+    训练线程只把状态复制到 CPU，序列化与写盘在后台线程中进行，先写临时文件再原子替换；
+    上一次写入尚未完成时跳过本次周期性检查点，避免快照在内存中堆积，final=True 的检查点（停止时）总会写入。
+    """
+
+    def __init__(self, checkpoint_id: str, config: Dict[str, Any], arch_hash: str, owner: Optional[str] = None):
+        self.checkpoint_id = checkpoint_id
+        self.directory = training_checkpoint_dir(checkpoint_id)
+        self.config = config
+        self.arch_hash = arch_hash
+        # 提交任务的客户端（见 model_artifacts.checkpoint_owner），resume_training 只接受同一客户端的请求
+        self.owner = owner
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='checkpoint')
+        self._future = None
+        self.written = 0
+        self.skipped = 0
+
+    def save(self, state: Dict[str, Any], progress: Dict[str, Any], final: bool = False) -> bool:
+        if self._future is not None and not self._future.done() and not final:
+            self.skipped += 1
+            return False
+        snapshot = _clone_to_cpu(state)
+        self._future = self._executor.submit(self._write, snapshot, progress)
+        return True
+
+    def _write(self, snapshot: Dict[str, Any], progress: Dict[str, Any]):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            checkpoint_path = os.path.join(self.directory, 'checkpoint.pt')
+            torch.save(snapshot, f"{checkpoint_path}.tmp")
+            os.replace(f"{checkpoint_path}.tmp", checkpoint_path)
+            # 元数据在权重之后写入，读到的元数据总是对应一份完整的检查点
+            meta = {'checkpointId': self.checkpoint_id, 'owner': self.owner, 'architectureHash': self.arch_hash,
+                    'config': self.config, **progress, 'updatedAt': time.strftime('%Y-%m-%dT%H:%M:%S')}
+            meta_path = os.path.join(self.directory, 'meta.json')
+            with open(f"{meta_path}.tmp", 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(f"{meta_path}.tmp", meta_path)
+            self.written += 1
+        except Exception as e:
+            logging.error(f"写入训练检查点失败 ({self.checkpoint_id}): {e}", exc_info=True)
+
+    def load(self) -> Dict[str, Any]:
+        return torch.load(os.path.join(self.directory, 'checkpoint.pt'), map_location='cpu')
+
+    def wait(self):
+        if self._future is not None:
+            self._future.result()
+
+    def discard(self):
+        """训练完成后删除检查点目录。"""
+        self.wait()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def close(self):
+        self.wait()
+        self._executor.shutdown(wait=False)
+
+
+class FeatureMapStreamer:
+    """
+    按采样节奏把固定探针图像在所选层上的特征图发送给前端。
+    前向钩子只在采样步临时注册、用完即移除，其余训练步没有额外开销；采样步上对探针图像单独做一次
+    no_grad 前向（eval 模式，不更新 BatchNorm 统计量）。采样间隔同时受步数和最小时间间隔限制。
+    每层最多取 max_channels 个通道，空间尺寸自适应平均池化到不超过 FEATURE_MAP_MAX_SIZE，再按层线性量化为 uint8。
+    """
+
+    def __init__(self, model: nn.Module, device: str, every_steps: int = 0, layer_names: Optional[List[str]] = None,
+                 min_interval_ms: float = 500, max_channels: int = 16):
+        self.every_steps = max(0, int(every_steps or 0))
+        self.min_interval_s = max(0.0, float(min_interval_ms or 0)) / 1000.0
+        self.max_channels = max(1, int(max_channels or 1))
+        self._last_time = float('-inf')
+        self.layers: List[Tuple[str, nn.Module]] = []
+        if not self.every_steps:
+            return
+
+        modules = dict(model.named_modules())
+        if layer_names:
+            missing = [name for name in layer_names if name not in modules]
+            if missing:
+                logging.warning(f"特征图流: 模型中不存在层 {missing}，已忽略")
+            self.layers = [(name, modules[name]) for name in layer_names if name in modules]
+        else:
+            self.layers = [(name, module) for name, module in modules.items()
+                           if isinstance(module, nn.Conv2d)][:FEATURE_MAP_DEFAULT_LAYERS]
+
+        test_images, test_labels = MNISTTensorCache.get_split(train=False)
+        probe = torch.from_numpy(np.array(test_images[FEATURE_MAP_PROBE_INDEX:FEATURE_MAP_PROBE_INDEX + 1]))
+        self.probe = normalize_mnist_batch(probe).to(device)
+        self.probe_label = int(test_labels[FEATURE_MAP_PROBE_INDEX])
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.every_steps and self.layers)
+
+    def is_due(self, step: int) -> bool:
+        return (self.enabled and step % self.every_steps == 0
+                and time.perf_counter() - self._last_time >= self.min_interval_s)
+
+    def _quantize(self, output: torch.Tensor) -> Dict[str, Any]:
+        feature_map = output[0, :self.max_channels].detach().float()
+        channels, height, width = feature_map.shape
+        if height > FEATURE_MAP_MAX_SIZE or width > FEATURE_MAP_MAX_SIZE:
+            feature_map = nn.functional.adaptive_avg_pool2d(
+                feature_map, (min(height, FEATURE_MAP_MAX_SIZE), min(width, FEATURE_MAP_MAX_SIZE)))
+        low, high = feature_map.min().item(), feature_map.max().item()
+        scale = (high - low) / 255.0 if high > low else 1.0
+        quantized = ((feature_map - low) / scale).round_().clamp_(0, 255).to(torch.uint8)
+        return {
+            'totalChannels': output.shape[1],
+            'channels': channels,
+            'sourceHeight': height,
+            'sourceWidth': width,
+            'height': quantized.shape[1],
+            'width': quantized.shape[2],
+            # 反量化: value = min + q * scale
+            'min': low,
+            'scale': scale,
+            'data': quantized.cpu().numpy().tobytes(),
+        }
+
+    def capture(self, model: nn.Module, epoch: int, step: int) -> Dict[str, Any]:
+        captured: Dict[str, Dict[str, Any]] = {}
+
+        def make_hook(name: str):
+            def hook(module, inputs, output):
+                # 在钩子内立即量化，避免后续 inplace 激活改写被引用的输出
+                if isinstance(output, torch.Tensor) and output.dim() == 4:
+                    captured[name] = self._quantize(output)
+            return hook
+
+        handles = [module.register_forward_hook(make_hook(name)) for name, module in self.layers]
+        was_training = model.training
+        try:
+            model.eval()
+            with torch.no_grad():
+                outputs, _ = model(self.probe)
+        finally:
+            for handle in handles:
+                handle.remove()
+            model.train(was_training)
+        self._last_time = time.perf_counter()
+        return {
+            'epoch': epoch,
+            'step': step,
+            'probeIndex': FEATURE_MAP_PROBE_INDEX,
+            'probeLabel': self.probe_label,
+            'prediction': int(outputs.argmax(dim=1).item()),
+            'layers': [{'name': name, **captured[name]} for name, _ in self.layers if name in captured],
+        }
+
+
+class LogitsOnly(nn.Module):
+    """只输出 logits 的包装：导出时丢弃训练可视化用的第一层卷积权重，FX 量化与 TorchScript/ONNX 只看到推理图。"""
+
+    def __init__(self, model: nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.model(x)[0]
+
+
+class ExportedModel(nn.Module):
+    """把导出的 TorchScript 模块包装回 (logits, None) 的模型接口，推理服务可以像使用原模型一样调用。"""
+
+    def __init__(self, module: nn.Module):
+        super().__init__()
+        self.module = module
+
+    def forward(self, x: torch.Tensor):
+        return self.module(x), None
+
+
+def _quantized_engine() -> str:
+    supported = torch.backends.quantized.supported_engines
+    engine = next((name for name in ('x86', 'fbgemm', 'qnnpack') if name in supported), None)
+    if engine is None:
+        raise RuntimeError("当前 PyTorch 构建不支持 int8 量化推理")
+    return engine
+
+
+class ExportSkipped(Exception):
+    """导出变体所需的可选依赖未安装，变体未生成或未测量（报告中记为 skipped，区别于导出失败的 error）。"""
+
+
+class ModelExporter:
+    """
+    训练后的导出阶段：在 CPU 上生成所选的优化变体，并与 float32 基线比较推理延迟（各基准批大小的中位数）、
+    文件大小和测试集精度。static 量化用训练未使用的样本做校准（训练子集覆盖整个训练集时退回训练子集）。
+    在精度下降不超过 max_accuracy_drop 个百分点、且推理服务能直接加载的变体中，
+    选择最大基准批大小下延迟最低的一个作为该模型的服务版本；没有变体满足条件时使用 float32。
+    """
+
+    def __init__(self, model: nn.Module, train_indices: torch.Tensor, variants: List[str],
+                 calibration_samples: int = 512, eval_samples: int = 2000, benchmark_runs: int = 20,
+                 max_accuracy_drop: float = 0.5, emit: Optional[Callable[[Dict[str, Any]], None]] = None):
+        unknown = [v for v in variants if v not in EXPORT_VARIANTS]
+        if unknown:
+            raise ValueError(f"未知的导出变体: {unknown}，可选 {list(EXPORT_VARIANTS)}")
+        self.model = model
+        self.train_indices = train_indices
+        self.variants = list(dict.fromkeys(variants))
+        self.calibration_samples = max(1, int(calibration_samples))
+        self.eval_samples = max(1, int(eval_samples))
+        self.benchmark_runs = max(1, int(benchmark_runs))
+        self.max_accuracy_drop = max(0.0, float(max_accuracy_drop))
+        self.emit = emit or (lambda data: None)
+        self.quantized_engine: Optional[str] = None
+
+    def _calibration_batches(self) -> List[torch.Tensor]:
+        train_images, train_labels = MNISTTensorCache.get_split(train=True)
+        held_out = torch.ones(len(train_labels), dtype=torch.bool)
+        held_out[self.train_indices] = False
+        pool = held_out.nonzero().squeeze(1)
+        if not len(pool):
+            pool = self.train_indices
+        generator = torch.Generator().manual_seed(0)
+        indices = pool[torch.randperm(len(pool), generator=generator)[:self.calibration_samples]].sort().values
+        images = normalize_mnist_batch(torch.from_numpy(train_images[indices.numpy()]))
+        return list(torch.split(images, EXPORT_CALIBRATION_BATCH_SIZE))
+
+    def _measure(self, forward: Callable[[torch.Tensor], torch.Tensor], images: torch.Tensor,
+                 labels: torch.Tensor) -> Dict[str, Any]:
+        latency = {}
+        with torch.inference_mode():
+            for batch_size in EXPORT_BENCHMARK_BATCH_SIZES:
+                batch = images[:batch_size]
+                for _ in range(EXPORT_BENCHMARK_WARMUP):
+                    forward(batch)
+                timings = []
+                for _ in range(self.benchmark_runs):
+                    start = time.perf_counter()
+                    forward(batch)
+                    timings.append(time.perf_counter() - start)
+                latency[str(batch_size)] = round(statistics.median(timings) * 1000, 3)
+            correct = 0
+            for start in range(0, len(labels), EVAL_BATCH_SIZE):
+                outputs = forward(images[start:start + EVAL_BATCH_SIZE])
+                correct += int((outputs.argmax(dim=1) == labels[start:start + EVAL_BATCH_SIZE]).sum())
+        return {'latencyMs': latency, 'accuracy': round(correct / len(labels) * 100, 3)}
+
+    @staticmethod
+    def _save_torchscript(module: nn.Module, example: torch.Tensor, path: str) -> nn.Module:
+        with torch.no_grad():
+            scripted = torch.jit.freeze(torch.jit.trace(module.eval(), example))
+        torch.jit.save(scripted, path)
+        return scripted
+
+    def _build_variant(self, variant: str, reference: nn.Module, example: torch.Tensor, path: str):
+        """生成并保存一个变体，返回其前向函数；缺少可选依赖时抛出 ExportSkipped。"""
+        if variant == 'torchscript':
+            return self._save_torchscript(reference, example, path)
+        if variant == 'dynamic':
+            # 动态量化只作用于全连接层：权重离线量化为 int8，激活在运行时按批量化
+            torch.backends.quantized.engine = self.quantized_engine
+            quantized = torch.ao.quantization.quantize_dynamic(copy.deepcopy(reference), {nn.Linear},
+                                                               dtype=torch.qint8)
+            return self._save_torchscript(quantized, example, path)
+        if variant == 'static':
+            from torch.ao.quantization import get_default_qconfig_mapping
+            from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+            torch.backends.quantized.engine = self.quantized_engine
+            # 先符号追踪并删除无用节点（训练时返回的卷积权重），否则融合后的 Conv+ReLU 上找不到 weight
+            graph_module = torch.fx.symbolic_trace(copy.deepcopy(reference))
+            graph_module.graph.eliminate_dead_code()
+            graph_module.recompile()
+            prepared = prepare_fx(graph_module, get_default_qconfig_mapping(self.quantized_engine), (example,))
+            with torch.inference_mode():
+                for batch in self._calibration_batches():
+                    prepared(batch)
+            return self._save_torchscript(convert_fx(prepared), example, path)
+        # onnx：需要可选依赖 onnx；装有 onnxruntime 时才能测量延迟和精度
+        if importlib.util.find_spec('onnx') is None:
+            raise ExportSkipped("未安装 onnx，未导出 ONNX 模型")
+        torch.onnx.export(reference, (example,), path, input_names=['input'], output_names=['logits'],
+                          dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}}, dynamo=False)
+        if importlib.util.find_spec('onnxruntime') is None:
+            raise ExportSkipped("未安装 onnxruntime，已导出 ONNX 模型但未测量延迟和精度")
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = torch.get_num_threads()
+        session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        return lambda x: torch.from_numpy(session.run(None, {'input': x.numpy()})[0])
+
+    @staticmethod
+    def select_variant(results: List[Dict[str, Any]], reference_bytes: int,
+                       max_accuracy_drop: float) -> Dict[str, Any]:
+        """
+        在 results（第一项为 float32 基线）中补充与基线的比较字段，返回服务版本：满足精度要求的可服务变体中，
+        最大基准批大小下延迟最低的一个；基线本身始终可以作为服务版本。
+        """
+        baseline = results[0]
+        largest = str(EXPORT_BENCHMARK_BATCH_SIZES[-1])
+        for entry in results:
+            entry['servable'] = (entry['variant'] in EXPORT_SERVABLE_VARIANTS
+                                 and 'error' not in entry and 'skipped' not in entry)
+            if 'accuracy' in entry:
+                entry['accuracyDrop'] = round(baseline['accuracy'] - entry['accuracy'], 3)
+                entry['meetsAccuracyTarget'] = entry['accuracyDrop'] <= max_accuracy_drop
+                entry['speedup'] = round(baseline['latencyMs'][largest] / max(entry['latencyMs'][largest], 1e-9), 3)
+            if 'sizeBytes' in entry:
+                entry['sizeRatio'] = round(entry['sizeBytes'] / reference_bytes, 4)
+        candidates = [e for e in results if e['servable'] and e.get('meetsAccuracyTarget')]
+        return min(candidates, key=lambda e: e['latencyMs'][largest], default=baseline)
+
+    def run(self, directory: str) -> Dict[str, Any]:
+        """在模型注册目录 directory 中写入 exports/ 下的产物，返回对比报告（写入模型元数据）。"""
+        export_start = time.perf_counter()
+        os.makedirs(os.path.join(directory, 'exports'), exist_ok=True)
+        if {'dynamic', 'static'} & set(self.variants):
+            self.quantized_engine = _quantized_engine()
+        reference = LogitsOnly(copy.deepcopy(self.model)).to('cpu', memory_format=torch.contiguous_format).float()
+        reference.eval()
+        test_images, test_labels = MNISTTensorCache.get_split(train=False)
+        eval_count = min(self.eval_samples, len(test_labels))
+        images = normalize_mnist_batch(torch.from_numpy(np.array(test_images[:eval_count])))
+        labels = test_labels[:eval_count]
+        example = images[:EXPORT_BENCHMARK_BATCH_SIZES[0]]
+        reference_bytes = os.path.getsize(os.path.join(directory, 'weights.pth'))
+
+        self.emit({'status': '导出: 测量 float32 基线...'})
+        results = [{'variant': 'float32', 'format': 'state_dict', 'file': 'weights.pth',
+                    'sizeBytes': reference_bytes, **self._measure(reference, images, labels)}]
+        for variant in self.variants:
+            self.emit({'status': f'导出: 生成 {variant} 变体...'})
+            file_name = os.path.join('exports', f"{variant}.{'onnx' if variant == 'onnx' else 'pt'}")
+            path = os.path.join(directory, file_name)
+            entry: Dict[str, Any] = {'variant': variant, 'file': file_name,
+                                     'format': 'onnx' if variant == 'onnx' else 'torchscript'}
+            try:
+                forward = self._build_variant(variant, reference, example, path)
+                entry['sizeBytes'] = os.path.getsize(path)
+                entry.update(self._measure(forward, images, labels))
+            except ExportSkipped as e:
+                logging.info(f"跳过导出 {variant}: {e}")
+                entry['skipped'] = str(e)
+                if os.path.exists(path):
+                    entry['sizeBytes'] = os.path.getsize(path)
+            except Exception as e:
+                logging.warning(f"导出 {variant} 失败: {e}")
+                entry['error'] = f"{type(e).__name__}: {e}"
+            results.append(entry)
+
+        return {
+            'variants': results,
+            'selected': self.select_variant(results, reference_bytes, self.max_accuracy_drop)['variant'],
+            'maxAccuracyDrop': self.max_accuracy_drop,
+            'benchmarkBatchSizes': list(EXPORT_BENCHMARK_BATCH_SIZES),
+            'benchmarkThreads': torch.get_num_threads(),
+            'evalSamples': eval_count,
+            'calibrationSamples': self.calibration_samples if 'static' in self.variants else 0,
+            'quantizedEngine': self.quantized_engine,
+            'exportSeconds': round(time.perf_counter() - export_start, 2),
+        }
+
+
+class CNNTrainer:
+    """
+    在训练工作进程中同步执行一次训练任务。
+    所有进度消息通过 progress_queue 回传给主进程，由调度器转发到对应的 Socket.IO 客户端。
+    """
+
+    def __init__(self, job_id: str, client_sid: str, progress_queue):
+        self.job_id = job_id
+        self.sid = client_sid
+        self.progress_queue = progress_queue
+        self.is_training_active = False
+
+    def _stop_requested(self) -> bool:
+        """外部取消（stop_training / 客户端断开）通过共享内存标记传入，最迟在下一个批次开始前生效。"""
+        if self.is_training_active and is_job_cancelled(self.job_id):
+            logging.info(f"[{self.sid}] 训练任务 {self.job_id} 收到取消请求")
+            self.is_training_active = False
+        return not self.is_training_active
+
+    def _emit_update(self, data: Dict[str, Any]):
+        log_data = {k: v for k, v in data.items() if k not in ['modelArchitectureText', 'modelGraphData']}
+        if 'modelArchitectureText' in data:
+            log_data['modelArchitectureText_length'] = len(data['modelArchitectureText'])
+        if 'modelGraphData' in data:
+            log_data['modelGraphData_nodes'] = len(data['modelGraphData'].get('nodes', []))
+            log_data['modelGraphData_edges'] = len(data['modelGraphData'].get('edges', []))
+        logging.debug(f"Queueing update for {self.sid} (job {self.job_id}): {log_data}")
+        # 附带入队时间，主进程据此统计 update 从工作进程到发出的延迟
+        self.progress_queue.put((self.job_id, self.sid, 'update', data, time.time()))
+
+    def _emit_metrics(self, data: Dict[str, Any]):
+        """发给主进程 /metrics 的观测值，不转发给客户端。"""
+        self.progress_queue.put((self.job_id, self.sid, 'metrics', data))
+
+    def _render_kernel_sprite(self, tensor_data: torch.Tensor, image_format: str = 'png') -> Optional[Dict[str, Any]]:
+        """
+        将第一层卷积核一次性归一化并拼接成一张网格图（sprite sheet），只编码一次。
+        图像以二进制附件形式发送，同时附带每个卷积核在网格中的左上角坐标，供前端切片显示。
+        image_format: 'png' | 'webp'（无损）| 'raw'（未编码的 uint8 灰度像素）
+        """
+        if tensor_data is None:
+            return None
+
+        detached_data = tensor_data.detach().float().cpu().numpy()
+
+        if detached_data.ndim == 4:
+            # 多输入通道时只显示第一个通道
+            data_to_visualize = detached_data[:, 0, :, :]
+        elif detached_data.ndim == 3:
+            data_to_visualize = detached_data
+        elif detached_data.ndim == 2:
+            logging.warning("2D tensor detected. Not suitable for kernel visualization.")
+            return None
+        else:
+            logging.warning(f"无法可视化形状为 {detached_data.shape} 的张量。")
+            return None
+
+        count, tile_h, tile_w = data_to_visualize.shape
+        flat = data_to_visualize.reshape(count, -1)
+        mins = flat.min(axis=1, keepdims=True)
+        ranges = flat.max(axis=1, keepdims=True) - mins
+        scale = np.divide(1.0, ranges, out=np.zeros_like(ranges), where=ranges > 1e-9)
+        tiles = ((flat - mins) * scale * 255).astype(np.uint8).reshape(count, tile_h, tile_w)
+
+        cols = int(np.ceil(np.sqrt(count)))
+        rows = int(np.ceil(count / cols))
+        padded = np.zeros((rows * cols, tile_h, tile_w), dtype=np.uint8)
+        padded[:count] = tiles
+        grid = padded.reshape(rows, cols, tile_h, tile_w).transpose(0, 2, 1, 3).reshape(rows * tile_h, cols * tile_w)
+
+        if image_format == 'raw':
+            image_bytes, mime_type = grid.tobytes(), 'application/octet-stream'
+        else:
+            buffered = io.BytesIO()
+            img = Image.fromarray(grid, 'L')
+            try:
+                if image_format == 'webp':
+                    img.save(buffered, format='WEBP', lossless=True)
+                    mime_type = 'image/webp'
+                else:
+                    raise ValueError
+            except (ValueError, OSError, KeyError):
+                image_format = 'png'
+                buffered = io.BytesIO()
+                img.save(buffered, format='PNG', optimize=True)
+                mime_type = 'image/png'
+            image_bytes = buffered.getvalue()
+
+        return {
+            'image': image_bytes,
+            'format': image_format,
+            'mimeType': mime_type,
+            'count': count,
+            'cols': cols,
+            'rows': rows,
+            'tileWidth': tile_w,
+            'tileHeight': tile_h,
+            'width': cols * tile_w,
+            'height': rows * tile_h,
+            'tiles': [[(i % cols) * tile_w, (i // cols) * tile_h] for i in range(count)],
+        }
+
+    def _start_trace_window(self, active_steps: int, device: str) -> Optional[Dict[str, Any]]:
+        """用 torch.profiler 包住一段训练步（跳过 1 步、预热 1 步、记录 active_steps 步），结束后导出 Chrome trace。"""
+        active_steps = int(active_steps or 0)
+        if active_steps <= 0:
+            return None
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if device == 'cuda':
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        os.makedirs(PROFILE_TRACE_DIR, exist_ok=True)
+        trace_path = os.path.join(PROFILE_TRACE_DIR, f"trace_{self.job_id}.json")
+
+        def on_trace_ready(prof):
+            prof.export_chrome_trace(trace_path)
+            logging.info(f"[{self.sid}] Chrome trace 已保存: {trace_path}")
+            self._emit_update({'status': f'性能追踪已保存: {trace_path}', 'profileTrace': trace_path})
+
+        prof = torch.profiler.profile(
+            activities=activities,
+            schedule=torch.profiler.schedule(wait=1, warmup=1, active=active_steps, repeat=1),
+            on_trace_ready=on_trace_ready,
+            record_shapes=True)
+        prof.start()
+        return {'profiler': prof, 'remaining': active_steps + 2}
+
+    def _step_trace_window(self, trace_window: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        trace_window['profiler'].step()
+        trace_window['remaining'] -= 1
+        if trace_window['remaining'] <= 0:
+            # 窗口结束后立即停止 profiler，之后的训练步不再有任何追踪开销
+            trace_window['profiler'].stop()
+            return None
+        return trace_window
+
+    def _finish_trace_window(self, trace_window: Dict[str, Any]):
+        # 训练步数不足以走完窗口时，导出已记录的部分
+        trace_window['profiler'].stop()
+
+    def _measure_execution_speedup(self, model: nn.Module, criterion: nn.Module, train_loader: MNISTBatchLoader,
+                                   device: str, amp_dtype: Optional[torch.dtype], channels_last: bool,
+                                   steps: int = 5) -> Dict[str, Any]:
+        """
+        在同一批数据上分别测量 float32/默认内存格式与所选执行模式的 forward+backward 耗时。
+        测量前后保存并恢复 state_dict（BatchNorm 统计量），不调用 optimizer.step()，不影响训练结果。
+        调用结束时模型已转换为所选的内存格式。
+        """
+        steps = max(1, int(steps))
+        inputs, labels = next(iter(train_loader))
+        inputs, labels = inputs.to(device), labels.to(device)
+        snapshot = {k: v.detach().clone() for k, v in model.state_dict().items()}
+
+        def timed_steps(batch: torch.Tensor, dtype: Optional[torch.dtype]) -> float:
+            for i in range(steps + 2):  # 前两步预热
+                if i == 2:
+                    if device == 'cuda':
+                        torch.cuda.synchronize()
+                    start = time.perf_counter()
+                with torch.autocast(device_type=device, dtype=dtype or torch.float32, enabled=dtype is not None):
+                    outputs, _ = model(batch)
+                    loss = criterion(outputs, labels)
+                loss.backward()
+                model.zero_grad(set_to_none=True)
+            if device == 'cuda':
+                torch.cuda.synchronize()
+            return (time.perf_counter() - start) / steps * 1000
+
+        model.train()
+        fp32_ms = timed_steps(inputs, None)
+        if channels_last:
+            model.to(memory_format=torch.channels_last)
+            inputs = inputs.contiguous(memory_format=torch.channels_last)
+        mode_ms = timed_steps(inputs, amp_dtype)
+        model.load_state_dict(snapshot)
+
+        label_parts = [str(amp_dtype).replace('torch.', '') if amp_dtype is not None else 'float32']
+        if channels_last:
+            label_parts.append('channels_last')
+        result = {
+            'label': ' + '.join(label_parts),
+            'mixedPrecision': str(amp_dtype).replace('torch.', '') if amp_dtype is not None else None,
+            'channelsLast': channels_last,
+            'fp32StepMs': round(fp32_ms, 3),
+            'modeStepMs': round(mode_ms, 3),
+            'speedup': round(fp32_ms / mode_ms, 3) if mode_ms > 0 else None,
+        }
+        logging.info(f"[{self.sid}] 执行模式测量结果: {result}")
+        return result
+
+    def _autotune_batching(self, model: nn.Module, criterion: nn.Module, config: Dict[str, Any], arch_hash: str,
+                           train_images: np.ndarray, train_labels: torch.Tensor, train_indices: torch.Tensor,
+                           device: str, amp_dtype: Optional[torch.dtype], memory_format: torch.memory_format,
+                           steps: int = 3) -> Dict[str, Any]:
+        """
+        在保持有效批大小 (batchSize) 不变的前提下，选择吞吐最高的 微批大小 × 梯度累积步数，以及是否启用后台预取。
+        先在不预取的情况下比较各个微批（估算内存超过 AUTOTUNE_MAX_MEMORY_MB 的候选直接跳过），再为最优微批测量预取。
+        每个候选计时 steps 个有效批次的 forward+backward（optimizer.step() 每个有效批次各执行一次，对所有候选相同，不计入）；
+        测量前后保存并恢复 state_dict。结果按架构哈希、有效批大小、执行模式和机器缓存在磁盘上。
+        """
+        batch_size = config.get('trainingParams', {}).get('batchSize', 128)
+        cache_key = {'archHash': arch_hash, 'batchSize': batch_size, 'device': device,
+                     'amp': str(amp_dtype) if amp_dtype is not None else None,
+                     'channelsLast': memory_format == torch.channels_last, 'machine': _machine_fingerprint(device)}
+        cache_path = _autotune_cache_path(cache_key)
+        try:
+            with open(cache_path, encoding='utf-8') as f:
+                return {**json.load(f), 'cached': True}
+        except (OSError, ValueError):
+            pass
+
+        steps = max(1, int(steps))
+        snapshot = {k: v.detach().clone() for k, v in model.state_dict().items()}
+
+        def samples_per_sec(micro_batch: int, prefetch: int) -> float:
+            accumulation = batch_size // micro_batch
+            loader = MNISTBatchLoader(train_images, train_labels, train_indices, micro_batch, shuffle=True,
+                                      pin_memory=device == 'cuda', prefetch=prefetch)
+            batches = iter(loader)
+            try:
+                for group in range(steps + 1):  # 第一个有效批次用于预热
+                    if group == 1:
+                        if device == 'cuda':
+                            torch.cuda.synchronize()
+                        start = time.perf_counter()
+                    for _ in range(accumulation):
+                        try:
+                            inputs, labels = next(batches)
+                        except StopIteration:
+                            batches = iter(loader)
+                            inputs, labels = next(batches)
+                        inputs = inputs.to(device, non_blocking=True, memory_format=memory_format)
+                        labels = labels.to(device, non_blocking=True)
+                        with torch.autocast(device_type=device, dtype=amp_dtype or torch.float32,
+                                            enabled=amp_dtype is not None):
+                            outputs, _ = model(inputs)
+                            loss = criterion(outputs, labels) / accumulation
+                        loss.backward()
+                    model.zero_grad(set_to_none=True)
+                if device == 'cuda':
+                    torch.cuda.synchronize()
+                return batch_size * steps / (time.perf_counter() - start)
+            finally:
+                batches.close()
+
+        candidates = []
+        model.train()
+        for micro_batch in autotune_micro_batches(batch_size):
+            probe_config = {**config, 'trainingParams': {**config.get('trainingParams', {}), 'batchSize': micro_batch,
+                                                         'autotune': False}}
+            memory_mb = estimate_training_cost(probe_config)['trainingMemoryBytes'] / (1024 * 1024)
+            candidate = {'microBatchSize': micro_batch, 'accumulationSteps': batch_size // micro_batch, 'prefetch': 0,
+                         'estimatedMemoryMb': round(memory_mb, 1)}
+            if memory_mb > AUTOTUNE_MAX_MEMORY_MB:
+                candidate['skipped'] = 'memory'
+            else:
+                try:
+                    candidate['samplesPerSec'] = round(samples_per_sec(micro_batch, 0), 1)
+                except torch.cuda.OutOfMemoryError:
+                    torch.cuda.empty_cache()
+                    candidate['skipped'] = 'oom'
+            candidates.append(candidate)
+
+        measured = [c for c in candidates if 'samplesPerSec' in c]
+        if not measured:
+            model.load_state_dict(snapshot)
+            raise RuntimeError(f"自动调优失败: 没有候选微批能在 {AUTOTUNE_MAX_MEMORY_MB:.0f} MB 内运行")
+        best = max(measured, key=lambda c: c['samplesPerSec'])
+        prefetched = {**best, 'prefetch': AUTOTUNE_PREFETCH,
+                      'samplesPerSec': round(samples_per_sec(best['microBatchSize'], AUTOTUNE_PREFETCH), 1)}
+        candidates.append(prefetched)
+        if prefetched['samplesPerSec'] > best['samplesPerSec']:
+            best = prefetched
+        model.load_state_dict(snapshot)
+
+        result = {'batchSize': batch_size, 'microBatchSize': best['microBatchSize'],
+                  'accumulationSteps': best['accumulationSteps'], 'prefetch': best['prefetch'],
+                  'samplesPerSec': best['samplesPerSec'], 'candidates': candidates,
+                  'machine': cache_key['machine']}
+        os.makedirs(AUTOTUNE_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f)
+        os.replace(tmp_path, cache_path)
+        logging.info(f"[{self.sid}] 自动调优结果: {result}")
+        return {**result, 'cached': False}
+
+    def _compile_model(self, model: nn.Module, compile_mode: str, criterion: nn.Module,
+                       train_loader: MNISTBatchLoader, device: str, amp_dtype: Optional[torch.dtype],
+                       memory_format: torch.memory_format) -> Dict[str, Any]:
+        """
+        用 torch.compile 编译模型，失败时退回 TorchScript trace。
+        编译是惰性的，这里用一个批次执行 forward+backward 触发编译，之后恢复 state_dict，不影响训练结果。
+        """
+        inputs, labels = next(iter(train_loader))
+        inputs = inputs.to(device, memory_format=memory_format)
+        labels = labels.to(device)
+        snapshot = {k: v.detach().clone() for k, v in model.state_dict().items()}
+        model.train()
+        start = time.perf_counter()
+
+        compiled, used_mode = None, compile_mode
+        if compile_mode == 'compile':
+            try:
+                compiled = torch.compile(model)
+                with torch.autocast(device_type=device, dtype=amp_dtype or torch.float32, enabled=amp_dtype is not None):
+                    outputs, _ = compiled(inputs)
+                    loss = criterion(outputs, labels)
+                loss.backward()
+            except Exception as e:
+                logging.warning(f"[{self.sid}] torch.compile 失败，改用 TorchScript trace: {e}")
+                compiled, used_mode = None, 'trace'
+        if compiled is None:
+            compiled = torch.jit.trace(model, inputs, check_trace=False)
+
+        model.zero_grad(set_to_none=True)
+        model.load_state_dict(snapshot)
+        compile_ms = (time.perf_counter() - start) * 1000
+        logging.info(f"[{self.sid}] 模型编译完成 (mode={used_mode})，耗时 {compile_ms:.0f} ms")
+        return {'model': model, 'compiled': compiled, 'mode': used_mode, 'compileMs': round(compile_ms, 1)}
+
+    def _emit_model_analysis(self, model: nn.Module, arch_hash: str) -> bool:
+        """生成并发送模型图结构与文本摘要，摘要生成失败时发送错误并返回 False。"""
+        graph_start = time.perf_counter()
+        model_graph_data = model_to_json_graph(model, input_shape=(1, 28, 28))
+        summary_start = time.perf_counter()
+        model_arch_text = get_model_summary_text(model, input_size=(1, 28, 28))
+        self._emit_metrics({'analysisSeconds': {'graph': summary_start - graph_start,
+                                                'summary': time.perf_counter() - summary_start}})
+
+        if "Error generating model text summary" in model_arch_text:
+            logging.error(f"Failed to generate model text summary. Sending error message to frontend.")
+            self._emit_update({'status': model_arch_text, 'error': True, 'isTrainingComplete': False})
+            return False
+
+        if not model_arch_text.strip():
+            model_arch_text = "无法生成详细模型文本摘要。请确保torchinfo已安装或模型结构有效。"
+            logging.warning("Generated model text summary was empty, sending fallback message.")
+
+        self._emit_update({
+            'modelArchitectureText': model_arch_text,
+            'modelGraphData': model_graph_data,
+            'architectureHash': arch_hash
+        })
+        logging.info(
+            f"Model architecture text (len: {len(model_arch_text)}) and graph data (nodes: {len(model_graph_data.get('nodes', []))}) sent to frontend.")
+        return True
+
+    @staticmethod
+    def _create_optimizer(model: nn.Module, config: Dict[str, Any]) -> optim.Optimizer:
+        optimizer_name = config.get('trainingParams', {}).get('optimizer', 'adam')
+        learning_rate = config.get('trainingParams', {}).get('learningRate', 0.001)
+
+        if optimizer_name == 'adam':
+            return optim.Adam(model.parameters(), lr=learning_rate)
+        elif optimizer_name == 'sgd':
+            return optim.SGD(model.parameters(), lr=learning_rate)
+        else:
+            raise ValueError(f"不支持的优化器: {optimizer_name}")
+
+    def _export_stage(self, model: nn.Module, config: Dict[str, Any], train_indices: torch.Tensor,
+                      emit: Optional[Callable[[Dict[str, Any]], None]] = None
+                      ) -> Optional[Callable[[str], Dict[str, Any]]]:
+        """按 trainingParams.exportVariants 构造注册模型时执行的导出阶段；未请求导出时返回 None。"""
+        params = config.get('trainingParams', {})
+        if not params.get('exportVariants'):
+            return None
+        emit = emit or self._emit_update
+        exporter = ModelExporter(model, train_indices, params['exportVariants'],
+                                 calibration_samples=params.get('exportCalibrationSamples', 512),
+                                 eval_samples=params.get('exportEvalSamples', 2000),
+                                 benchmark_runs=params.get('exportBenchmarkRuns', 20),
+                                 max_accuracy_drop=params.get('exportMaxAccuracyDrop', 0.5), emit=emit)
+
+        def write_exports(directory: str) -> Dict[str, Any]:
+            # 导出失败不影响注册 float32 模型
+            try:
+                report = exporter.run(directory)
+            except Exception as e:
+                logging.error(f"导出阶段失败: {e}", exc_info=True)
+                emit({'status': f'导出失败: {e}'})
+                return {'error': f"{type(e).__name__}: {e}"}
+            selected = next(v for v in report['variants'] if v['variant'] == report['selected'])
+            largest = str(EXPORT_BENCHMARK_BATCH_SIZES[-1])
+            emit({'export': report,
+                  'status': f"导出完成，服务版本: {report['selected']}（批大小 {largest} 延迟 "
+                            f"{selected['latencyMs'][largest]:.1f} ms，精度 {selected['accuracy']:.2f}%）"})
+            return report
+        return write_exports
+
+    def run_training(self, config: Dict[str, Any], arch_hash: str, skip_analysis: bool = False,
+                     submitted_at: Optional[float] = None, checkpoint_id: Optional[str] = None, resume: bool = False,
+                     owner: Optional[str] = None):
+        self.is_training_active = True
+        training_start = time.perf_counter()
+        evaluator: Optional[AsyncEvaluator] = None
+        # 检查点以最初任务的 job_id 命名，恢复后的任务继续写入同一位置
+        checkpoint_id = checkpoint_id or self.job_id
+        checkpointer = AsyncCheckpointWriter(checkpoint_id, config, arch_hash, owner)
+        try:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+            self._emit_update({'status': f'准备数据集... 设备: {device.upper()}'})
+
+            train_images, train_labels = MNISTTensorCache.get_split(train=True)
+
+            subset_size, sampling_strategy = resolve_training_subset(config.get('trainingParams', {}),
+                                                                     len(train_labels))
+            train_indices = MNISTTensorCache.subset_indices(subset_size, sampling_strategy)
+            batch_size = config.get('trainingParams', {}).get('batchSize', 128)
+            # 固定采样顺序的种子，恢复训练时才能跳过已经训练过的批次
+            sampler_seed = int(checkpoint_id, 16) % (2 ** 31)
+            checkpoint = checkpointer.load() if resume else None
+            accumulation_steps, prefetch = 1, 0
+            if checkpoint is not None:
+                # 沿用中断前（可能经过自动调优）的微批大小、梯度累积与预取设置
+                batch_size = checkpoint['progress']['microBatchSize']
+                accumulation_steps = checkpoint['progress']['accumulationSteps']
+                prefetch = checkpoint['progress']['prefetch']
+            train_loader = MNISTBatchLoader(train_images, train_labels, train_indices, batch_size,
+                                            shuffle=True, pin_memory=torch.cuda.is_available(), prefetch=prefetch,
+                                            seed=sampler_seed)
+            self._emit_update({'status': f'训练样本: {subset_size}/{len(train_labels)} ({sampling_strategy})'})
+
+            # --- 执行模式：混合精度 (CPU: bfloat16, CUDA: float16 + GradScaler)、channels_last 内存格式与模型编译 ---
+            use_amp = bool(config.get('trainingParams', {}).get('mixedPrecision', False))
+            channels_last = bool(config.get('trainingParams', {}).get('channelsLast', False))
+            amp_dtype = torch.float16 if device == 'cuda' else torch.bfloat16
+            memory_format = torch.channels_last if channels_last else torch.contiguous_format
+            compile_mode = config.get('trainingParams', {}).get('compileMode', 'none')
+            compile_key = f"{arch_hash}:{compile_mode}:{device}:{int(channels_last)}:{int(use_amp)}"
+
+            build_start = time.perf_counter()
+            compiled_entry = compiled_model_cache.get(compile_key) if compile_mode in ('compile', 'trace') else None
+            if compiled_entry is not None:
+                # 复用已编译的模型实例：原地装入初始权重，参数对象不变，编译产物保持有效
+                model = compiled_entry['model']
+                model.load_state_dict(pristine_state_dict(config, arch_hash))
+            else:
+                model = build_model_from_template(config, arch_hash, num_classes=10).to(device)
+            self._emit_metrics({'modelBuildSeconds': time.perf_counter() - build_start})
+            logging.info(
+                f"Model built successfully. Base architecture: {config.get('modelArchitecture', {}).get('baseArchitecture')}, "
+                f"template cache: {model_template_cache.stats()}")
+
+            # --- 生成模型结构化数据和文本摘要（主进程缓存命中时已直接发送，跳过分析） ---
+            if not skip_analysis and not self._emit_model_analysis(model, arch_hash):
+                return
+
+            criterion = nn.CrossEntropyLoss()
+
+            execution_mode = compiled_entry['executionMode'] if compiled_entry is not None else None
+            if execution_mode is None and (use_amp or channels_last):
+                execution_mode = self._measure_execution_speedup(
+                    model, criterion, train_loader, device, amp_dtype if use_amp else None, channels_last,
+                    steps=config.get('trainingParams', {}).get('executionProbeSteps', 5))
+            if execution_mode is not None:
+                self._emit_update({'executionMode': execution_mode,
+                                   'status': f"执行模式: {execution_mode['label']}，相对 float32 加速 "
+                                             f"{execution_mode['speedup']:.2f}x"})
+            scaler = torch.amp.GradScaler('cuda', enabled=use_amp and device == 'cuda')
+
+            # --- 可选的批大小/加载器自动调优：保持有效批大小，用梯度累积换取更高吞吐或更低内存 ---
+            if config.get('trainingParams', {}).get('autotune', False) and checkpoint is None:
+                self._emit_update({'status': '正在自动调优批大小与数据加载...'})
+                autotune = self._autotune_batching(
+                    model, criterion, config, arch_hash, train_images, train_labels, train_indices, device,
+                    amp_dtype if use_amp else None, memory_format,
+                    steps=config.get('trainingParams', {}).get('autotuneProbeSteps', 3))
+                accumulation_steps = autotune['accumulationSteps']
+                train_loader = MNISTBatchLoader(train_images, train_labels, train_indices, autotune['microBatchSize'],
+                                                shuffle=True, pin_memory=torch.cuda.is_available(),
+                                                prefetch=autotune['prefetch'], seed=sampler_seed)
+                self._emit_update({'autotune': autotune,
+                                   'status': f"自动调优{'（缓存）' if autotune['cached'] else ''}: "
+                                             f"微批 {autotune['microBatchSize']} × 累积 {accumulation_steps}，"
+                                             f"预取 {autotune['prefetch']}，{autotune['samplesPerSec']:.0f} 样本/秒"})
+
+            train_model = model
+            if compile_mode in ('compile', 'trace'):
+                cached = compiled_entry is not None
+                if not cached:
+                    self._emit_update({'status': f'正在编译模型 ({compile_mode})，首次编译可能需要较长时间...'})
+                    compiled_entry = self._compile_model(model, compile_mode, criterion, train_loader, device,
+                                                         amp_dtype if use_amp else None, memory_format)
+                    compiled_entry['executionMode'] = execution_mode
+                    compiled_model_cache.put(compile_key, compiled_entry)
+                train_model = compiled_entry['compiled']
+                self._emit_update({'compileMode': {'requested': compile_mode, 'used': compiled_entry['mode'],
+                                                   'cached': cached, 'compileMs': compiled_entry['compileMs'],
+                                                   'cacheStats': compiled_model_cache.stats()}})
+
+            optimizer = self._create_optimizer(model, config)
+
+            epochs = config.get('trainingParams', {}).get('epochs', 5)
+            kernel_image_format = config.get('trainingParams', {}).get('kernelImageFormat', 'png')
+
+            # --- 检查点：每隔 checkpointIntervalSec 秒（在优化器更新之后）和每个 epoch 结束时异步写入 ---
+            checkpoint_interval_s = float(config.get('trainingParams', {}).get('checkpointIntervalSec', 30) or 0)
+            # 下一次开始训练的位置 (epoch, 批次)，以及该 epoch 内已累计的损失/正确数/样本数
+            resume_point: Tuple[int, int] = (0, 0)
+            last_epoch_metrics: Optional[Dict[str, float]] = None
+            epoch_totals: Optional[Dict[str, float]] = None
+            if checkpoint is not None:
+                model.load_state_dict(checkpoint['model'])
+                optimizer.load_state_dict(checkpoint['optimizer'])
+                scaler.load_state_dict(checkpoint['scaler'])
+                resume_point = (checkpoint['progress']['epoch'], checkpoint['progress']['batch'])
+                last_epoch_metrics = checkpoint['progress'].get('lastEpoch')
+                epoch_totals = checkpoint.get('epochTotals')
+                self._emit_update({'status': f'已从检查点恢复: epoch {resume_point[0] + 1}，'
+                                             f'第 {resume_point[1]}/{len(train_loader)} 个批次',
+                                   'checkpoint': {'checkpointId': checkpoint_id, 'epoch': resume_point[0],
+                                                  'batch': resume_point[1], 'resumed': True}})
+            start_epoch, start_batch = resume_point
+
+            def save_checkpoint(final: bool = False, buffers: Optional[Dict[str, torch.Tensor]] = None) -> bool:
+                progress = {'epoch': resume_point[0], 'batch': resume_point[1], 'epochs': epochs,
+                            'totalBatches': len(train_loader), 'microBatchSize': train_loader.sampler.batch_size,
+                            'accumulationSteps': accumulation_steps, 'prefetch': train_loader.prefetch,
+                            'lastEpoch': last_epoch_metrics}
+                model_state = model.state_dict()
+                if buffers is not None:
+                    model_state.update((name, value) for name, value in buffers.items() if name in model_state)
+                state = {'model': model_state, 'optimizer': optimizer.state_dict(),
+                         'scaler': scaler.state_dict(), 'epochTotals': epoch_totals, 'progress': progress}
+                saved = checkpointer.save(state, progress, final=final)
+                if saved:
+                    self._emit_update({'checkpoint': {'checkpointId': checkpoint_id, 'epoch': resume_point[0],
+                                                      'batch': resume_point[1], 'skipped': checkpointer.skipped}})
+                return saved
+
+            last_checkpoint_time = time.perf_counter()
+            totals: Optional[EpochTotals] = None
+            # 梯度累积组内每个微批的前向都会更新 BatchNorm 运行统计量：保留最近一次优化器更新时的缓冲区，
+            # 停止在组中间时检查点用它们代替，恢复后重新训练的微批不会被统计两次
+            committed_buffers: Optional[Dict[str, torch.Tensor]] = None
+            if accumulation_steps > 1:
+                committed_buffers = {name: buf.detach().clone() for name, buf in model.named_buffers()}
+            # 训练步耗时（相邻两个批次结束的间隔，含取数据）先在本地累计，随进度汇报批量发回主进程
+            step_latency = Histogram(STEP_SECONDS_BUCKETS)
+
+            progress_reporter = TrainingProgressReporter(
+                every_batches=config.get('trainingParams', {}).get('reportEveryBatches', 0),
+                interval_ms=config.get('trainingParams', {}).get('reportIntervalMs', 1000))
+            profiler = PhaseProfiler(enabled=bool(config.get('trainingParams', {}).get('profile', False)),
+                                     device=device)
+            trace_window = self._start_trace_window(config.get('trainingParams', {}).get('profileTraceSteps', 0),
+                                                    device) if profiler.enabled else None
+            if config.get('trainingParams', {}).get('validateEachEpoch', True):
+                evaluator = AsyncEvaluator(config, arch_hash, device, self._emit_update)
+            feature_maps = FeatureMapStreamer(
+                model, device,
+                every_steps=config.get('trainingParams', {}).get('featureMapEverySteps', 0),
+                layer_names=config.get('trainingParams', {}).get('featureMapLayers'),
+                min_interval_ms=config.get('trainingParams', {}).get('featureMapIntervalMs', 500),
+                max_channels=config.get('trainingParams', {}).get('featureMapMaxChannels', 16))
+
+            for epoch in range(start_epoch, epochs):
+                if self._stop_requested():
+                    logging.info(f"[{self.sid}] 训练被中断.")
+                    break
+
+                first_batch = start_batch if epoch == start_epoch else 0
+                train_loader.set_epoch(epoch, first_batch)
+                model.train()
+                totals = EpochTotals(device, epoch_totals if first_batch else None)
+                progress_reporter.start_epoch()
+                profiler.start_epoch()
+                step_end = time.perf_counter()
+
+                for i, (inputs, labels) in enumerate(train_loader, start=first_batch):
+                    if self._stop_requested():
+                        break
+                    with profiler.phase('data'):
+                        inputs = inputs.to(device, non_blocking=True, memory_format=memory_format)
+                        labels = labels.to(device, non_blocking=True)
+
+                    # 梯度累积：每 accumulation_steps 个微批执行一次优化器更新（轮次末尾不足一组时也会更新）
+                    group_start = i % accumulation_steps == 0
+                    group_end = (i + 1) % accumulation_steps == 0 or i + 1 == len(train_loader)
+                    with profiler.phase('forward'):
+                        if group_start:
+                            optimizer.zero_grad()
+                        with torch.autocast(device_type=device, dtype=amp_dtype, enabled=use_amp):
+                            outputs, first_conv_weights = train_model(inputs)
+                            loss = criterion(outputs, labels)
+                    with profiler.phase('backward'):
+                        scaler.scale(loss / accumulation_steps if accumulation_steps > 1 else loss).backward()
+                    if group_end:
+                        with profiler.phase('optimizer'):
+                            scaler.step(optimizer)
+                            scaler.update()
+
+                    totals.add(loss, outputs, labels)
+
+                    if group_end:
+                        resume_point = (epoch, i + 1)
+                        totals.commit()
+                        epoch_totals = None
+                        if committed_buffers is not None:
+                            committed_buffers = {name: buf.detach().clone() for name, buf in model.named_buffers()}
+                        if checkpoint_interval_s and time.perf_counter() - last_checkpoint_time >= checkpoint_interval_s:
+                            with profiler.phase('checkpoint'):
+                                epoch_totals = totals.committed()
+                                save_checkpoint()
+                            last_checkpoint_time = time.perf_counter()
+
+                    if submitted_at is not None:
+                        # 从提交任务 (主进程 time.time()) 到完成第一个训练步的耗时，只汇报一次
+                        self._emit_update({'firstStepMs': (time.time() - submitted_at) * 1000})
+                        submitted_at = None
+
+                    step_start, step_end = step_end, time.perf_counter()
+                    step_latency.observe(step_end - step_start)
+
+                    if progress_reporter.is_due(i + 1):
+                        with profiler.phase('emit'):
+                            self._emit_update({'progress': progress_reporter.report(
+                                epoch + 1, i + 1, len(train_loader), totals.loss_sum.item(), totals.correct.item(),
+                                totals.samples)})
+                            self._emit_metrics({'stepSeconds': step_latency.drain()})
+
+                    global_step = epoch * len(train_loader) + i + 1
+                    if feature_maps.is_due(global_step):
+                        with profiler.phase('featureMaps'):
+                            self._emit_update({'featureMaps': feature_maps.capture(model, epoch + 1, global_step)})
+
+                    if trace_window is not None:
+                        trace_window = self._step_trace_window(trace_window)
+                    profiler.mark_data_start()
+
+                steps = step_latency.drain()
+                if steps is not None:
+                    self._emit_metrics({'stepSeconds': steps})
+                if not self.is_training_active:
+                    break
+
+                epoch_loss = totals.loss_sum.item() / totals.samples
+                epoch_accuracy = (totals.correct.item() / totals.samples) * 100
+                last_epoch_metrics = {'loss': epoch_loss, 'accuracy': epoch_accuracy}
+
+                with profiler.phase('visualize'):
+                    kernel_sprite = self._render_kernel_sprite(first_conv_weights, kernel_image_format)
+
+                update_data = {
+                    'epoch': epoch + 1,
+                    'loss': epoch_loss,
+                    'accuracy': epoch_accuracy,
+                    'kernelSprite': kernel_sprite,
+                    'status': f'Epoch {epoch + 1}/{epochs} 完成. Loss: {epoch_loss:.4f}, Acc: {epoch_accuracy:.2f}%'
+                }
+                if profiler.enabled:
+                    update_data['timing'] = profiler.epoch_summary()
+                with profiler.phase('emit'):
+                    self._emit_update(update_data)
+                if evaluator is not None:
+                    with profiler.phase('snapshot'):
+                        evaluator.submit(epoch + 1, model)
+                resume_point, epoch_totals = (epoch + 1, 0), None
+                if checkpoint_interval_s and epoch + 1 < epochs:
+                    with profiler.phase('checkpoint'):
+                        save_checkpoint()
+                    last_checkpoint_time = time.perf_counter()
+
+            if trace_window is not None:
+                self._finish_trace_window(trace_window)
+
+            if self.is_training_active:
+                metrics = dict(last_epoch_metrics or {})
+                validation = evaluator.finish() if evaluator is not None else None
+                if validation is not None:
+                    metrics.update({'testLoss': validation['loss'], 'testAccuracy': validation['accuracy']})
+                model_id = model_registry.register(model, config, arch_hash, metrics,
+                                                   time.perf_counter() - training_start, self.job_id,
+                                                   write_exports=self._export_stage(model, config, train_indices))
+                checkpointer.discard()
+                self._emit_update({'status': '训练完成!', 'isTrainingComplete': True, 'modelId': model_id,
+                                   'validationWaitMs': evaluator.wait_ms if evaluator is not None else 0.0})
+            else:
+                # 停止时在最近一次优化器更新的位置写入检查点并等待写完，之后即可通过 resume_training 继续；
+                # epoch 累计值和 BatchNorm 统计量取同一位置的快照，不含梯度累积组内尚未更新进模型的微批
+                if resume_point == (0, 0):
+                    # 还没有完成任何优化器更新，检查点与重新开始训练等价，不保存
+                    checkpointer.discard()
+                    self._emit_update({'status': '训练已停止，尚未完成任何训练步，未保存检查点。',
+                                       'isTrainingComplete': False, 'cancelled': True})
+                else:
+                    if resume_point[1] > 0 and totals is not None:
+                        epoch_totals = totals.committed()
+                    save_checkpoint(final=True, buffers=committed_buffers)
+                    checkpointer.wait()
+                    self._emit_update({'status': '训练已停止，已保存检查点，可通过 resume_training 继续。',
+                                       'isTrainingComplete': False, 'cancelled': True,
+                                       'checkpointId': checkpoint_id})
+
+        except Exception as e:
+            logging.error(f"训练过程中发生错误: {e}", exc_info=True)
+            update = {'status': f'错误: {e}', 'error': True, 'isTrainingComplete': False}
+            checkpointer.wait()
+            if os.path.exists(os.path.join(checkpointer.directory, 'checkpoint.pt')):
+                update['checkpointId'] = checkpoint_id
+            self._emit_update(update)
+        finally:
+            if evaluator is not None:
+                evaluator.close()
+            checkpointer.close()
+            self.is_training_active = False
+
+    def run_data_parallel_rank(self, config: Dict[str, Any], arch_hash: str, skip_analysis: bool, rank: int,
+                               world_size: int, seed: int):
+        """
+        数据并行训练中单个进程 (rank) 的训练循环：DistributedDataParallel + gloo，仅支持 CPU。
+        每个 rank 处理 MNIST 子集的一个分片，梯度在反向传播中全归约；汇报时对损失/正确数/样本数做一次 all_reduce，
+        只有 rank 0 负责发送进度、卷积核可视化和模型分析结果。
+        """
+        import torch.distributed as dist
+        from torch.nn.parallel import DistributedDataParallel
+
+        is_main = rank == 0
+        self.is_training_active = True
+        training_start = time.perf_counter()
+        emit = self._emit_update if is_main else (lambda data: None)
+
+        train_images, train_labels = MNISTTensorCache.get_split(train=True)
+        subset_size, sampling_strategy = resolve_training_subset(config.get('trainingParams', {}), len(train_labels))
+        train_indices = MNISTTensorCache.subset_indices(subset_size, sampling_strategy)
+        # batchSize 仍表示全局批大小，按进程数均分
+        batch_size = max(1, config.get('trainingParams', {}).get('batchSize', 128) // world_size)
+        train_loader = MNISTBatchLoader(train_images, train_labels, train_indices, batch_size,
+                                        shuffle=True, num_replicas=world_size, rank=rank, seed=seed)
+        emit({'status': f'数据并行训练: {world_size} 个进程 (gloo)，每进程 {torch.get_num_threads()} 个线程，'
+                        f'每进程批大小 {batch_size}'})
+
+        model = build_model_from_template(config, arch_hash, num_classes=10)
+        if is_main and not skip_analysis and not self._emit_model_analysis(model, arch_hash):
+            # 其余 rank 会在第一次集合通信时因 rank 0 退出而失败，由启动方统一处理
+            raise RuntimeError("Model analysis failed on rank 0")
+
+        use_amp = bool(config.get('trainingParams', {}).get('mixedPrecision', False))
+        memory_format = torch.channels_last if config.get('trainingParams', {}).get('channelsLast') \
+            else torch.contiguous_format
+        model = model.to(memory_format=memory_format)
+        ddp_model = DistributedDataParallel(model)
+        criterion = nn.CrossEntropyLoss()
+        optimizer = self._create_optimizer(model, config)
+
+        epochs = config.get('trainingParams', {}).get('epochs', 5)
+        kernel_image_format = config.get('trainingParams', {}).get('kernelImageFormat', 'png')
+        # 各 rank 必须在相同的步数上参与 all_reduce，因此只按批次数汇报
+        report_every = config.get('trainingParams', {}).get('reportEveryBatches', 0) or max(1, len(train_loader) // 10)
+        progress_reporter = TrainingProgressReporter(every_batches=report_every, interval_ms=0)
+
+        def global_totals(loss_sum: torch.Tensor, correct: torch.Tensor, samples: int) -> Tuple[float, int, int]:
+            totals = torch.stack([loss_sum.detach().double(), correct.double(),
+                                  torch.tensor(samples, dtype=torch.float64)])
+            dist.all_reduce(totals)
+            return totals[0].item(), int(totals[1].item()), int(totals[2].item())
+
+        evaluator = None
+        if is_main and config.get('trainingParams', {}).get('validateEachEpoch', True):
+            evaluator = AsyncEvaluator(config, arch_hash, 'cpu', emit)
+
+        stopped = False
+        for epoch in range(epochs):
+            ddp_model.train()
+            train_loader.set_epoch(epoch)
+            running_loss = torch.zeros(())
+            correct_predictions = torch.zeros((), dtype=torch.long)
+            total_samples = 0
+            progress_reporter.start_epoch()
+
+            for i, (inputs, labels) in enumerate(train_loader):
+                # 各 rank 必须在同一批次停止，否则其余 rank 会阻塞在梯度全归约上
+                stop_flag = torch.tensor(float(self._stop_requested()))
+                dist.all_reduce(stop_flag, op=dist.ReduceOp.MAX)
+                if stop_flag.item():
+                    stopped = True
+                    break
+                inputs = inputs.contiguous(memory_format=memory_format)
+                optimizer.zero_grad()
+                with torch.autocast(device_type='cpu', dtype=torch.bfloat16, enabled=use_amp):
+                    outputs, first_conv_weights = ddp_model(inputs)
+                    loss = criterion(outputs, labels)
+                loss.backward()
+                optimizer.step()
+
+                running_loss += loss.detach() * inputs.size(0)
+                total_samples += labels.size(0)
+                correct_predictions += (outputs.detach().argmax(dim=1) == labels).sum()
+
+                if progress_reporter.is_due(i + 1):
+                    loss_sum, correct, samples = global_totals(running_loss, correct_predictions, total_samples)
+                    emit({'progress': progress_reporter.report(epoch + 1, i + 1, len(train_loader), loss_sum,
+                                                               correct, samples)})
+
+            if stopped:
+                break
+            loss_sum, correct, samples = global_totals(running_loss, correct_predictions, total_samples)
+            epoch_loss = loss_sum / samples
+            epoch_accuracy = correct / samples * 100
+            if is_main:
+                emit({
+                    'epoch': epoch + 1,
+                    'loss': epoch_loss,
+                    'accuracy': epoch_accuracy,
+                    'kernelSprite': self._render_kernel_sprite(first_conv_weights, kernel_image_format),
+                    'status': f'Epoch {epoch + 1}/{epochs} 完成. Loss: {epoch_loss:.4f}, Acc: {epoch_accuracy:.2f}%'
+                })
+                if evaluator is not None:
+                    evaluator.submit(epoch + 1, model)
+
+        if is_main and stopped:
+            if evaluator is not None:
+                evaluator.close()
+            emit({'status': '训练已停止。', 'isTrainingComplete': False, 'cancelled': True})
+        elif is_main:
+            metrics = {'loss': epoch_loss, 'accuracy': epoch_accuracy}
+            validation = evaluator.finish() if evaluator is not None else None
+            if validation is not None:
+                metrics.update({'testLoss': validation['loss'], 'testAccuracy': validation['accuracy']})
+            model_id = model_registry.register(model, config, arch_hash, metrics,
+                                               time.perf_counter() - training_start, self.job_id,
+                                               write_exports=self._export_stage(model, config, train_indices, emit))
+            emit({'status': '训练完成!', 'isTrainingComplete': True, 'modelId': model_id,
+                  'validationWaitMs': evaluator.wait_ms if evaluator is not None else 0.0})
+        self.is_training_active = False
+
+    def run_trial_segment(self, config: Dict[str, Any], arch_hash: str, start_epoch: int, end_epoch: int,
+                          checkpoint_path: str) -> Dict[str, Any]:
+        """
+        超参数搜索中的一段试验训练：从检查点恢复 (start_epoch > 0 时)，训练到 end_epoch，在验证集上评估后写回检查点。
+        不发送逐批进度，结果由调用方汇总进排行榜。
+        """
+        segment_start = time.perf_counter()
+        train_images, train_labels = MNISTTensorCache.get_split(train=True)
+        # 验证集取训练集末尾的固定切片，训练子集只从其余样本中抽取
+        pool_size = len(train_labels) - SWEEP_VALIDATION_SIZE
+        subset_size, sampling_strategy = resolve_training_subset(config.get('trainingParams', {}), pool_size)
+        batch_size = config.get('trainingParams', {}).get('batchSize', 128)
+        train_loader = MNISTBatchLoader(train_images, train_labels,
+                                        MNISTTensorCache.subset_indices(subset_size, sampling_strategy, pool_size),
+                                        batch_size, shuffle=True)
+        validation_indices = torch.arange(len(train_labels) - SWEEP_VALIDATION_SIZE, len(train_labels))
+        validation_loader = MNISTBatchLoader(train_images, train_labels, validation_indices, 1024, shuffle=False)
+
+        model = build_model_from_template(config, arch_hash, num_classes=10)
+        optimizer = self._create_optimizer(model, config)
+        if start_epoch > 0:
+            checkpoint = torch.load(checkpoint_path)
+            model.load_state_dict(checkpoint['model'])
+            optimizer.load_state_dict(checkpoint['optimizer'])
+        criterion = nn.CrossEntropyLoss()
+
+        train_loss = torch.zeros(())
+        train_samples = 0
+        for epoch in range(start_epoch, end_epoch):
+            model.train()
+            train_loss = torch.zeros(())
+            train_samples = 0
+            for inputs, labels in train_loader:
+                if is_job_cancelled(self.job_id):
+                    raise RuntimeError(f"试验任务 {self.job_id} 已取消")
+                optimizer.zero_grad()
+                outputs, _ = model(inputs)
+                loss = criterion(outputs, labels)
+                loss.backward()
+                optimizer.step()
+                train_loss += loss.detach() * inputs.size(0)
+                train_samples += labels.size(0)
+
+        model.eval()
+        validation_loss = torch.zeros(())
+        validation_correct = torch.zeros((), dtype=torch.long)
+        with torch.inference_mode():
+            for inputs, labels in validation_loader:
+                outputs, _ = model(inputs)
+                validation_loss += criterion(outputs, labels) * inputs.size(0)
+                validation_correct += (outputs.argmax(dim=1) == labels).sum()
+
+        torch.save({'model': model.state_dict(), 'optimizer': optimizer.state_dict(), 'epoch': end_epoch},
+                   checkpoint_path)
+        return {
+            'epochs': end_epoch,
+            'trainLoss': train_loss.item() / max(1, train_samples),
+            'valLoss': validation_loss.item() / len(validation_indices),
+            'valAccuracy': validation_correct.item() / len(validation_indices) * 100,
+            'segmentSeconds': time.perf_counter() - segment_start,
+        }
+
+
+# --- 4. 工作进程入口 ---
+# 由 Web 服务主进程的进程池按函数名调用，只有工作进程需要导入本模块。
+DATA_PARALLEL_MAX_WORKERS = int(os.environ.get('DATA_PARALLEL_MAX_WORKERS', os.cpu_count() or 1))
+
+# 预热时构建的架构，取值为 DEFAULT_ARCHITECTURE_CONFIGS 的键
+WORKER_WARMUP_ARCHITECTURES = [a for a in os.environ.get(
+    'WORKER_WARMUP_ARCHITECTURES', 'CustomCNN,ResNet18,DenseNet121,SENet').split(',') if a]
+
+# 与前端默认值保持一致的架构配置，用于工作进程预热和基准测试
+DEFAULT_ARCHITECTURE_CONFIGS: Dict[str, Dict[str, Any]] = {
+    'CustomCNN': {'modelArchitecture': {
+        'baseArchitecture': 'CustomCNN',
+        'customLayers': [
+            {'kernelSize': 3, 'numFilters': 16, 'stride': 1, 'padding': 1, 'activation': 'ReLU', 'batchNorm': True},
+            {'kernelSize': 3, 'numFilters': 32, 'stride': 1, 'padding': 1, 'activation': 'ReLU', 'batchNorm': True},
+        ],
+        'fcLayer': {'numNeurons': 128}}},
+    'ResNet18': {'modelArchitecture': {'baseArchitecture': 'ResNet18', 'fcLayer': {'numNeurons': 128}}},
+    'DenseNet121': {'modelArchitecture': {'baseArchitecture': 'DenseNet121', 'fcLayer': {'numNeurons': 128}}},
+    'SENet': {'modelArchitecture': {'baseArchitecture': 'SENet', 'fcLayer': {'numNeurons': 128},
+                                    'senetConfig': {'reduction': 8}}},
+}
+
+# 工作进程内的进度队列与取消标记（主进程写入被取消任务 job_id 的共享内存环形缓冲区），由进程池 initializer 注入
+_worker_progress_queue = None
+_worker_cancel_flags = None
+_worker_warmup_seconds: Optional[float] = None
+# 当前任务分配到的核心及是否绑核，由 apply_core_budget 在每个任务开始前设置
+_worker_cores: Optional[List[int]] = None
+_worker_cores_pinned = False
+# 工作进程启动时继承的 CPU 亲和性，不绑核的任务恢复到这一集合
+_WORKER_DEFAULT_AFFINITY = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else None
+
+
+def warm_up_worker():
+    """
+    在工作进程空闲时完成首个训练请求原本要付出的初始化：打开 MNIST 训练/测试集缓存，
+    为常用架构构建初始权重模板，并各跑一次前向以完成算子库的初始化。
+    """
+    start = time.perf_counter()
+    MNISTTensorCache.get_split(train=True)
+    MNISTTensorCache.get_split(train=False)
+    sample = torch.zeros(2, 1, 28, 28)
+    for arch in WORKER_WARMUP_ARCHITECTURES:
+        config = DEFAULT_ARCHITECTURE_CONFIGS.get(arch)
+        if config is None:
+            logging.warning(f"未知的预热架构: {arch}")
+            continue
+        model = build_model_from_template(config, architecture_config_hash(config), num_classes=10)
+        with torch.inference_mode():
+            model.eval()(sample)
+    return time.perf_counter() - start
+
+
+def init_training_worker(progress_queue, warm_up: bool = False, cancel_flags=None):
+    global _worker_progress_queue, _worker_cancel_flags, _worker_warmup_seconds
+    _worker_progress_queue = progress_queue
+    _worker_cancel_flags = cancel_flags
+    if warm_up:
+        _worker_warmup_seconds = warm_up_worker()
+        logging.info(f"训练工作进程已启动并完成预热 (pid={os.getpid()})，预热用时 {_worker_warmup_seconds:.2f}s")
+    else:
+        logging.info(f"训练工作进程已启动 (pid={os.getpid()})")
+
+
+def apply_core_budget(cores: List[int], pin: bool = False):
+    """
+    按调度器分配的核心数设置 intra-op 线程数，可选地把工作进程绑定到这些核心。
+    工作进程会被后续任务复用，因此每个任务开始前都重新设置 (未绑核时恢复为全部可用核心)。
+    """
+    global _worker_cores, _worker_cores_pinned
+    _worker_cores = list(cores)
+    _worker_cores_pinned = pin and hasattr(os, 'sched_setaffinity')
+    torch.set_num_threads(max(1, len(_worker_cores)))
+    if hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(0, _worker_cores if _worker_cores_pinned else _WORKER_DEFAULT_AFFINITY)
+        except OSError as e:
+            logging.warning(f"设置 CPU 亲和性失败: {e}")
+            _worker_cores_pinned = False
+
+
+def is_job_cancelled(job_id: str) -> bool:
+    """读取共享内存中的取消标记，不涉及进程间通信，可以在每个批次检查。"""
+    return _worker_cancel_flags is not None and job_id.encode('ascii') in _worker_cancel_flags.raw
+
+
+def worker_ready() -> Dict[str, Any]:
+    """供调度器确认工作进程已启动（initializer 中的预热先于任何任务完成）。"""
+    return {'pid': os.getpid(), 'warmupSeconds': _worker_warmup_seconds}
+
+
+def run_training_job(job_id: str, client_sid: str, config: Dict[str, Any], arch_hash: str, skip_analysis: bool,
+                     submitted_at: Optional[float] = None, checkpoint_id: Optional[str] = None, resume: bool = False,
+                     owner: Optional[str] = None):
+    """进程池入口：在工作进程中同步运行一次完整训练；resume=True 时从 checkpoint_id 的检查点继续，owner 写入检查点。"""
+    world_size = int(config.get('trainingParams', {}).get('dataParallelWorkers', 1) or 1)
+    # 数据并行训练不写检查点；能恢复的检查点只可能来自单进程训练（包括核心不足时的退化路径）
+    if world_size > 1 and not resume:
+        run_data_parallel_training(job_id, client_sid, config, arch_hash, skip_analysis, world_size,
+                                   submitted_at=submitted_at, checkpoint_id=checkpoint_id, owner=owner)
+        return
+    trainer = CNNTrainer(job_id, client_sid, _worker_progress_queue)
+    trainer.run_training(config, arch_hash, skip_analysis=skip_analysis, submitted_at=submitted_at,
+                         checkpoint_id=checkpoint_id, resume=resume, owner=owner)
+
+
+def _data_parallel_rank_main(rank: int, world_size: int, init_method: str, job_id: str, client_sid: str,
+                             config: Dict[str, Any], arch_hash: str, skip_analysis: bool, seed: int,
+                             progress_queue, core_budget: List[int], pin_cores: bool, cancel_flags):
+    global _worker_cancel_flags
+    import torch.distributed as dist
+
+    _worker_cancel_flags = cancel_flags
+
+    # 平分本任务分配到的核心，避免多个 rank 各自占满所有核心造成超额订阅
+    cores = core_budget[rank::world_size]
+    torch.set_num_threads(max(1, len(cores)))
+    if pin_cores:
+        os.sched_setaffinity(0, cores)
+    dist.init_process_group('gloo', init_method=init_method, rank=rank, world_size=world_size)
+    try:
+        CNNTrainer(job_id, client_sid, progress_queue).run_data_parallel_rank(
+            config, arch_hash, skip_analysis, rank, world_size, seed)
+    finally:
+        dist.destroy_process_group()
+
+
+def run_data_parallel_training(job_id: str, client_sid: str, config: Dict[str, Any], arch_hash: str,
+                               skip_analysis: bool, world_size: int, submitted_at: Optional[float] = None,
+                               checkpoint_id: Optional[str] = None, owner: Optional[str] = None):
+    """
+    在当前工作进程中启动 world_size 个本地 rank 进程并等待其结束。
+    submitted_at / checkpoint_id / owner 只用于核心不足时的单进程退化路径，使其检查点可以被原客户端恢复。
+    """
+    import socket
+    import torch.multiprocessing as torch_mp
+
+    core_budget = _worker_cores or list(range(os.cpu_count() or 1))
+    world_size = min(world_size, len(core_budget), DATA_PARALLEL_MAX_WORKERS)
+    if world_size < 2:
+        logging.info(f"[{client_sid}] 分配的核心不足，数据并行退化为单进程训练")
+        CNNTrainer(job_id, client_sid, _worker_progress_queue).run_training(
+            config, arch_hash, skip_analysis=skip_analysis, submitted_at=submitted_at, checkpoint_id=checkpoint_id,
+            owner=owner)
+        return
+
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        init_method = f"tcp://127.0.0.1:{s.getsockname()[1]}"
+    seed = int(job_id, 16) % (2 ** 31)
+    try:
+        torch_mp.spawn(_data_parallel_rank_main, nprocs=world_size, join=True,
+                       args=(world_size, init_method, job_id, client_sid, config, arch_hash, skip_analysis, seed,
+                             _worker_progress_queue, core_budget, _worker_cores_pinned, _worker_cancel_flags))
+    except Exception as e:
+        logging.error(f"数据并行训练失败 (job {job_id}): {e}", exc_info=True)
+        _worker_progress_queue.put((job_id, client_sid, 'update',
+                                    {'status': f'错误: 数据并行训练失败: {e}', 'error': True,
+                                     'isTrainingComplete': False}))
+
+
+def run_sweep_trial_job(job_id: str, client_sid: str, config: Dict[str, Any], arch_hash: str, start_epoch: int,
+                         end_epoch: int, checkpoint_path: str) -> Dict[str, Any]:
+    """进程池入口：运行超参数搜索中一个试验的一段训练并返回验证指标。"""
+    trainer = CNNTrainer(job_id, client_sid, _worker_progress_queue)
+    return trainer.run_trial_segment(config, arch_hash, start_epoch, end_epoch, checkpoint_path)
+
+
+# --- 5. 推理辅助函数 ---
+# 主进程中的推理服务在首次推理请求时才导入本模块，以下函数都在推理线程中执行。
+def decode_inference_images(payload: Dict[str, Any]) -> torch.Tensor:
+    """
+    把请求解析为归一化后的 (N, 1, 28, 28) 张量。支持两种字段：
+    'images': base64 编码的图片文件（PNG/JPEG 等，会转为灰度并缩放到 28x28）；
+    'pixels': 28x28 的 0-255 灰度数组，或由它们组成的列表。
+    """
+    if 'images' in payload:
+        images = payload['images']
+        images = images if isinstance(images, list) else [images]
+        arrays = []
+        for i, encoded in enumerate(images, start=1):
+            # 非法 base64 抛出 binascii.Error，能解码但不是图片时 PIL 抛出 UnidentifiedImageError (OSError)
+            try:
+                image = Image.open(io.BytesIO(base64.b64decode(encoded))).convert('L')
+            except (OSError, binascii.Error, TypeError):
+                raise ValueError(f"第 {i} 张图片无法解码")
+            if image.size != (28, 28):
+                image = image.resize((28, 28), Image.BILINEAR)
+            arrays.append(np.asarray(image, dtype=np.uint8))
+        batch = np.stack(arrays) if arrays else np.zeros((0, 28, 28), dtype=np.uint8)
+    elif 'pixels' in payload:
+        batch = np.asarray(payload['pixels'], dtype=np.float32)
+        if batch.ndim == 2:
+            batch = batch[None]
+        if batch.shape[-2:] != (28, 28):
+            raise ValueError(f"pixels 的形状必须为 28x28 或 Nx28x28，实际为 {list(batch.shape)}")
+        batch = np.clip(batch.reshape(-1, 28, 28), 0, 255).astype(np.uint8)
+    else:
+        raise ValueError("请求中缺少 'images' 或 'pixels' 字段")
+    if len(batch) == 0:
+        raise ValueError("请求中没有图片")
+    return normalize_mnist_batch(torch.from_numpy(batch))
+
+
+def run_inference_batch(model: nn.Module, inputs_list: List[torch.Tensor]) -> List[torch.Tensor]:
+    """把多个请求的图片拼成一个微批次执行一次前向，按请求拆分返回 softmax 概率。"""
+    inputs = torch.cat(inputs_list) if len(inputs_list) > 1 else inputs_list[0]
+    with torch.inference_mode():
+        outputs, _ = model(inputs)
+        probabilities = torch.softmax(outputs.float(), dim=1)
+    return list(torch.split(probabilities, [len(x) for x in inputs_list]))
+
+
+def summarize_predictions(probabilities: torch.Tensor) -> List[Dict[str, Any]]:
+    confidences, labels = probabilities.max(dim=1)
+    return [{'label': int(label), 'confidence': float(confidence), 'probabilities': row.tolist()}
+            for label, confidence, row in zip(labels, confidences, probabilities)]
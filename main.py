@@ -1,20 +1,38 @@
-import io
-import base64
-import numpy as np
-import torch
-import torch.nn as nn
-import torch.optim as optim
-from torchvision import datasets, transforms, models
-from torch.utils.data import DataLoader
-from fastapi import FastAPI
+import time
+
+# 进程启动时间，用于汇报冷启动各阶段的耗时
+SERVER_START_TIME = time.time()
+
+from fastapi import FastAPI, HTTPException, Request, Response
 import socketio
-from PIL import Image
 import uvicorn
-import threading
+import os
+import gzip
+import uuid
+import copy
+import math
+import random
 import logging
-from typing import Dict, Any, List, Tuple
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Tuple, Optional, TYPE_CHECKING
 import asyncio
-from collections import OrderedDict
+from collections import OrderedDict, deque
+
+from model_artifacts import (architecture_config_hash, checkpoint_owner, ContentAddressedStore, load_checkpoint_meta,
+                             LRUArtifactCache, ModelRegistry, model_registry, sweep_training_checkpoints)
+from model_cost import ArchitectureCostError, estimate_training_cost, check_admission
+from server_metrics import (BUILD_SECONDS_BUCKETS, EMIT_SECONDS_BUCKETS, MetricsRegistry, PAYLOAD_BYTES_BUCKETS,
+                            payload_size, process_rss_bytes, STEP_SECONDS_BUCKETS)
+
+if TYPE_CHECKING:
+    import torch
+    import torch.nn as nn
+
+# torch / torchvision 只在训练工作进程和首次推理时通过 cnn_engine 导入，Web 服务启动不再付出这部分开销
 
 # --- 1. 日志记录配置 ---
 logging.basicConfig(
@@ -24,7 +42,40 @@ logging.basicConfig(
 )
 
 # --- 2. FastAPI 和 Socket.IO 设置 ---
-app = FastAPI()
+# production: 不启用 reload，并预热训练工作进程池；development: 保持 reload 便于开发
+SERVER_MODE = os.environ.get('SERVER_MODE', 'development')
+
+# 冷启动各阶段距进程启动的秒数
+startup_metrics: Dict[str, Optional[float]] = {
+    'moduleImportSeconds': None,
+    'appReadySeconds': None,
+    'workerPoolWarmSeconds': None,
+    'firstConnectSeconds': None,
+    'firstTrainingStepSeconds': None,
+}
+
+
+def record_startup_metric(name: str, seconds: Optional[float] = None):
+    """只记录首次发生的时间，默认取当前时刻距进程启动的秒数。"""
+    if startup_metrics.get(name) is None:
+        startup_metrics[name] = seconds if seconds is not None else time.time() - SERVER_START_TIME
+        logging.info(f"冷启动: {name} = {startup_metrics[name]:.2f}s")
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    # 训练任务调度器在服务启动时创建进程池，关闭时回收
+    record_startup_metric('moduleImportSeconds', MODULE_IMPORTED_TIME - SERVER_START_TIME)
+    await training_scheduler.start()
+    record_startup_metric('appReadySeconds')
+    try:
+        yield
+    finally:
+        await training_scheduler.shutdown()
+        inference_service.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 
 sio = socketio.AsyncServer(
     async_mode='asgi',
@@ -40,608 +91,1122 @@ sio = socketio.AsyncServer(
 )
 
 socket_app = socketio.ASGIApp(sio)
-app.mount("/", socket_app)
 
-# --- 3. PyTorch 模型构建器和自定义模块 ---
+# --- 3. 模型分析产物缓存 ---
+ARTIFACT_CACHE_MAX_ENTRIES = int(os.environ.get('ARTIFACT_CACHE_MAX_ENTRIES', 32))
+
+ARCHITECTURE_ARTIFACT_FIELDS = ('modelArchitectureText', 'modelGraphData')
+# 客户端可选的产物传输方式：json 为内联对象，gzip 为压缩后的紧凑 JSON 二进制附件
+ARTIFACT_ENCODINGS = ('json', 'gzip')
+
+# 主进程：图结构 JSON 与文本摘要按内容哈希存放一份，架构哈希只映射到这些内容哈希
+artifact_store = ContentAddressedStore(ARTIFACT_CACHE_MAX_ENTRIES * len(ARCHITECTURE_ARTIFACT_FIELDS))
+architecture_artifact_cache = LRUArtifactCache(ARTIFACT_CACHE_MAX_ENTRIES)
 
-# 激活函数映射
-ACTIVATION_MAP = {
-    'ReLU': nn.ReLU,
-    'Sigmoid': nn.Sigmoid,
-    'Tanh': nn.Tanh,
-    'LeakyReLU': nn.LeakyReLU,
-    'PReLU': nn.PReLU
-}
 
+def store_architecture_artifacts(arch_hash: str, data: Dict[str, Any]) -> Dict[str, str]:
+    refs = {field: artifact_store.put(data[field]) for field in ARCHITECTURE_ARTIFACT_FIELDS}
+    architecture_artifact_cache.put(arch_hash, refs)
+    return refs
 
-class SqueezeExcitation(nn.Module):
+
+def render_architecture_artifacts(refs: Dict[str, str], encoding: Optional[str] = None,
+                                  known: Optional[set] = None) -> Optional[Dict[str, Any]]:
     """
-    Squeeze-and-Excitation (SE) Block
+    按客户端声明的协议生成 update 中的产物字段，引用的内容已被淘汰时返回 None。
+    未声明 artifactEncoding 的客户端照旧收到内联字段；声明了的客户端只收到 artifactRefs，
+    以及 artifacts 中它尚未持有 (不在 knownArtifacts 里) 的内容。
+    """
+    entries = {field: artifact_store.get(content_hash) for field, content_hash in refs.items()}
+    if any(entry is None for entry in entries.values()):
+        return None
+    if encoding is None:
+        return {'artifactRefs': refs, **{field: entry['value'] for field, entry in entries.items()}}
+    artifacts = {}
+    for field, entry in entries.items():
+        if refs[field] in (known or ()):
+            continue
+        if encoding == 'gzip':
+            artifacts[refs[field]] = {'encoding': 'gzip', 'mimeType': 'application/json', 'size': entry['size'],
+                                      'data': entry['gzip']}
+        else:
+            artifacts[refs[field]] = {'encoding': 'json', 'size': entry['size'], 'data': entry['value']}
+    return {'artifactRefs': refs, 'artifacts': artifacts}
+
+
+# --- 4. 训练任务调度器 ---
+# 训练在独立的工作进程中执行，避免同步的 PyTorch 循环阻塞 uvicorn 的事件循环。
+TRAINING_MAX_WORKERS = int(os.environ.get('TRAINING_MAX_WORKERS', max(1, min(4, (os.cpu_count() or 1) // 2))))
+# 启动时让工作进程预先导入 torch、打开数据集缓存并构建常用架构，默认只在 production 模式下开启
+WORKER_WARMUP = os.environ.get('WORKER_WARMUP', '1' if SERVER_MODE == 'production' else '0') == '1'
+
+
+def _available_cores() -> List[int]:
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+# 核心预算：训练任务只使用前 TRAINING_TOTAL_CORES 个可用核心，默认平分给各工作进程槽位，互不重叠
+TRAINING_TOTAL_CORES = int(os.environ.get('TRAINING_TOTAL_CORES', 0)) or len(_available_cores())
+# 单个客户端同时占用的核心数上限，以及排队 + 运行中的训练任务数上限 (0 表示不限)
+TRAINING_MAX_CORES_PER_CLIENT = int(os.environ.get('TRAINING_MAX_CORES_PER_CLIENT', 0)) or TRAINING_TOTAL_CORES
+TRAINING_MAX_JOBS_PER_CLIENT = int(os.environ.get('TRAINING_MAX_JOBS_PER_CLIENT', 2))
+# 是否把工作进程绑定到分配的核心上 (os.sched_setaffinity，仅 Linux)
+TRAINING_CPU_AFFINITY = os.environ.get('TRAINING_CPU_AFFINITY', '0') == '1'
+# 取消标记环形缓冲区的槽位数；每个槽位存放一个 12 位 job_id 加 1 字节分隔符，工作进程每个批次读取一次
+TRAINING_CANCEL_SLOTS = int(os.environ.get('TRAINING_CANCEL_SLOTS', 64))
+# 清理被放弃的训练检查点的间隔（秒）；启动时先清理一次，TTL 与总大小上限见 model_artifacts
+TRAINING_CHECKPOINT_SWEEP_INTERVAL_SEC = float(os.environ.get('TRAINING_CHECKPOINT_SWEEP_INTERVAL_SEC', 600))
+_CANCEL_SLOT_BYTES = 13
+
+
+# 训练服务的 Prometheus 指标（/metrics）。任务数、核心与内存在抓取时读取，其余在事件发生时累计
+training_metrics = MetricsRegistry()
+training_metrics.describe('training_jobs_submitted_total', 'counter', '通过准入检查并入队的训练任务数')
+training_metrics.describe('training_jobs_completed_total', 'counter',
+                          '结束的训练任务数，outcome 为 finished / failed / cancelled / rejected')
+training_metrics.describe('training_job_samples_per_second', 'gauge', '运行中任务最近一次进度汇报的训练吞吐')
+training_metrics.describe('training_step_seconds', 'histogram', '训练步耗时（相邻两个批次结束的间隔，含取数据）',
+                          STEP_SECONDS_BUCKETS)
+training_metrics.describe('training_model_build_seconds', 'histogram', '训练进程中构建模型的耗时',
+                          BUILD_SECONDS_BUCKETS)
+training_metrics.describe('training_model_analysis_seconds', 'histogram',
+                          '模型图结构 (stage=graph) 与文本摘要 (stage=summary) 的生成耗时', BUILD_SECONDS_BUCKETS)
+training_metrics.describe('training_update_queue_seconds', 'histogram', 'update 从工作进程入队到主进程取出的延迟',
+                          EMIT_SECONDS_BUCKETS)
+training_metrics.describe('training_update_emit_seconds', 'histogram', 'update 在主进程中 sio.emit 的耗时',
+                          EMIT_SECONDS_BUCKETS)
+training_metrics.describe('training_update_payload_bytes', 'histogram', 'update 负载的近似字节数',
+                          PAYLOAD_BYTES_BUCKETS)
+
+# update 按其中最重的字段归类，作为上面三个直方图的 kind 标签
+UPDATE_KINDS = ('modelGraphData', 'artifacts', 'kernelSprite', 'featureMaps', 'progress', 'validation', 'checkpoint')
+
+
+def update_kind(data: Dict[str, Any]) -> str:
+    return next((kind for kind in UPDATE_KINDS if kind in data), 'status')
+
+
+def _init_training_worker(progress_queue, warm_up: bool, cancel_flags=None):
+    import cnn_engine
+    cnn_engine.init_training_worker(progress_queue, warm_up, cancel_flags)
+
+
+def _run_in_engine(function_name: str, *args):
+    """进程池入口：在工作进程中按名称调用 cnn_engine 的函数，主进程因此无需导入 torch。"""
+    import cnn_engine
+    return getattr(cnn_engine, function_name)(*args)
+
+
+def _run_job_in_engine(function_name: str, cores: List[int], pin: bool, *args) -> Tuple[Any, Dict[str, float]]:
+    """在分配的核心预算内运行任务，并返回 (结果, 资源使用)；CPU 时间包含数据并行时派生的 rank 子进程。"""
+    import cnn_engine
+    cnn_engine.apply_core_budget(cores, pin)
+    start_times, start_wall = os.times(), time.perf_counter()
+    result = _run_in_engine(function_name, *args)
+    end_times = os.times()
+    cpu_seconds = sum(end - start for end, start in zip(end_times[:4], start_times[:4]))
+    return result, {'cpuSeconds': cpu_seconds, 'wallSeconds': time.perf_counter() - start_wall}
+
+
+class CoreAllocator:
+    """
+    为训练任务分配互不重叠的 CPU 核心集合。
+    每个任务默认获得 total / slots 个核心 (trainingParams.cpuCores 可覆盖，受单客户端上限约束)；
+    空闲核心不足或该客户端已达核心上限时，任务在分配处等待，不会与其他任务争抢线程。
     """
 
-    def __init__(self, channel, reduction=16):
-        super(SqueezeExcitation, self).__init__()
-        self.avg_pool = nn.AdaptiveAvgPool2d(1)
-        self.fc = nn.Sequential(
-            nn.Linear(channel, channel // reduction, bias=False),
-            nn.ReLU(inplace=True),
-            nn.Linear(channel // reduction, channel, bias=False),
-            nn.Sigmoid()
-        )
-
-    def forward(self, x):
-        b, c, _, _ = x.size()
-        y = self.avg_pool(x).view(b, c)
-        y = self.fc(y).view(b, c, 1, 1)
-        return x * y.expand_as(x)
-
-
-class CustomCNN(nn.Module):
-    def __init__(self, config: Dict[str, Any]):
-        super(CustomCNN, self).__init__()
-        self.features = nn.Sequential()
-        in_channels = 1  # MNIST input
-        current_dim = 28  # MNIST image size
-
-        custom_layers_config = config.get('modelArchitecture', {}).get('customLayers', [])
-
-        for i, layer_conf in enumerate(custom_layers_config):
-            out_channels = layer_conf['numFilters']
-            kernel_size = layer_conf['kernelSize']
-            stride = layer_conf['stride']
-            padding = layer_conf['padding']
-            activation_name = layer_conf['activation']
-            use_batchnorm = layer_conf['batchNorm']
-
-            conv_out_dim = (current_dim - kernel_size + 2 * padding) // stride + 1
-            if conv_out_dim <= 0:
-                logging.error(
-                    f"Layer {i + 1} (Conv) configuration leads to invalid output dimension after convolution. "
-                    f"Input dim: {current_dim}, Kernel: {kernel_size}, Stride: {stride}, Padding: {padding}. "
-                    f"Output dim would be {conv_out_dim}. Skipping further layers for CustomCNN.")
-                break
-
-            self.features.add_module(f'conv{i + 1}',
-                                     nn.Conv2d(in_channels, out_channels, kernel_size=kernel_size, stride=stride,
-                                               padding=padding))
+    def __init__(self, cores: List[int], slots: int, max_cores_per_client: int):
+        self.cores = list(cores)
+        self.default_budget = max(1, len(self.cores) // max(1, slots))
+        self.max_cores_per_client = max(1, min(max_cores_per_client, len(self.cores)))
+        self._free = set(self.cores)
+        self._allocations: Dict[str, Dict[str, Any]] = {}
+        self._condition = asyncio.Condition()
 
-            if use_batchnorm:
-                self.features.add_module(f'bn{i + 1}', nn.BatchNorm2d(out_channels))
+    def budget_for(self, config: Dict[str, Any]) -> int:
+        requested = (config.get('trainingParams', {}) or {}).get('cpuCores')
+        try:
+            budget = int(requested) if requested else self.default_budget
+        except (TypeError, ValueError):
+            budget = self.default_budget
+        return max(1, min(budget, self.max_cores_per_client))
+
+    def _client_cores(self, sid: str) -> int:
+        return sum(len(a['cores']) for a in self._allocations.values() if a['sid'] == sid)
+
+    async def acquire(self, job: "TrainingJob") -> List[int]:
+        budget = self.budget_for(job.config)
+        async with self._condition:
+            # 等待期间被取消的任务立即返回，不再占用调度槽位
+            await self._condition.wait_for(lambda: job.status == 'cancelled' or (
+                len(self._free) >= budget and self._client_cores(job.sid) + budget <= self.max_cores_per_client))
+            if job.status == 'cancelled':
+                return []
+            cores = sorted(self._free)[:budget]
+            self._free.difference_update(cores)
+            self._allocations[job.job_id] = {'sid': job.sid, 'cores': cores, 'startedAt': time.perf_counter()}
+        return cores
+
+    async def wake(self):
+        async with self._condition:
+            self._condition.notify_all()
+
+    async def release(self, job: "TrainingJob"):
+        async with self._condition:
+            allocation = self._allocations.pop(job.job_id, None)
+            if allocation is not None:
+                self._free.update(allocation['cores'])
+            self._condition.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'totalCores': len(self.cores),
+            'freeCores': len(self._free),
+            'defaultBudget': self.default_budget,
+            'maxCoresPerClient': self.max_cores_per_client,
+            'maxJobsPerClient': TRAINING_MAX_JOBS_PER_CLIENT,
+            'pinned': TRAINING_CPU_AFFINITY,
+            'jobs': {job_id: {'cores': a['cores'], 'runningSeconds': round(time.perf_counter() - a['startedAt'], 1)}
+                     for job_id, a in self._allocations.items()},
+        }
 
-            activation_fn = ACTIVATION_MAP.get(activation_name, nn.ReLU)
-            self.features.add_module(f'act{i + 1}', activation_fn())
 
-            if conv_out_dim >= 2:
-                self.features.add_module(f'pool{i + 1}', nn.MaxPool2d(kernel_size=2, stride=2))
-                current_dim = conv_out_dim // 2
-            else:
-                logging.warning(
-                    f"Feature map dimension {conv_out_dim} too small for pooling in layer {i + 1}. Skipping MaxPool2d.")
-                current_dim = conv_out_dim
+class TrainingJob:
+    def __init__(self, client_sid: str, config: Dict[str, Any], checkpoint_id: Optional[str] = None,
+                 owner: Optional[str] = None):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.sid = client_sid
+        # 检查点归属，写入 meta.json；resume_training 只接受同一客户端的请求
+        self.owner = owner or checkpoint_owner(client_sid)
+        self.config = config
+        self.arch_hash = architecture_config_hash(config)
+        self.artifacts_cached = False
+        # 客户端声明的产物传输协议，见 render_architecture_artifacts
+        encoding = config.get('artifactEncoding')
+        self.artifact_encoding = encoding if encoding in ARTIFACT_ENCODINGS else None
+        self.known_artifacts = set(config.get('knownArtifacts') or [])
+        self.architecture = (config.get('modelArchitecture') or {}).get('baseArchitecture', 'CustomCNN')
+        # 训练进程报告的最终结果 (finished / failed / cancelled)，转发 update 时记下；
+        # 训练进程内部捕获的错误只以 error update 的形式出现，任务函数本身仍正常返回
+        self.outcome: Optional[str] = None
+        self.status = 'queued'
+        self.submitted_at = time.time()
+        # 训练检查点的标识：新任务使用自己的 job_id，resume_training 沿用原任务的检查点
+        self.checkpoint_id = checkpoint_id or self.job_id
+        self.resume = checkpoint_id is not None
+        # cnn_engine 中的入口函数名及参数；result 非空时表示这是一个由服务端等待结果的任务（如搜索试验），
+        # 调度器把返回值或异常写入该 Future
+        self.runner = 'run_training_job'
+        self.runner_args: Optional[Tuple] = None
+        self.result: Optional[asyncio.Future] = None
+
+
+class TrainingJobScheduler:
+    """
+    基于进程池的训练任务调度器。
+    - 任务按提交顺序 (FIFO) 排队，同时运行的任务数不超过 max_workers；
+    - 工作进程通过 multiprocessing 队列回传进度，由后台协程在事件循环中转发给客户端；
+    - 取消运行中的任务时把 job_id 写入共享内存环形缓冲区，工作进程在下一个批次开始前读到后停止并写检查点。
+    """
 
-            in_channels = out_channels
-            current_dim = max(1, current_dim)
+    def __init__(self, sio_server: socketio.AsyncServer, max_workers: int = TRAINING_MAX_WORKERS):
+        self.sio = sio_server
+        self.max_workers = max(1, max_workers)
+        self._mp_context = multiprocessing.get_context('spawn')
+        self._progress_queue = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pending: Optional[asyncio.Queue] = None
+        self._queued_jobs: "OrderedDict[str, TrainingJob]" = OrderedDict()
+        self._running_jobs: Dict[str, TrainingJob] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._cancel_flags = None
+        self._cancel_cursor = 0
+        self.cores = CoreAllocator(_available_cores()[:TRAINING_TOTAL_CORES], self.max_workers,
+                                   TRAINING_MAX_CORES_PER_CLIENT)
+
+    def _create_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=self._mp_context,
+                                   initializer=_init_training_worker, initargs=(self._progress_queue, WORKER_WARMUP, self._cancel_flags))
+
+    async def start(self):
+        self._progress_queue = self._mp_context.Queue()
+        self._cancel_flags = self._mp_context.Array('c', TRAINING_CANCEL_SLOTS * _CANCEL_SLOT_BYTES, lock=False)
+        self._pool = self._create_pool()
+        self._pending = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._pump_progress())]
+        self._tasks += [asyncio.create_task(self._dispatch_loop()) for _ in range(self.max_workers)]
+        self._tasks.append(asyncio.create_task(self._sweep_checkpoints_loop()))
+        if WORKER_WARMUP:
+            self._tasks.append(asyncio.create_task(self._warm_up_pool()))
+        logging.info(f"训练调度器已启动，最大并发训练任务数: {self.max_workers}")
+
+    async def _warm_up_pool(self):
+        """
+        同时提交 max_workers 个空任务，迫使进程池立即启动全部工作进程；
+        预热在各进程的 initializer 中完成，不占用调度队列，也不阻塞服务启动。
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            workers = await asyncio.gather(*(loop.run_in_executor(self._pool, _run_in_engine, 'worker_ready')
+                                             for _ in range(self.max_workers)))
+        except Exception as e:
+            logging.error(f"训练工作进程池预热失败: {e}", exc_info=True)
+            return
+        record_startup_metric('workerPoolWarmSeconds')
+        logging.info(f"训练工作进程池已预热: {workers}")
+
+    async def _sweep_checkpoints_loop(self):
+        """定期删除超过 TTL 或超出总大小上限的训练检查点，排队和运行中任务的检查点除外。"""
+        loop = asyncio.get_running_loop()
+        while True:
+            active = [job.checkpoint_id for job in (*self._queued_jobs.values(), *self._running_jobs.values())]
+            try:
+                removed = await loop.run_in_executor(None, sweep_training_checkpoints, active)
+                if removed:
+                    logging.info(f"已清理 {len(removed)} 个过期或超出容量的训练检查点: {removed}")
+            except Exception as e:
+                logging.error(f"清理训练检查点失败: {e}", exc_info=True)
+            await asyncio.sleep(TRAINING_CHECKPOINT_SWEEP_INTERVAL_SEC)
+
+    async def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        if self._progress_queue is not None:
+            # 唤醒阻塞在 get() 上的转发线程
+            self._progress_queue.put(None)
+        logging.info("训练调度器已关闭。")
 
-        fc_input_features = 0
-        with torch.no_grad():
-            dummy_input = torch.randn(1, 1, 28, 28)
+    @staticmethod
+    def admit(config: Dict[str, Any]) -> Dict[str, Any]:
+        """准入检查：静态估算形状、参数量、FLOPs 与内存，配置无效或超出预算时抛出 ArchitectureCostError。"""
+        estimate = estimate_training_cost(config)
+        check_admission(estimate)
+        return estimate
+
+    async def submit(self, client_sid: str, config: Dict[str, Any], checkpoint_id: Optional[str] = None,
+                     owner: Optional[str] = None) -> Optional[TrainingJob]:
+        # 在构建模型和占用工作进程之前拒绝无效或超出预算的配置
+        try:
+            estimate = self.admit(config)
+        except ArchitectureCostError as e:
+            logging.warning(f"[{client_sid}] 训练任务被拒绝: {e}")
+            training_metrics.inc('training_jobs_completed_total', outcome='rejected')
+            await self.sio.emit('update', {'status': f'错误: {e}', 'error': True, 'isTrainingComplete': False},
+                                to=client_sid)
+            return None
+        active_jobs = sum(1 for job in (*self._queued_jobs.values(), *self._running_jobs.values())
+                          if job.sid == client_sid and job.result is None)
+        if TRAINING_MAX_JOBS_PER_CLIENT and active_jobs >= TRAINING_MAX_JOBS_PER_CLIENT:
+            training_metrics.inc('training_jobs_completed_total', outcome='rejected')
+            await self.sio.emit('update', {'status': f'错误: 每个客户端最多同时提交 {TRAINING_MAX_JOBS_PER_CLIENT} 个训练任务',
+                                           'error': True, 'isTrainingComplete': False}, to=client_sid)
+            return None
+        job = TrainingJob(client_sid, config, checkpoint_id, owner)
+        await self.sio.emit('update', {'costEstimate': estimate, 'jobId': job.job_id,
+                                       'checkpointId': job.checkpoint_id}, to=client_sid)
+
+        # 相同架构的图结构和文本摘要已缓存时立即发送，训练进程将跳过分析步骤
+        refs = architecture_artifact_cache.get(job.arch_hash)
+        cached = render_architecture_artifacts(refs, job.artifact_encoding, job.known_artifacts) if refs else None
+        cache_stats = architecture_artifact_cache.stats()
+        logging.info(f"[{client_sid}] 架构 {job.arch_hash[:12]} 分析产物缓存{'命中' if cached else '未命中'}: {cache_stats}")
+        if cached is not None:
+            job.artifacts_cached = True
+            await self.sio.emit('update', {**cached, 'architectureHash': job.arch_hash, 'artifactCache': cache_stats},
+                                to=client_sid)
+
+        self._queued_jobs[job.job_id] = job
+        await self._pending.put(job)
+        training_metrics.inc('training_jobs_submitted_total')
+        position = len(self._queued_jobs)
+        logging.info(f"[{client_sid}] 训练任务 {job.job_id} 已入队，当前排队位置: {position}")
+        if position > self.max_workers - len(self._running_jobs):
+            await self.sio.emit('update', {'status': f'训练任务排队中，当前排队位置: {position}'}, to=client_sid)
+        return job
+
+    async def run_trial_segment(self, client_sid: str, config: Dict[str, Any], start_epoch: int, end_epoch: int,
+                                checkpoint_path: str) -> Dict[str, Any]:
+        """把搜索试验的一段训练排入同一个 FIFO 队列，与普通训练任务共享工作进程，并等待其验证指标。"""
+        self.admit(config)
+        job = TrainingJob(client_sid, config)
+        job.runner = 'run_sweep_trial_job'
+        job.runner_args = (job.job_id, client_sid, config, job.arch_hash, start_epoch, end_epoch, checkpoint_path)
+        job.result = asyncio.get_running_loop().create_future()
+        self._queued_jobs[job.job_id] = job
+        await self._pending.put(job)
+        return await job.result
+
+    async def cancel(self, client_sid: str, job_id: Optional[str] = None) -> List[str]:
+        """
+        取消客户端的任务（job_id 为空时取消该客户端的全部任务），返回被取消的 job_id 列表。
+        排队中或等待核心的任务直接出队；运行中的任务写入取消标记，由工作进程在下一个批次前停止。
+        """
+        cancelled = []
+        for job in (*self._queued_jobs.values(), *self._running_jobs.values()):
+            if job.sid != client_sid or (job_id is not None and job_id not in (job.job_id, job.checkpoint_id)):
+                continue
+            if job.status == 'running':
+                if job.outcome is not None:
+                    # 训练已经结束，只是工作进程还没返回
+                    continue
+                slot = self._cancel_cursor % TRAINING_CANCEL_SLOTS * _CANCEL_SLOT_BYTES
+                self._cancel_flags[slot:slot + _CANCEL_SLOT_BYTES] = job.job_id.encode('ascii') + b'\0'
+                self._cancel_cursor += 1
+                job.status = 'cancelling'
+            elif job.status in ('queued', 'waiting'):
+                self._queued_jobs.pop(job.job_id, None)
+                job.status = 'cancelled'
+                training_metrics.inc('training_jobs_completed_total', outcome='cancelled')
+                if job.result is not None:
+                    if not job.result.done():
+                        job.result.cancel()
+                else:
+                    await self.sio.emit('update', {'status': '训练任务已取消。', 'isTrainingComplete': False,
+                                                   'cancelled': True, 'jobId': job.job_id}, to=client_sid)
+            else:
+                continue
+            cancelled.append(job.job_id)
+        if cancelled:
+            await self.cores.wake()
+            logging.info(f"[{client_sid}] 已取消训练任务: {cancelled}")
+        return cancelled
+
+    def stats(self) -> Dict[str, Any]:
+        return {'queued': len(self._queued_jobs), 'running': len(self._running_jobs), 'maxWorkers': self.max_workers,
+                'cores': self.cores.stats()}
+
+    async def _dispatch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._pending.get()
+            if job.status == 'cancelled':
+                self._pending.task_done()
+                continue
+            self._queued_jobs.pop(job.job_id, None)
+            self._running_jobs[job.job_id] = job
+            job.status = 'waiting'
+            runner_args = job.runner_args or (job.job_id, job.sid, job.config, job.arch_hash, job.artifacts_cached,
+                                              job.submitted_at, job.checkpoint_id, job.resume, job.owner)
+            # 等待核心预算；拿到核心之后才真正开始运行
+            cores = await self.cores.acquire(job)
+            if job.status == 'cancelled':
+                await self.cores.release(job)
+                self._running_jobs.pop(job.job_id, None)
+                self._pending.task_done()
+                continue
+            job.status = 'running'
             try:
-                if len(self.features) > 0:
-                    dummy_output = self.features(dummy_input)
-                    fc_input_features = dummy_output.view(dummy_output.size(0), -1).shape[1]
+                if job.result is None:
+                    await self.sio.emit('update', {'coreAllocation': {'jobId': job.job_id, 'cores': cores,
+                                                                      'pinned': TRAINING_CPU_AFFINITY}}, to=job.sid)
+                pool = self._pool
+                result, usage = await loop.run_in_executor(pool, _run_job_in_engine, job.runner, cores,
+                                                           TRAINING_CPU_AFFINITY, *runner_args)
+                job.status = job.outcome or ('cancelled' if job.status == 'cancelling' else 'finished')
+                utilization = usage['cpuSeconds'] / max(usage['wallSeconds'] * len(cores), 1e-9)
+                logging.info(f"训练任务 {job.job_id} 完成: {len(cores)} 个核心 {cores}，"
+                             f"用时 {usage['wallSeconds']:.1f}s，CPU 利用率 {utilization:.0%}")
+                if job.result is not None:
+                    if not job.result.done():
+                        job.result.set_result(result)
                 else:
-                    fc_input_features = 1 * 28 * 28
-
-                if fc_input_features <= 0:
-                    raise ValueError(
-                        f"Calculated fc_input_features is {fc_input_features}, which is invalid. Model dimensions might be too small.")
-
+                    await self.sio.emit('update', {'coreAllocation': {
+                        'jobId': job.job_id, 'cores': cores, 'pinned': TRAINING_CPU_AFFINITY,
+                        'cpuSeconds': round(usage['cpuSeconds'], 2), 'wallSeconds': round(usage['wallSeconds'], 2),
+                        'utilization': round(utilization, 3)}}, to=job.sid)
+            except BrokenProcessPool as e:
+                job.status = 'failed'
+                # 同一个进程池损坏时，所有在其上运行的分发协程都会收到该异常：只由第一个重建，其余直接使用新进程池
+                if self._pool is pool:
+                    logging.error(f"训练工作进程异常退出 (job {job.job_id}): {e}. 正在重建进程池。")
+                    pool.shutdown(wait=False, cancel_futures=False)
+                    self._pool = self._create_pool()
+                else:
+                    logging.error(f"训练工作进程异常退出 (job {job.job_id}): {e}. 进程池已重建。")
+                if job.result is not None:
+                    if not job.result.done():
+                        job.result.set_exception(e)
+                else:
+                    await self.sio.emit('update', {'status': '错误: 训练进程异常退出', 'error': True,
+                                                   'isTrainingComplete': False}, to=job.sid)
             except Exception as e:
-                logging.error(
-                    f"Error calculating FC input features with dummy input ({in_channels}x{current_dim}x{current_dim}): {e}. "
-                    f"Model might be malformed. Using fallback feature size.")
-                fc_input_features = 512
-
-        fc_config = config.get('modelArchitecture', {}).get('fcLayer', {})
-        num_neurons = fc_config.get('numNeurons', 64)
-
-        self.classifier = nn.Sequential(
-            nn.Flatten(),
-            nn.Linear(fc_input_features, num_neurons),
-            nn.ReLU(),
-            nn.Linear(num_neurons, 10)
-        )
-
-    def forward(self, x: torch.Tensor):
-        first_conv_layer_weights = None
-        for module in self.features:
-            if isinstance(module, nn.Conv2d):
-                first_conv_layer_weights = module.weight
+                job.status = 'failed'
+                logging.error(f"训练任务 {job.job_id} 调度失败: {e}", exc_info=True)
+                if job.result is not None:
+                    if not job.result.done():
+                        job.result.set_exception(e)
+                else:
+                    await self.sio.emit('update', {'status': f'错误: {e}', 'error': True,
+                                                   'isTrainingComplete': False}, to=job.sid)
+            finally:
+                await self.cores.release(job)
+                self._running_jobs.pop(job.job_id, None)
+                self._pending.task_done()
+                training_metrics.inc('training_jobs_completed_total',
+                                     outcome=job.status if job.status in ('finished', 'cancelled') else 'failed')
+                training_metrics.remove('training_job_samples_per_second', job_id=job.job_id,
+                                        architecture=job.architecture)
+
+    async def _pump_progress(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await loop.run_in_executor(None, self._progress_queue.get)
+            if message is None:
                 break
+            job_id, client_sid, event, data, *queued_at = message
+            if event == 'metrics':
+                self._record_worker_metrics(job_id, data)
+                continue
+            kind = update_kind(data)
+            if queued_at:
+                training_metrics.observe('training_update_queue_seconds', max(0.0, time.time() - queued_at[0]),
+                                         kind=kind)
+            if job_id in self._running_jobs and ('isTrainingComplete' in data or data.get('error')):
+                self._running_jobs[job_id].outcome = ('finished' if data.get('isTrainingComplete') else
+                                                      'cancelled' if data.get('cancelled') else 'failed')
+            if 'progress' in data and job_id in self._running_jobs:
+                training_metrics.set('training_job_samples_per_second', data['progress']['samplesPerSec'],
+                                     job_id=job_id, architecture=self._running_jobs[job_id].architecture)
+            if event == 'update' and 'firstStepMs' in data:
+                record_startup_metric('firstTrainingStepSeconds')
+            if event == 'update' and all(field in data for field in ARCHITECTURE_ARTIFACT_FIELDS):
+                refs = store_architecture_artifacts(data['architectureHash'], data)
+                job = self._running_jobs.get(job_id)
+                if job is not None:
+                    data = {**{k: v for k, v in data.items() if k not in ARCHITECTURE_ARTIFACT_FIELDS},
+                            **render_architecture_artifacts(refs, job.artifact_encoding, job.known_artifacts)}
+            emit_start = time.perf_counter()
+            try:
+                await self.sio.emit(event, data, to=client_sid)
+            except Exception as e:
+                logging.error(f"转发训练任务 {job_id} 的进度消息失败: {e}")
+            training_metrics.observe('training_update_emit_seconds', time.perf_counter() - emit_start, kind=kind)
+            training_metrics.observe('training_update_payload_bytes', payload_size(data), kind=kind)
+
+    def _record_worker_metrics(self, job_id: str, data: Dict[str, Any]):
+        job = self._running_jobs.get(job_id)
+        architecture = job.architecture if job is not None else 'unknown'
+        if data.get('stepSeconds'):
+            training_metrics.histogram('training_step_seconds', architecture=architecture).merge(data['stepSeconds'])
+        if 'modelBuildSeconds' in data:
+            training_metrics.observe('training_model_build_seconds', data['modelBuildSeconds'],
+                                     architecture=architecture)
+        for stage, seconds in data.get('analysisSeconds', {}).items():
+            training_metrics.observe('training_model_analysis_seconds', seconds, architecture=architecture,
+                                     stage=stage)
+
+    def scrape_metrics(self) -> List[Tuple[str, str, str, Dict[tuple, float]]]:
+        """/metrics 抓取时读取的仪表：各状态的任务数、核心占用，以及主进程和训练工作进程的常驻内存。"""
+        jobs = {('state', 'queued'): 0, ('state', 'waiting'): 0, ('state', 'running'): 0}
+        for job in (*self._queued_jobs.values(), *self._running_jobs.values()):
+            state = 'running' if job.status == 'cancelling' else job.status
+            if ('state', state) in jobs:
+                jobs[('state', state)] += 1
+        cores = self.cores.stats()
+        workers = {}
+        for process in multiprocessing.active_children():
+            rss = process_rss_bytes(process.pid)
+            if rss is not None:
+                workers[(('name', process.name), ('pid', process.pid))] = rss
+        return [
+            ('training_jobs', 'gauge', '排队 (queued)、等待核心 (waiting) 与运行中 (running) 的训练任务数',
+             {(key,): count for key, count in jobs.items()}),
+            ('training_cores', 'gauge', '训练核心预算中空闲与已分配的核心数',
+             {(('state', 'free'),): cores['freeCores'],
+              (('state', 'allocated'),): cores['totalCores'] - cores['freeCores']}),
+            ('process_resident_memory_bytes', 'gauge', 'Web 服务主进程的常驻内存', {(): process_rss_bytes()}),
+            ('process_start_time_seconds', 'gauge', '主进程启动时的 Unix 时间', {(): SERVER_START_TIME}),
+            ('training_worker_resident_memory_bytes', 'gauge', '训练工作进程（及其他子进程）的常驻内存', workers),
+        ]
+
+
+training_scheduler = TrainingJobScheduler(sio)
+
+
+# --- 5. 超参数搜索 (异步逐次减半 / ASHA) ---
+# 试验以“段”为单位排入训练调度器：每段训练到当前梯级 (rung) 的 epoch 预算，在验证集上评估后写检查点；
+# 只有梯级内排名前 1/reductionFactor 的试验会从检查点继续训练到下一梯级，其余提前终止。
+SWEEP_CHECKPOINT_DIR = os.environ.get('SWEEP_CHECKPOINT_DIR', './sweep_checkpoints')
+SWEEP_MAX_TRIALS = int(os.environ.get('SWEEP_MAX_TRIALS', 64))
+
+
+def sample_search_value(spec: Any, rng) -> Any:
+    """
+    按搜索空间定义采样一个取值：
+    列表表示离散候选；字典支持 {"type": "choice", "values": [...]}、
+    {"type": "uniform" | "loguniform", "low": x, "high": y} 和 {"type": "int", "low": a, "high": b}。
+    """
+    if isinstance(spec, list):
+        if not spec:
+            raise ValueError("搜索空间的候选列表不能为空")
+        return copy.deepcopy(rng.choice(spec))
+    if not isinstance(spec, dict):
+        raise ValueError(f"无法识别的搜索空间定义: {spec!r}")
+    kind = spec.get('type', 'choice')
+    if kind == 'choice':
+        return sample_search_value(list(spec.get('values', [])), rng)
+    low, high = spec.get('low'), spec.get('high')
+    if low is None or high is None or low > high:
+        raise ValueError(f"搜索空间 {kind} 需要合法的 low/high: {spec!r}")
+    if kind == 'uniform':
+        return rng.uniform(low, high)
+    if kind == 'loguniform':
+        if low <= 0:
+            raise ValueError(f"loguniform 的 low 必须为正数: {spec!r}")
+        return math.exp(rng.uniform(math.log(low), math.log(high)))
+    if kind == 'int':
+        return rng.randint(int(low), int(high))
+    raise ValueError(f"不支持的搜索空间类型: {kind}")
+
+
+def apply_search_value(config: Dict[str, Any], path: str, value: Any):
+    """把取值写入以点号分隔的配置路径，如 "trainingParams.learningRate"。"""
+    keys = path.split('.')
+    if keys[0] not in ('modelArchitecture', 'trainingParams'):
+        raise ValueError(f"搜索参数必须位于 modelArchitecture 或 trainingParams 下: {path}")
+    node = config
+    for key in keys[:-1]:
+        node = node.setdefault(key, {})
+    node[keys[-1]] = value
+
+
+class SweepTrial:
+    def __init__(self, trial_id: int, config: Dict[str, Any], params: Dict[str, Any], checkpoint_path: str):
+        self.trial_id = trial_id
+        self.config = config
+        self.params = params
+        self.checkpoint_path = checkpoint_path
+        self.rung = -1
+        self.epochs = 0
+        self.status = 'pending'
+        self.metrics: Dict[str, Any] = {}
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'trialId': self.trial_id, 'params': self.params, 'rung': self.rung, 'epochs': self.epochs,
+                'status': self.status, **self.metrics, **({'error': self.error} if self.error else {})}
+
+
+class HyperparameterSweep:
+    """
+    一次超参数搜索：按搜索空间随机采样 numTrials 个配置，用 ASHA 调度试验段。
+    每个梯级的 epoch 预算为 minEpochs * reductionFactor^k（不超过 maxEpochs），
+    并发度受训练调度器的工作进程数约束，排行榜通过 'sweep_update' 事件实时推送。
+    """
 
-        x = self.features(x)
-        x = self.classifier(x)
-        return x, first_conv_layer_weights
-
-
-class PretrainedModel(nn.Module):
-    def __init__(self, base_arch: str, num_classes: int, fc_neurons: int, senet_reduction: int = 8):
-        super(PretrainedModel, self).__init__()
-        self.base_arch = base_arch
-
-        if base_arch == 'ResNet18':
-            self.model = models.resnet18(weights=None)
-            self.model.conv1 = nn.Conv2d(1, 64, kernel_size=7, stride=2, padding=3, bias=False)
-            num_ftrs = self.model.fc.in_features
-            self.model.fc = nn.Sequential(
-                nn.Linear(num_ftrs, fc_neurons),
-                nn.ReLU(),
-                nn.Linear(fc_neurons, num_classes)
-            )
-        elif base_arch == 'DenseNet121':
-            self.model = models.densenet121(weights=None)
-            self.model.features.conv0 = nn.Conv2d(1, 64, kernel_size=7, stride=2, padding=3, bias=False)
-            num_ftrs = self.model.classifier.in_features
-            self.model.classifier = nn.Sequential(
-                nn.Linear(num_ftrs, fc_neurons),
-                nn.ReLU(),
-                nn.Linear(fc_neurons, num_classes)
-            )
-        elif base_arch == 'SENet':
-            # Calculate num_features_before_fc based on fixed sequential structure for SENet example
-            # Assuming 28x28 input -> 2 MaxPool2d (kernel=2, stride=2) -> 7x7 feature map size before Flatten
-            num_features_before_fc = 64 * 7 * 7
-
-            self.model = nn.Sequential(
-                nn.Conv2d(1, 32, kernel_size=3, padding=1),
-                nn.BatchNorm2d(32),
-                nn.ReLU(inplace=True),
-                SqueezeExcitation(32, reduction=senet_reduction),
-                nn.MaxPool2d(kernel_size=2, stride=2),
-
-                nn.Conv2d(32, 64, kernel_size=3, padding=1),
-                nn.BatchNorm2d(64),
-                nn.ReLU(inplace=True),
-                SqueezeExcitation(64, reduction=senet_reduction),
-                nn.MaxPool2d(kernel_size=2, stride=2),
-
-                nn.Flatten(),
-                nn.Linear(num_features_before_fc, fc_neurons),  # This line was causing syntax error previously.
-                nn.ReLU(inplace=True),
-                nn.Linear(fc_neurons, num_classes)
-            )
-        else:
-            raise ValueError(f"不支持的基础架构: {base_arch}")
+    def __init__(self, scheduler: TrainingJobScheduler, sio_server: socketio.AsyncServer, client_sid: str,
+                 request: Dict[str, Any]):
+        self.scheduler = scheduler
+        self.sio = sio_server
+        self.sid = client_sid
+        self.sweep_id = uuid.uuid4().hex[:12]
+        base_config = request.get('baseConfig') or {}
+        search_space = request.get('searchSpace') or {}
+        if not search_space:
+            raise ValueError("searchSpace 不能为空")
+        self.num_trials = int(request.get('numTrials', 8))
+        if not 1 <= self.num_trials <= SWEEP_MAX_TRIALS:
+            raise ValueError(f"numTrials 必须在 1 到 {SWEEP_MAX_TRIALS} 之间")
+        self.min_epochs = max(1, int(request.get('minEpochs', 1)))
+        self.max_epochs = max(self.min_epochs, int(request.get('maxEpochs', 4)))
+        self.reduction_factor = max(2, int(request.get('reductionFactor', 3)))
+        self.parallelism = max(1, min(int(request.get('parallelism', scheduler.max_workers)), scheduler.max_workers))
+        self.metric = 'valAccuracy'
+
+        self.rung_epochs = [self.min_epochs]
+        while self.rung_epochs[-1] < self.max_epochs:
+            self.rung_epochs.append(min(self.max_epochs, self.rung_epochs[-1] * self.reduction_factor))
+        # rungs[k]: 已完成第 k 梯级的试验 -> 验证指标
+        self.rungs: List[Dict[int, float]] = [{} for _ in self.rung_epochs]
+        self.promoted: List[set] = [set() for _ in self.rung_epochs]
+
+        self.checkpoint_dir = os.path.join(SWEEP_CHECKPOINT_DIR, self.sweep_id)
+        rng = random.Random(request.get('seed'))
+        self.trials: List[SweepTrial] = []
+        for trial_id in range(self.num_trials):
+            config = copy.deepcopy(base_config)
+            params = {path: sample_search_value(spec, rng) for path, spec in search_space.items()}
+            for path, value in params.items():
+                apply_search_value(config, path, value)
+            self.trials.append(SweepTrial(trial_id, config, params,
+                                          os.path.join(self.checkpoint_dir, f"trial-{trial_id}.pt")))
+        self._next_trial = 0
+        self.epochs_used = 0
+        self.started_at = time.perf_counter()
+
+    def _next_segment(self) -> Optional[Tuple[SweepTrial, int]]:
+        """ASHA 的取任务规则：优先把高梯级中排名前 1/η 且尚未晋级的试验晋级，否则启动一个新试验。"""
+        for k in reversed(range(len(self.rung_epochs) - 1)):
+            quota = len(self.rungs[k]) // self.reduction_factor
+            ranked = sorted(self.rungs[k].items(), key=lambda item: item[1], reverse=True)[:quota]
+            for trial_id, _ in ranked:
+                if trial_id not in self.promoted[k]:
+                    self.promoted[k].add(trial_id)
+                    return self.trials[trial_id], k + 1
+        if self._next_trial < self.num_trials:
+            trial = self.trials[self._next_trial]
+            self._next_trial += 1
+            return trial, 0
+        return None
+
+    async def _run_segment(self, trial: SweepTrial, rung: int):
+        trial.status = 'running'
+        end_epoch = self.rung_epochs[rung]
+        try:
+            metrics = await self.scheduler.run_trial_segment(self.sid, trial.config, trial.epochs, end_epoch,
+                                                             trial.checkpoint_path)
+        except Exception as e:
+            trial.status = 'failed'
+            trial.error = str(e)
+            logging.warning(f"[sweep {self.sweep_id}] 试验 {trial.trial_id} 失败: {e}")
+            return
+        self.epochs_used += end_epoch - trial.epochs
+        trial.epochs = end_epoch
+        trial.rung = rung
+        trial.metrics = metrics
+        trial.status = 'completed' if rung == len(self.rung_epochs) - 1 else 'paused'
+        self.rungs[rung][trial.trial_id] = metrics[self.metric]
+
+    def leaderboard(self) -> List[Dict[str, Any]]:
+        return [t.to_dict() for t in sorted(self.trials, key=lambda t: (t.epochs, t.metrics.get(self.metric, -1.0)),
+                                            reverse=True)]
+
+    async def _emit(self, status: str, **extra):
+        await self.sio.emit('sweep_update', {
+            'sweepId': self.sweep_id,
+            'status': status,
+            'rungEpochs': self.rung_epochs,
+            'epochsUsed': self.epochs_used,
+            # 所有试验都完整训练 maxEpochs 所需的 epoch 数，用于对比节省的算力
+            'exhaustiveEpochs': self.num_trials * self.max_epochs,
+            'elapsedSeconds': time.perf_counter() - self.started_at,
+            'leaderboard': self.leaderboard(),
+            **extra,
+        }, to=self.sid)
+
+    async def run(self):
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        logging.info(f"[{self.sid}] 超参数搜索 {self.sweep_id} 开始: {self.num_trials} 个试验，梯级 {self.rung_epochs}")
+        await self._emit('running')
+        in_flight = set()
+        try:
+            while True:
+                while len(in_flight) < self.parallelism:
+                    segment = self._next_segment()
+                    if segment is None:
+                        break
+                    in_flight.add(asyncio.create_task(self._run_segment(*segment)))
+                if not in_flight:
+                    break
+                _, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                await self._emit('running')
+
+            for trial in self.trials:
+                if trial.status == 'paused':
+                    trial.status = 'stopped'
+            # 试验数少于 reductionFactor 的幂次时可能没有试验到达最高梯级，此时取实际到达的最高梯级中的最佳试验
+            reached = next((rung for rung in reversed(self.rungs) if rung), None)
+            if reached is None:
+                await self._emit('failed', error="所有试验均失败")
+                return
+            best = self.trials[max(reached, key=reached.get)]
+            # 只保留最佳试验的检查点
+            for trial in self.trials:
+                if trial is not best and os.path.exists(trial.checkpoint_path):
+                    os.remove(trial.checkpoint_path)
+            logging.info(f"[{self.sid}] 超参数搜索 {self.sweep_id} 完成，最佳试验 {best.trial_id} 训练到第 "
+                         f"{best.epochs} 个 epoch，共训练 {self.epochs_used} 个 epoch")
+            await self._emit('completed', best=best.to_dict(), bestCheckpoint=best.checkpoint_path)
+        except Exception as e:
+            logging.error(f"超参数搜索 {self.sweep_id} 失败: {e}", exc_info=True)
+            await self._emit('failed', error=str(e))
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+
+active_sweeps: Dict[str, asyncio.Task] = {}
+# sweep_id -> 发起搜索的客户端 sid，客户端断开时取消其搜索
+active_sweep_owners: Dict[str, str] = {}
+
+
+# --- 6. 推理服务 (动态批处理) ---
+# 并发到达的推理请求在 max_wait_ms 内合并成不超过 max_batch_size 张图片的微批次，
+# 在单独的推理线程中以 inference_mode 执行一次前向，避免阻塞事件循环。
+# cnn_engine（以及 torch）在首个推理请求时才于推理线程中导入。
+INFERENCE_MAX_BATCH_SIZE = int(os.environ.get('INFERENCE_MAX_BATCH_SIZE', 64))
+INFERENCE_MAX_WAIT_MS = float(os.environ.get('INFERENCE_MAX_WAIT_MS', 5))
+INFERENCE_STATS_WINDOW = 2048
+
+
+def _percentile(values, q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return float(ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))])
+
+
+class DynamicBatcher:
+    """单个模型的动态批处理队列，并记录请求延迟、批大小和吞吐统计。"""
+
+    def __init__(self, model: "nn.Module", executor: ThreadPoolExecutor, max_batch_size: int = INFERENCE_MAX_BATCH_SIZE,
+                 max_wait_ms: float = INFERENCE_MAX_WAIT_MS):
+        self.model = model.eval()
+        self.executor = executor
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_s = max(0.0, max_wait_ms) / 1000.0
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self.closed = False
+        self._latencies_ms = deque(maxlen=INFERENCE_STATS_WINDOW)
+        self._batch_sizes = deque(maxlen=INFERENCE_STATS_WINDOW)
+        self._served = deque(maxlen=INFERENCE_STATS_WINDOW)  # (完成时间, 图片数)
+        self.total_requests = 0
+        self.total_images = 0
+
+    async def predict(self, inputs: "torch.Tensor") -> "torch.Tensor":
+        """提交一个请求的图片，等待其所在微批次完成后返回对应的 softmax 概率。"""
+        if self.closed:
+            raise RuntimeError("模型已被卸载，请重新提交请求")
+        if self._task is None:
+            self._task = asyncio.create_task(self._batch_loop())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((inputs, future, time.perf_counter()))
+        return await future
+
+    def _forward(self, inputs_list: List["torch.Tensor"]) -> List["torch.Tensor"]:
+        import cnn_engine
+        return cnn_engine.run_inference_batch(self.model, inputs_list)
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            pending = [item]
+            batch_images = len(pending[0][0])
+            deadline = time.perf_counter() + self.max_wait_s
+            # 在等待窗口内继续合并请求；单个请求超过 max_batch_size 时单独成批
+            while batch_images < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    # close() 之前入队的请求已全部取出：执行完当前批次后退出
+                    await self._run_batch(loop, pending, batch_images)
+                    return
+                if batch_images + len(item[0]) > self.max_batch_size:
+                    # 当前批次已满：先执行，再以该请求开启下一批
+                    await self._run_batch(loop, pending, batch_images)
+                    pending, batch_images = [item], len(item[0])
+                    deadline = time.perf_counter() + self.max_wait_s
+                    continue
+                pending.append(item)
+                batch_images += len(item[0])
+            await self._run_batch(loop, pending, batch_images)
 
-    def forward(self, x: torch.Tensor):
-        first_conv_layer_weights = None
-        if self.base_arch == 'ResNet18':
-            first_conv_layer_weights = self.model.conv1.weight
-        elif self.base_arch == 'DenseNet121':
-            first_conv_layer_weights = self.model.features.conv0.weight
-        elif self.base_arch == 'SENet':
-            if isinstance(self.model[0], nn.Conv2d):
-                first_conv_layer_weights = self.model[0].weight
+    @staticmethod
+    def _fail(pending: List[Tuple], error: BaseException):
+        for _, future, _ in pending:
+            if not future.done():
+                future.set_exception(error)
 
-        x = self.model(x)
-        return x, first_conv_layer_weights
+    async def _run_batch(self, loop, pending: List[Tuple], batch_images: int):
+        try:
+            probabilities = await loop.run_in_executor(self.executor, self._forward, [item[0] for item in pending])
+        except asyncio.CancelledError:
+            # 推理线程池关闭或事件循环退出：不能让等待中的请求永远挂起
+            self._fail(pending, RuntimeError("推理服务已关闭"))
+            raise
+        except Exception as e:
+            self._fail(pending, e)
+            return
+        finished = time.perf_counter()
+        for (_, future, enqueued), request_probabilities in zip(pending, probabilities):
+            if not future.done():
+                future.set_result(request_probabilities)
+            self._latencies_ms.append((finished - enqueued) * 1000)
+        self._batch_sizes.append(batch_images)
+        self._served.append((finished, batch_images))
+        self.total_requests += len(pending)
+        self.total_images += batch_images
+
+    def stats(self) -> Dict[str, Any]:
+        throughput = None
+        if len(self._served) > 1:
+            span = self._served[-1][0] - self._served[0][0]
+            if span > 0:
+                # 窗口内第一批之后完成的图片数 / 时间跨度
+                throughput = sum(n for _, n in list(self._served)[1:]) / span
+        return {
+            'requests': self.total_requests,
+            'images': self.total_images,
+            'p50LatencyMs': _percentile(self._latencies_ms, 50),
+            'p99LatencyMs': _percentile(self._latencies_ms, 99),
+            'meanBatchSize': sum(self._batch_sizes) / len(self._batch_sizes) if self._batch_sizes else None,
+            'throughputImagesPerSec': throughput,
+            'maxBatchSize': self.max_batch_size,
+            'maxWaitMs': self.max_wait_s * 1000,
+        }
 
-
-class ModelBuilder:
-    @staticmethod
-    def build_model(config: Dict[str, Any], num_classes: int = 10):
-        base_arch = config.get('modelArchitecture', {}).get('baseArchitecture', 'CustomCNN')
-        fc_neurons = config.get('modelArchitecture', {}).get('fcLayer', {}).get('numNeurons', 64)
-
-        if base_arch == 'CustomCNN':
-            return CustomCNN(config)
-        elif base_arch in ['ResNet18', 'DenseNet121']:
-            return PretrainedModel(base_arch, num_classes, fc_neurons)
-        elif base_arch == 'SENet':
-            senet_reduction = config.get('modelArchitecture', {}).get('senetConfig', {}).get('reduction', 8)
-            return PretrainedModel(base_arch, num_classes, fc_neurons, senet_reduction)
-        else:
-            raise ValueError(f"未知模型架构: {base_arch}")
+    def close(self):
+        """停止接收新请求；已入队的请求（包括正在执行的批次）仍由原模型完成，之后批处理循环退出。"""
+        self.closed = True
+        if self._task is not None:
+            self._queue.put_nowait(None)
+            self._task = None
 
 
-def get_model_summary_text(model: nn.Module, input_size: Tuple[int, ...] = (1, 28, 28)):
+class InferenceService:
     """
-    使用 torchinfo 生成模型文本摘要。
-    input_size 应为 (channels, height, width)。
+    从模型注册表按 ID 取模型（未指定时使用最新注册的模型），每个常驻模型对应一个动态批处理队列。
+    模型被注册表的 LRU 淘汰后，对应的批处理队列也随之关闭，避免继续持有其权重。
     """
-    try:
-        from torchinfo import summary
-        import sys
-        from io import StringIO
 
-        old_stdout = sys.stdout
-        sys.stdout = captured_output = StringIO()
+    def __init__(self, registry: ModelRegistry):
+        self.registry = registry
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='inference')
+        self._batchers: Dict[str, DynamicBatcher] = {}
+        self._lock = asyncio.Lock()
+
+    async def _get_batcher(self, model_id: Optional[str]) -> Tuple[str, DynamicBatcher]:
+        model_id = model_id or self.registry.latest_model_id()
+        if model_id is None:
+            raise FileNotFoundError("尚无已训练的模型，请先完成一次训练")
+        async with self._lock:
+            batcher = self._batchers.get(model_id)
+            if batcher is not None and self.registry.is_resident(model_id):
+                # 命中常驻模型：刷新其在注册表 LRU 中的位置
+                self.registry.load(model_id)
+            else:
+                model = await asyncio.get_running_loop().run_in_executor(self._executor, self.registry.load,
+                                                                         model_id)
+                if batcher is not None:
+                    batcher.close()
+                batcher = self._batchers[model_id] = DynamicBatcher(model, self._executor)
+            for evicted_id in [mid for mid in self._batchers if not self.registry.is_resident(mid)]:
+                self._batchers.pop(evicted_id).close()
+        return model_id, batcher
 
-        device = 'cpu'
+    @staticmethod
+    def _decode(payload: Dict[str, Any]) -> "torch.Tensor":
+        import cnn_engine
+        return cnn_engine.decode_inference_images(payload)
+
+    async def predict(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        inputs = await asyncio.get_running_loop().run_in_executor(self._executor, self._decode, payload)
         try:
-            param = next(model.parameters(), None)
-            if param is not None:
-                device = str(param.device)
-        except Exception:
-            pass
-
-        summary(model, input_size=(1,) + input_size, verbose=0, device=device)
-
-        sys.stdout = old_stdout
-        summary_text = captured_output.getvalue()
-
-        if not summary_text.strip():
-            logging.warning("torchinfo generated empty summary. Falling back to str(model).")
-            summary_text = str(model)
-
-        logging.info(f"Generated model text summary (first 500 chars):\n{summary_text[:500]}...")
-        return summary_text
-    except ImportError:
-        logging.warning(
-            "torchinfo 库未安装。为了获得详细的模型摘要，请运行 'pip install torchinfo'。将使用简单的模型结构字符串。")
-        summary_text = str(model)
-        logging.info(f"Generated model text summary (str(model), first 500 chars):\n{summary_text[:500]}...")
-        return summary_text
-    except Exception as e:
-        logging.error(f"生成模型文本摘要时发生意外错误: {e}", exc_info=True)
-        return f"Error generating model text summary: {e}. Check backend logs for details."
+            model_id, batcher = await self._get_batcher(payload.get('modelId'))
+        except KeyError as e:
+            raise FileNotFoundError(e.args[0]) from e
+        start = time.perf_counter()
+        probabilities = await batcher.predict(inputs)
+        import cnn_engine
+        return {
+            'predictions': cnn_engine.summarize_predictions(probabilities),
+            'latencyMs': (time.perf_counter() - start) * 1000,
+            'modelId': model_id,
+        }
 
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'residentModels': self.registry.stats(),
+            'models': {model_id: batcher.stats() for model_id, batcher in self._batchers.items()},
+        }
 
-def model_to_json_graph(model: nn.Module, input_shape: Tuple[int, ...] = (1, 28, 28)):
-    """
-    将 PyTorch 模型转换为 JSON 格式的图结构，以便在前端可视化。
-    每个节点代表一个模块，包含其类型、名称、参数、子模块等。
-    节点ID会保持唯一性，并记录其父模块ID。
-    该函数尝试捕捉模块间的顺序流和嵌套层次。
-    """
-    nodes = []
-    edges = []
-    node_id_counter = 0
+    def shutdown(self):
+        for batcher in self._batchers.values():
+            batcher.close()
+        self._batchers.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
 
-    # Helper to get parameter count for a module
-    def get_param_count(module):
-        return sum(p.numel() for p in module.parameters(recurse=False) if p.requires_grad)
 
-    # Helper to infer output shape by running a dummy input
-    def _get_output_shape_for_module(module: nn.Module, input_s: Tuple[int, ...]) -> Tuple[int, ...]:
-        try:
-            # Check if module has any parameters. If not, it might not be a computational module.
-            if not list(module.parameters()):
-                return input_s  # Assume identity for non-computational modules
-
-            dummy_input = torch.randn(1, *input_s)  # Add batch dimension
-            # Ensure dummy input is on the same device as the module
-            device = next(module.parameters()).device if next(module.parameters(), None) is not None else 'cpu'
-            output = module(dummy_input.to(device))
-            if isinstance(output, tuple):
-                output = output[0]  # Take first output if multiple
-            return tuple(output.shape[1:])  # Remove batch dimension
-        except Exception as e:
-            logging.warning(
-                f"Failed to infer output shape for {module.__class__.__name__} (Input {input_s}): {e}. Returning input shape.")
-            return input_s  # Fallback: assume shape doesn't change
-
-    # Use a stack for DFS traversal to correctly track parent and level
-    # Stack stores (module, parent_vis_id, current_prefix, current_level, input_shape_for_this_module, prev_node_id_in_sequence)
-
-    # Add the Input Node first
-    input_node_id = "node_input"
-    nodes.append({
-        "id": input_node_id,
-        "label": f"Input\nShape: {input_shape}",
-        "full_name": "Input",
-        "type": "Input",
-        "input_shape": input_shape,
-        "output_shape": input_shape,
-        "parameters": 0,
-        "has_children": False,
-        "parent_id": None,  # Top-level node
-        "level": 0  # Level 0 for the input node
-    })
-
-    # Main traversal queue for BFS-like processing to ensure correct sequential edges
-    # Each item: (module_instance, parent_vis_id, current_name_prefix, level, input_shape_for_this_module, prev_vis_id_at_this_level)
-    queue = []
-
-    # Identify top-level iterable modules based on the model type
-    # For CustomCNN, its features and classifier are top-level.
-    # For PretrainedModel, its internal 'model' attribute holds the architecture.
-
-    top_level_iter_modules = []
-    if isinstance(model, CustomCNN):
-        top_level_iter_modules.append(("features", model.features))
-        top_level_iter_modules.append(("classifier", model.classifier))
-    elif isinstance(model, PretrainedModel):
-        # Traverse direct children of the internal 'model' for pretrained
-        for name, sub_module in model.model.named_children():
-            top_level_iter_modules.append((name, sub_module))
-    else:  # Fallback for any other nn.Module directly passed
-        for name, sub_module in model.named_children():
-            top_level_iter_modules.append((name, sub_module))
-
-    # Initialize queue for top-level modules
-    current_input_shape_for_sequence = input_shape
-    last_node_in_top_level_sequence_id = input_node_id
-
-    for name, top_module in top_level_iter_modules:
-        # Each top-level module is added to the queue to be processed as a node
-        # Its input shape is the output of the previous module in the sequence.
-        # Its parent_vis_id is the last_node_in_top_level_sequence_id for sequential edges.
-        queue.append((top_module, last_node_in_top_level_sequence_id, name, 1, current_input_shape_for_sequence, None))
-        # Update current_input_shape_for_sequence for the *next* top-level module
-        current_input_shape_for_sequence = _get_output_shape_for_module(top_module, current_input_shape_for_sequence)
-        # We'll assign the actual node ID when it's popped and created.
-        # For now, prev_node_id_in_sequence for children is handled by queueing.
-
-    processed_vis_ids = set()  # Track already processed nodes to prevent infinite loops
-
-    while queue:
-        current_module, parent_vis_id, module_name, current_level, input_shape_for_current_module, prev_sibling_vis_id = queue.pop(
-            0)
-
-        # Skip if already processed (e.g., due to complex graph structures where modules might be referenced multiple times)
-        # This simple graph generation might not create true cyclic dependencies that need this for correctness
-        # but is good for safety.
-        # However, for this simple hierarchical Vis.js graph, ID generation prevents true duplicates.
-
-        node_id_counter += 1
-        node_vis_id = f"node_{node_id_counter}"
-        full_name = f"{parent_vis_id.replace('node_', '')}.{module_name}" if parent_vis_id != input_node_id else module_name
-
-        module_type = current_module.__class__.__name__
-        module_output_shape = _get_output_shape_for_module(current_module, input_shape_for_current_module)
-
-        # Determine if module has 'displayable' children for folding
-        has_displayable_children = False
-        # If it's a standard container and has children
-        if isinstance(current_module, (nn.Sequential, nn.ModuleList, nn.ModuleDict)) and len(
-                list(current_module.children())) > 0:
-            has_displayable_children = True
-        # Or if it's a known "block" module with internal structure (like ResNet BasicBlock)
-        elif module_type in ["BasicBlock", "Bottleneck", "DenseBlock", "Transition",
-                             "SELayer"]:  # Add more known blocks
-            if len(list(current_module.children())) > 0:  # Also check if it actually contains sub-modules
-                has_displayable_children = True
-
-        node_info = {
-            "id": node_vis_id,
-            "label": f"{module_name}\n({module_type})",
-            "full_name": full_name,
-            "type": module_type,
-            "input_shape": input_shape_for_current_module,
-            "output_shape": module_output_shape,
-            "parameters": get_param_count(current_module),
-            "has_children": has_displayable_children,
-            "parent_id": parent_vis_id if parent_vis_id != input_node_id else None,  # Set parent for hierarchy
-            "level": current_level
-        }
-        nodes.append(node_info)
-
-        # Add sequential edge from previous sibling or parent to current node
-        if prev_sibling_vis_id:  # Connect from previous sibling in sequence
-            edges.append({"from": prev_sibling_vis_id, "to": node_vis_id, "type": "sequential_flow"})
-        elif parent_vis_id:  # Connect from parent (first child in a block)
-            edges.append({"from": parent_vis_id, "to": node_vis_id, "type": "parent_child"})
-
-        # Queue children for traversal, passing current node_vis_id as their parent
-        next_level_prev_sibling_id = None  # Track previous sibling for the next level
-
-        child_modules_list = []
-        for name, sub_module in current_module.named_children():
-            child_modules_list.append((name, sub_module))
-
-        # Sort children for consistent layout if order is not guaranteed (e.g. for `_modules` dict)
-        child_modules_list.sort(key=lambda x: x[0])
-
-        for name, sub_module in child_modules_list:
-            # The input shape for a child in a Sequential or typical block is the output of the *parent module itself*
-            # or the output of the previous sibling if dealing with strictly sequential children.
-            # For this hierarchical view, we'll pass the *current module's* output as the input for its children's subgraph.
-            queue.append(
-                (sub_module, node_vis_id, name, current_level + 1, module_output_shape, next_level_prev_sibling_id))
-            # Update next_level_prev_sibling_id for the next child in this sub-sequence.
-            # This is a bit tricky with simple ID generation. For now, it will predict the next ID.
-            # A more robust solution would track actual node IDs created when popped from queue.
-            # For simplicity, we just use None and let parent_child edge handle it for sub-graphs.
-            next_level_prev_sibling_id = node_vis_id  # This connects subsequent children back to their container visually if no explicit sibling edge
-            # This is more of a placeholder for direct child links.
-            # The hierarchical layout handles implicit sibling ordering.
-
-    logging.info(f"Generated graph data with {len(nodes)} nodes and {len(edges)} edges.")
-    return {"nodes": nodes, "edges": edges}
-
-
-# --- 4. 核心训练器类 ---
-class CNNTrainer:
-    def __init__(self, sio_server: socketio.AsyncServer, client_sid: str, loop: asyncio.AbstractEventLoop):
-        self.sio = sio_server
-        self.sid = client_sid
-        self.loop = loop
-        self.is_training_active = False
-
-    async def _emit_update(self, data: Dict[str, Any]):
-        log_data = {k: v for k, v in data.items() if k not in ['modelArchitectureText', 'modelGraphData']}
-        if 'modelArchitectureText' in data:
-            log_data['modelArchitectureText_length'] = len(data['modelArchitectureText'])
-        if 'modelGraphData' in data:
-            log_data['modelGraphData_nodes'] = len(data['modelGraphData'].get('nodes', []))
-            log_data['modelGraphData_edges'] = len(data['modelGraphData'].get('edges', []))
-        logging.debug(f"Emitting update to {self.sid}: {log_data}")
-        await self.sio.emit('update', data, to=self.sid)
-
-    def _visualize_tensor(self, tensor_data: torch.Tensor) -> List[str]:
-        if tensor_data is None:
-            return []
-
-        detached_data = tensor_data.detach().cpu().numpy()
-        images_base64 = []
-
-        if detached_data.ndim == 4:
-            if detached_data.shape[1] > 1:
-                data_to_visualize = detached_data[:, 0, :, :]
-            else:
-                data_to_visualize = detached_data.squeeze(1)
+inference_service = InferenceService(model_registry)
 
-        elif detached_data.ndim == 3:
-            data_to_visualize = detached_data
-        elif detached_data.ndim == 2:
-            logging.warning("2D tensor detected. Not suitable for kernel visualization.")
-            return []
-        else:
-            logging.warning(f"无法可视化形状为 {detached_data.shape} 的张量。")
-            return []
-
-        for item in data_to_visualize:
-            min_val, max_val = item.min(), item.max()
-            if max_val - min_val > 1e-9:
-                item = (item - min_val) / (max_val - min_val)
-            img_array = (item * 255).astype(np.uint8)
-            img = Image.fromarray(img_array, 'L').resize((64, 64), Image.NEAREST)
-            buffered = io.BytesIO()
-            img.save(buffered, format="PNG")
-            images_base64.append(f"data:image/png;base64,{base64.b64encode(buffered.getvalue()).decode('utf-8')}")
-        return images_base64
-
-    async def _run_training_async(self, config: Dict[str, Any]):
-        self.is_training_active = True
-        try:
-            device = "cuda" if torch.cuda.is_available() else "cpu"
-            await self._emit_update({'status': f'准备数据集... 设备: {device.upper()}'})
 
-            transform = transforms.Compose([transforms.ToTensor(), transforms.Normalize((0.5,), (0.5,))])
-            train_dataset = datasets.MNIST(root='./data', train=True, download=True, transform=transform)
+# --- 7. API 和 Socket.IO 事件处理 ---
+# 客户端连接时在 auth 中提供的 clientToken，用作训练检查点的归属，重新连接后仍可恢复自己的检查点；
+# 没有提供时退回到本次连接的 sid，检查点只能在同一连接内恢复
+client_tokens: Dict[str, str] = {}
 
-            subset_size = 10000
-            train_dataset = torch.utils.data.Subset(train_dataset, range(subset_size))
 
-            loader_kwargs = {'num_workers': 1, 'pin_memory': True} if torch.cuda.is_available() else {}
-            batch_size = config.get('trainingParams', {}).get('batchSize', 128)
-            train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True, **loader_kwargs)
+def client_checkpoint_owner(sid: str) -> str:
+    return checkpoint_owner(client_tokens.get(sid, sid))
 
-            model = ModelBuilder.build_model(config, num_classes=10).to(device)
-            logging.info(
-                f"Model built successfully. Base architecture: {config.get('modelArchitecture', {}).get('baseArchitecture')}")
 
-            # --- 生成模型结构化数据和文本摘要 ---
-            model_graph_data = model_to_json_graph(model, input_shape=(1, 28, 28))
-            model_arch_text = get_model_summary_text(model, input_size=(1, 28, 28))
+@sio.event
+async def connect(sid, environ, auth=None):
+    logging.info(f'客户端已连接: {sid}')
+    record_startup_metric('firstConnectSeconds')
+    token = (auth or {}).get('clientToken') if isinstance(auth, dict) else None
+    if isinstance(token, str) and 16 <= len(token) <= 128:
+        client_tokens[sid] = token
 
-            if "Error generating model summary" in model_arch_text:
-                logging.error(f"Failed to generate model text summary. Sending error message to frontend.")
-                await self._emit_update({'status': model_arch_text, 'error': True, 'isTrainingComplete': False})
-                return
 
-            if not model_arch_text.strip():
-                model_arch_text = "无法生成详细模型文本摘要。请确保torchinfo已安装或模型结构有效。"
-                logging.warning("Generated model text summary was empty, sending fallback message.")
-
-            await self._emit_update({
-                'modelArchitectureText': model_arch_text,
-                'modelGraphData': model_graph_data
-            })
-            logging.info(
-                f"Model architecture text (len: {len(model_arch_text)}) and graph data (nodes: {len(model_graph_data.get('nodes', []))}) sent to frontend.")
-
-            criterion = nn.CrossEntropyLoss()
-            optimizer_name = config.get('trainingParams', {}).get('optimizer', 'adam')
-            learning_rate = config.get('trainingParams', {}).get('learningRate', 0.001)
-
-            if optimizer_name == 'adam':
-                optimizer = optim.Adam(model.parameters(), lr=learning_rate)
-            elif optimizer_name == 'sgd':
-                optimizer = optim.SGD(model.parameters(), lr=learning_rate)
-            else:
-                raise ValueError(f"不支持的优化器: {optimizer_name}")
+@sio.event
+async def disconnect(sid):
+    logging.info(f'客户端已断开: {sid}')
+    client_tokens.pop(sid, None)
+    # 断开的客户端收不到进度，立即释放其排队和运行中的任务占用的算力
+    for sweep_id, task in list(active_sweeps.items()):
+        if active_sweep_owners.get(sweep_id) == sid:
+            task.cancel()
+    await training_scheduler.cancel(sid)
 
-            epochs = config.get('trainingParams', {}).get('epochs', 5)
 
-            for epoch in range(epochs):
-                if not self.is_training_active:
-                    logging.info(f"[{self.sid}] 训练被中断.")
-                    break
+@sio.event
+async def start_training(sid, config):
+    logging.info(f"[{sid}] 收到训练请求")
+    await training_scheduler.submit(sid, config, owner=client_checkpoint_owner(sid))
 
-                model.train()
-                running_loss = 0.0
-                correct_predictions = 0
-                total_samples = 0
 
-                for i, (inputs, labels) in enumerate(train_loader):
-                    if not self.is_training_active:
-                        break
-                    inputs, labels = inputs.to(device), labels.to(device)
+@sio.event
+async def stop_training(sid, data=None):
+    """停止训练：data 可带 jobId 指定任务，否则停止该客户端的全部任务；ack 返回被取消的 job_id 列表。"""
+    job_id = (data or {}).get('jobId')
+    logging.info(f"[{sid}] 收到停止训练请求: {job_id or '全部任务'}")
+    return {'cancelled': await training_scheduler.cancel(sid, job_id)}
 
-                    optimizer.zero_grad()
-                    outputs, first_conv_weights = model(inputs)
 
-                    loss = criterion(outputs, labels)
-                    loss.backward()
-                    optimizer.step()
+@sio.event
+async def resume_training(sid, data):
+    """
+    从 stop_training（或异常中断）留下的检查点继续训练，data['jobId'] 为原任务的 checkpointId。
+    与 stop_training 只能停止自己的任务一样，只能恢复同一客户端（相同 clientToken 或 sid）提交的任务的检查点。
+    """
+    checkpoint_id = (data or {}).get('jobId', '')
+    owner = client_checkpoint_owner(sid)
+    try:
+        meta = load_checkpoint_meta(checkpoint_id, owner)
+    except KeyError:
+        await sio.emit('update', {'status': f'错误: 找不到任务 {checkpoint_id} 的训练检查点', 'error': True,
+                                  'isTrainingComplete': False}, to=sid)
+        return
+    logging.info(f"[{sid}] 从检查点 {checkpoint_id} 恢复训练: epoch {meta['epoch'] + 1}，第 {meta['batch']} 个批次")
+    await training_scheduler.submit(sid, meta['config'], checkpoint_id=checkpoint_id, owner=owner)
 
-                    running_loss += loss.item() * inputs.size(0)
-                    _, predicted = torch.max(outputs.data, 1)
-                    total_samples += labels.size(0)
-                    correct_predictions += (predicted == labels).sum().item()
 
-                if not self.is_training_active:
-                    break
+@sio.event
+async def start_sweep(sid, request):
+    logging.info(f"[{sid}] 收到超参数搜索请求")
+    try:
+        sweep = HyperparameterSweep(training_scheduler, sio, sid, request or {})
+    except (ValueError, TypeError) as e:
+        await sio.emit('sweep_update', {'status': 'failed', 'error': f'搜索配置无效: {e}'}, to=sid)
+        return
+    task = asyncio.create_task(sweep.run())
+    active_sweeps[sweep.sweep_id] = task
+    active_sweep_owners[sweep.sweep_id] = sid
+    task.add_done_callback(lambda _: (active_sweeps.pop(sweep.sweep_id, None),
+                                      active_sweep_owners.pop(sweep.sweep_id, None)))
 
-                epoch_loss = running_loss / total_samples
-                epoch_accuracy = (correct_predictions / total_samples) * 100
 
-                kernel_images = self._visualize_tensor(first_conv_weights)
+@sio.event
+async def predict(sid, payload):
+    """推理请求，结果通过 Socket.IO ack 回调返回。"""
+    try:
+        return await inference_service.predict(payload or {})
+    except (ValueError, FileNotFoundError) as e:
+        return {'error': str(e)}
+    except Exception as e:
+        logging.error(f"[{sid}] 推理失败: {e}", exc_info=True)
+        return {'error': f'推理失败: {e}'}
 
-                update_data = {
-                    'epoch': epoch + 1,
-                    'loss': epoch_loss,
-                    'accuracy': epoch_accuracy,
-                    'kernels': kernel_images,
-                    'status': f'Epoch {epoch + 1}/{epochs} 完成. Loss: {epoch_loss:.4f}, Acc: {epoch_accuracy:.2f}%'
-                }
-                await self._emit_update(update_data)
 
-            if self.is_training_active:
-                torch.save(model.state_dict(), "trained_cnn_model.pth")
-                await self._emit_update({'status': '训练完成!', 'isTrainingComplete': True})
-            else:
-                await self._emit_update({'status': '训练已停止。', 'isTrainingComplete': False})
+@sio.event
+async def list_models(sid):
+    return {'models': model_registry.list_models()}
 
-        except Exception as e:
-            logging.error(f"训练过程中发生错误: {e}", exc_info=True)
-            await self._emit_update({'status': f'错误: {e}', 'error': True, 'isTrainingComplete': False})
-        finally:
-            self.is_training_active = False
 
-    def start_training_in_thread(self, config: Dict[str, Any]):
-        asyncio.run_coroutine_threadsafe(self._run_training_async(config), self.loop)
+@app.post("/api/inference/predict")
+async def inference_predict(payload: Dict[str, Any]):
+    try:
+        return await inference_service.predict(payload)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
 
 
-# --- 5. API 和 Socket.IO 事件处理 ---
-@sio.event
-async def connect(sid, environ):
-    logging.info(f'客户端已连接: {sid}')
+@app.get("/api/training/stats")
+async def training_stats():
+    """排队/运行中的训练任务数，以及各任务的核心分配。"""
+    return training_scheduler.stats()
 
 
-@sio.event
-async def disconnect(sid):
-    logging.info(f'客户端已断开: {sid}')
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 文本格式的训练服务指标。"""
+    return Response(content=training_metrics.render(training_scheduler.scrape_metrics()),
+                    media_type='text/plain; version=0.0.4; charset=utf-8')
 
 
-@sio.event
-async def start_training(sid, config):
-    logging.info(f"[{sid}] 收到训练请求")
-    current_loop = asyncio.get_running_loop()
-    trainer = CNNTrainer(sio, sid, current_loop)
-    threading.Thread(target=trainer.start_training_in_thread, args=(config,)).start()
+@app.get("/api/inference/stats")
+async def inference_stats():
+    return inference_service.stats()
 
 
-# --- 6. 启动服务器 ---
-if __name__ == '__main__':
+@app.get("/api/server/startup")
+async def server_startup():
+    return {'mode': SERVER_MODE, 'workerWarmup': WORKER_WARMUP, **startup_metrics}
+
+
+@app.get("/api/artifacts/{content_hash}")
+async def get_artifact(content_hash: str, request: Request):
+    """按内容哈希获取静态产物；内容不可变，浏览器可长期缓存，支持 gzip 时直接返回预压缩的字节。"""
+    headers = {'ETag': f'"{content_hash}"', 'Cache-Control': 'public, max-age=31536000, immutable'}
+    if request.headers.get('if-none-match') == headers['ETag']:
+        return Response(status_code=304, headers=headers)
+    entry = artifact_store.get(content_hash)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"产物不存在或已过期: {content_hash}")
+    if 'gzip' in request.headers.get('accept-encoding', ''):
+        return Response(entry['gzip'], media_type='application/json', headers={**headers, 'Content-Encoding': 'gzip'})
+    return Response(gzip.decompress(entry['gzip']), media_type='application/json', headers=headers)
+
+
+@app.get("/api/models")
+async def registry_list_models():
+    return {'models': model_registry.list_models(), 'resident': model_registry.stats()}
+
+
+@app.get("/api/models/{model_id}")
+async def registry_get_model(model_id: str):
     try:
-        import torchinfo
+        return model_registry.get_metadata(model_id)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+
 
+# Socket.IO 挂载在根路径，必须在所有 HTTP 路由注册之后挂载，否则会遮蔽这些路由
+app.mount("/", socket_app)
+# 只在服务进程的 lifespan 中记录；spawn 出的工作进程也会导入本模块
+MODULE_IMPORTED_TIME = time.time()
+
+
+# --- 8. 启动服务器 ---
+if __name__ == '__main__':
+    # 只检查是否可导入，不在启动时加载 torchinfo（它会连带导入 torch）
+    if importlib.util.find_spec('torchinfo') is not None:
         logging.info("torchinfo 库已安装，将用于生成详细的模型文本摘要。")
-    except ImportError:
+    else:
         logging.error(
             "torchinfo 库未安装！为了获得详细的模型文本摘要，请运行 'pip install torchinfo'。否则将只显示简化模型结构。")
 
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    if SERVER_MODE == 'production':
+        # 直接传入 app 对象，避免 uvicorn 再次按模块路径导入 main
+        uvicorn.run(app, host="0.0.0.0", port=8000, reload=False)
+    else:
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
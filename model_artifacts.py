@@ -0,0 +1,334 @@
+"""
+模型产物：架构配置哈希、容量有限的 LRU 缓存、按内容寻址的静态产物存储、保存训练结果的模型注册表，
+以及训练检查点的目录约定。
+本模块在导入时不加载 torch，Web 服务主进程和训练工作进程都可以直接导入；
+注册、加载模型等需要 torch 的操作在调用时才导入。
+"""
+import os
+import re
+import gzip
+import json
+import time
+import hashlib
+import threading
+import shutil
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, Callable, Iterable, List, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import torch.nn as nn
+
+
+def architecture_config_hash(config: Dict[str, Any]) -> str:
+    """
+    对配置中的 modelArchitecture 部分做规范化后计算 SHA-256。
+    只保留对所选基础架构真正生效的字段，字段顺序不影响哈希值。
+    """
+    arch = config.get('modelArchitecture', {}) or {}
+    base_arch = arch.get('baseArchitecture', 'CustomCNN')
+    canonical: Dict[str, Any] = {
+        'baseArchitecture': base_arch,
+        'fcLayer': {'numNeurons': (arch.get('fcLayer') or {}).get('numNeurons', 64)},
+    }
+    if base_arch == 'CustomCNN':
+        canonical['customLayers'] = arch.get('customLayers', [])
+    elif base_arch == 'SENet':
+        canonical['senetConfig'] = {'reduction': (arch.get('senetConfig') or {}).get('reduction', 8)}
+    payload = json.dumps(canonical, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LRUArtifactCache:
+    """按内容哈希索引、容量有限的线程安全 LRU 缓存，并统计命中/未命中次数。"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def contains(self, key: str) -> bool:
+        """只检查是否存在，不影响 LRU 顺序和命中统计。"""
+        with self._lock:
+            return key in self._entries
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries),
+                    'maxEntries': self.max_entries}
+
+
+class ContentAddressedStore:
+    """
+    按内容哈希保存较大的静态产物（模型图结构 JSON、文本摘要）。
+    每项同时保留原始对象和 gzip 压缩后的紧凑 JSON：旧客户端照常收到内联对象，
+    声明了已持有哈希的客户端可以跳过传输，其余情况发送压缩后的二进制附件。
+    """
+
+    def __init__(self, max_entries: int):
+        self._cache = LRUArtifactCache(max_entries)
+
+    @staticmethod
+    def _encode(value: Any) -> bytes:
+        return json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+    def put(self, value: Any) -> str:
+        encoded = self._encode(value)
+        content_hash = hashlib.sha256(encoded).hexdigest()
+        if not self._cache.contains(content_hash):
+            self._cache.put(content_hash, {'value': value, 'gzip': gzip.compress(encoded, compresslevel=6),
+                                           'size': len(encoded)})
+        return content_hash
+
+    def get(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        """返回 {'value', 'gzip', 'size'}；已被淘汰或不存在时返回 None。"""
+        return self._cache.get(content_hash)
+
+    def stats(self) -> Dict[str, int]:
+        return self._cache.stats()
+
+
+# --- 模型注册表 ---
+# 每次训练的结果以独立 ID 保存：<MODEL_REGISTRY_DIR>/<model_id>/{weights.pth, meta.json}，
+# meta.json 记录架构配置、架构哈希、指标和训练耗时；推理时按需加载，常驻内存的模型数量受 LRU 限制。
+MODEL_REGISTRY_DIR = os.environ.get('MODEL_REGISTRY_DIR', './model_registry')
+MODEL_REGISTRY_MAX_RESIDENT = int(os.environ.get('MODEL_REGISTRY_MAX_RESIDENT', 4))
+
+
+class ModelRegistry:
+    def __init__(self, root: str = MODEL_REGISTRY_DIR, max_resident: int = MODEL_REGISTRY_MAX_RESIDENT):
+        self.root = root
+        self._resident = LRUArtifactCache(max_resident)
+        self._index: Dict[str, Dict[str, Any]] = {}
+        self._index_mtime: Optional[float] = None
+        self._lock = threading.Lock()
+        # 量化算子的后端 (torch.backends.quantized.engine) 是进程级设置，由首个加载的量化变体选定一次
+        self._quantized_engine: Optional[str] = None
+
+    def register(self, model: "nn.Module", config: Dict[str, Any], arch_hash: str, metrics: Dict[str, Any],
+                 training_seconds: float, job_id: str,
+                 write_exports: Optional[Callable[[str], Dict[str, Any]]] = None) -> str:
+        """
+        在训练进程中调用：先写入临时目录再整体重命名，读取方不会看到不完整的条目。
+        write_exports 在权重写入之后以临时目录为参数调用，生成导出产物并返回写入元数据 'export' 的报告。
+        """
+        import torch
+
+        model_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{job_id}"
+        staging_dir = os.path.join(self.root, f".{model_id}.tmp")
+        os.makedirs(staging_dir, exist_ok=True)
+        torch.save({k: v.detach().cpu() for k, v in model.state_dict().items()},
+                   os.path.join(staging_dir, 'weights.pth'))
+        metadata = {
+            'modelId': model_id,
+            'architectureHash': arch_hash,
+            'baseArchitecture': config.get('modelArchitecture', {}).get('baseArchitecture', 'CustomCNN'),
+            'config': config,
+            'metrics': metrics,
+            'trainingSeconds': training_seconds,
+            'parameters': sum(p.numel() for p in model.parameters()),
+            'createdAt': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        if write_exports is not None:
+            metadata['export'] = write_exports(staging_dir)
+        with open(os.path.join(staging_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, ensure_ascii=False)
+        os.replace(staging_dir, os.path.join(self.root, model_id))
+        logging.info(f"模型已注册: {model_id} (架构 {arch_hash[:12]})")
+        return model_id
+
+    def _refresh_index(self):
+        """目录的 mtime 在新增条目时变化，未变化时直接复用内存中的索引。"""
+        try:
+            mtime = os.stat(self.root).st_mtime
+        except FileNotFoundError:
+            self._index, self._index_mtime = {}, None
+            return
+        if mtime == self._index_mtime:
+            return
+        index = {}
+        for model_id in os.listdir(self.root):
+            meta_path = os.path.join(self.root, model_id, 'meta.json')
+            if model_id.startswith('.') or not os.path.isfile(meta_path):
+                continue
+            try:
+                with open(meta_path, encoding='utf-8') as f:
+                    index[model_id] = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.warning(f"跳过无法读取的模型元数据 {meta_path}: {e}")
+        self._index, self._index_mtime = index, mtime
+
+    def list_models(self) -> List[Dict[str, Any]]:
+        """按创建时间倒序返回所有模型的元数据（不含完整配置），便于比较指标。"""
+        with self._lock:
+            self._refresh_index()
+            entries = sorted(self._index.values(), key=lambda m: m.get('createdAt', ''), reverse=True)
+        return [{**{k: v for k, v in m.items() if k != 'config'}, 'resident': self.is_resident(m['modelId'])}
+                for m in entries]
+
+    def get_metadata(self, model_id: str) -> Dict[str, Any]:
+        with self._lock:
+            self._refresh_index()
+            if model_id not in self._index:
+                raise KeyError(f"模型不存在: {model_id}")
+            return self._index[model_id]
+
+    def latest_model_id(self) -> Optional[str]:
+        with self._lock:
+            self._refresh_index()
+            return max(self._index, key=lambda mid: self._index[mid].get('createdAt', ''), default=None)
+
+    def is_resident(self, model_id: str) -> bool:
+        return self._resident.contains(model_id)
+
+    def _use_quantized_engine(self, engine: Optional[str]) -> bool:
+        """
+        选定进程的量化后端。后端一旦选定就不再切换（否则会改变其他常驻量化模型使用的后端），
+        导出时使用其他后端的量化变体返回 False，由调用方改为加载 float32 权重。
+        """
+        import torch
+
+        if engine is None:
+            return True
+        if self._quantized_engine is None and engine in torch.backends.quantized.supported_engines:
+            torch.backends.quantized.engine = engine
+            self._quantized_engine = engine
+        return engine == self._quantized_engine
+
+    def load(self, model_id: str) -> "nn.Module":
+        """返回常驻内存的模型；未命中时在 meta 设备上构建结构，再以 mmap 方式装入权重，超出容量时淘汰最久未用的模型。"""
+        import torch
+        from cnn_engine import ModelBuilder
+
+        model = self._resident.get(model_id)
+        if model is not None:
+            return model
+        metadata = self.get_metadata(model_id)
+        export = metadata.get('export') or {}
+        selected = next((v for v in export.get('variants', []) if v['variant'] == export.get('selected')), None)
+        if (selected is not None and selected['variant'] in ('dynamic', 'static')
+                and not self._use_quantized_engine(export.get('quantizedEngine'))):
+            logging.warning(f"模型 {model_id} 的 {selected['variant']} 变体以量化后端 {export.get('quantizedEngine')} "
+                            f"导出，服务进程不支持该后端或已选定 {self._quantized_engine}，改为加载 float32 权重")
+            selected = None
+        if selected is not None and selected['format'] == 'torchscript':
+            # 导出阶段选出的优化变体（量化 / TorchScript）比 float32 权重更快且满足精度要求，优先加载
+            from cnn_engine import ExportedModel
+
+            module = torch.jit.load(os.path.join(self.root, model_id, selected['file']), map_location='cpu')
+            model = ExportedModel(module).eval()
+            self._resident.put(model_id, model)
+            logging.info(f"模型已加载到内存: {model_id} (导出变体 {selected['variant']})，"
+                         f"常驻 {self._resident.stats()['size']}/{self._resident.max_entries}")
+            return model
+        state_dict = torch.load(os.path.join(self.root, model_id, 'weights.pth'), map_location='cpu', mmap=True)
+        with torch.device('meta'):
+            model = ModelBuilder.build_model(metadata['config'], num_classes=10)
+        model.load_state_dict(state_dict, assign=True)
+        model.eval()
+        self._resident.put(model_id, model)
+        logging.info(f"模型已加载到内存: {model_id}，常驻 {self._resident.stats()['size']}/{self._resident.max_entries}")
+        return model
+
+    def stats(self) -> Dict[str, int]:
+        return self._resident.stats()
+
+
+model_registry = ModelRegistry()
+
+
+# --- 训练检查点 ---
+# 训练过程中异步写入 <TRAINING_CHECKPOINT_DIR>/<checkpoint_id>/{checkpoint.pt, meta.json}；
+# 任务被取消、客户端断开或工作进程崩溃后可以通过 resume_training 从最近的检查点继续，训练完成后删除；
+# 一直没有恢复的检查点超过 TTL 后由调度器定期清理，总大小超过上限时从最久未写入的开始清理。
+TRAINING_CHECKPOINT_DIR = os.environ.get('TRAINING_CHECKPOINT_DIR', './training_checkpoints')
+TRAINING_CHECKPOINT_TTL_HOURS = float(os.environ.get('TRAINING_CHECKPOINT_TTL_HOURS', 24))
+TRAINING_CHECKPOINT_MAX_MB = float(os.environ.get('TRAINING_CHECKPOINT_MAX_MB', 2048))
+_CHECKPOINT_ID_PATTERN = re.compile(r'[0-9a-f]{12}')
+
+
+def training_checkpoint_dir(checkpoint_id: str) -> str:
+    """检查点 ID 即最初训练任务的 job_id；校验格式，避免客户端传入的 ID 指向其他目录。"""
+    if not isinstance(checkpoint_id, str) or not _CHECKPOINT_ID_PATTERN.fullmatch(checkpoint_id):
+        raise KeyError(f"无效的检查点 ID: {checkpoint_id!r}")
+    return os.path.join(TRAINING_CHECKPOINT_DIR, checkpoint_id)
+
+
+def checkpoint_owner(client_key: str) -> str:
+    """检查点归属：客户端标识（连接时提供的 clientToken，或 Socket.IO sid）的摘要，meta.json 中不保存原始令牌。"""
+    return hashlib.sha256(client_key.encode('utf-8')).hexdigest()[:32]
+
+
+def load_checkpoint_meta(checkpoint_id: str, owner: Optional[str] = None) -> Dict[str, Any]:
+    """
+    读取检查点元数据（配置、进度），不需要 torch；不存在时抛出 KeyError。
+    给出 owner 时只返回属于该客户端的检查点，属于其他客户端时同样抛出 KeyError，不暴露检查点是否存在。
+    """
+    meta_path = os.path.join(training_checkpoint_dir(checkpoint_id), 'meta.json')
+    try:
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        raise KeyError(f"检查点不存在: {checkpoint_id}")
+    if owner is not None and meta.get('owner') != owner:
+        raise KeyError(f"检查点不存在: {checkpoint_id}")
+    return meta
+
+
+def sweep_training_checkpoints(active_ids: Iterable[str] = (), max_age_s: Optional[float] = None,
+                               max_bytes: Optional[float] = None, now: Optional[float] = None) -> List[str]:
+    """
+    清理被放弃的训练检查点，返回删除的检查点 ID。先删除最后写入时间早于 max_age_s 的检查点，
+    剩余总大小仍超过 max_bytes 时再从最久未写入的开始删除；active_ids（排队或运行中的任务）不会被删除。
+    max_age_s / max_bytes 为 None 时使用 TRAINING_CHECKPOINT_TTL_HOURS / TRAINING_CHECKPOINT_MAX_MB，0 表示不限制。
+    """
+    if max_age_s is None:
+        max_age_s = TRAINING_CHECKPOINT_TTL_HOURS * 3600
+    if max_bytes is None:
+        max_bytes = TRAINING_CHECKPOINT_MAX_MB * 1024 * 1024
+    now = time.time() if now is None else now
+    active_ids = set(active_ids)
+    try:
+        names = os.listdir(TRAINING_CHECKPOINT_DIR)
+    except OSError:
+        return []
+    entries = []
+    for name in names:
+        directory = os.path.join(TRAINING_CHECKPOINT_DIR, name)
+        if name in active_ids or not _CHECKPOINT_ID_PATTERN.fullmatch(name) or not os.path.isdir(directory):
+            continue
+        updated, size = os.path.getmtime(directory), 0
+        for entry in os.scandir(directory):
+            if entry.is_file():
+                stat = entry.stat()
+                updated, size = max(updated, stat.st_mtime), size + stat.st_size
+        entries.append((updated, size, name))
+    entries.sort()
+    removed = []
+    total = sum(size for _, size, _ in entries)
+    for updated, size, name in entries:
+        expired = max_age_s and now - updated > max_age_s
+        if not expired and not (max_bytes and total > max_bytes):
+            continue
+        shutil.rmtree(os.path.join(TRAINING_CHECKPOINT_DIR, name), ignore_errors=True)
+        total -= size
+        removed.append(name)
+    return removed
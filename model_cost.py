@@ -0,0 +1,345 @@
+"""
+静态代价模型：不实例化任何模块，直接按 modelArchitecture 配置推算每层输出形状、参数量、
+单样本前向 FLOPs 以及给定批大小下的训练显存/内存占用。
+Web 服务主进程用它在排队前做准入检查，本模块不依赖 torch。
+"""
+import os
+import contextlib
+from typing import Dict, Any, List, Optional, Tuple
+
+MNIST_INPUT_SHAPE = (1, 28, 28)
+NUM_CLASSES = 10
+BYTES_PER_ELEMENT = 4  # float32
+MNIST_TRAIN_SIZE = 60000
+# 每个 epoch 默认使用的训练样本数；trainingParams.subsetSize = 'full' 时使用整个训练集
+DEFAULT_TRAINING_SUBSET_SIZE = 10000
+# 子集抽样方式：按类别分层 / 均匀随机 / 训练集前 N 张
+TRAINING_SAMPLING_STRATEGIES = ('stratified', 'random', 'first')
+
+# 准入预算：单个训练任务的估算内存峰值与整个训练过程的计算量（前向 + 反向约为前向的 3 倍）
+ADMISSION_MAX_MEMORY_MB = float(os.environ.get('ADMISSION_MAX_MEMORY_MB', 4096))
+ADMISSION_MAX_TRAINING_TFLOPS = float(os.environ.get('ADMISSION_MAX_TRAINING_TFLOPS', 200))
+
+# 与 cnn_engine.ACTIVATION_MAP 保持一致；未知名称在构建时回退为 ReLU
+KNOWN_ACTIVATIONS = ('ReLU', 'Sigmoid', 'Tanh', 'LeakyReLU', 'PReLU')
+# 批大小自动调优：保持有效批大小不变，微批大小 = batchSize / 梯度累积步数，微批不小于 AUTOTUNE_MIN_MICRO_BATCH
+AUTOTUNE_ACCUMULATION_STEPS = (1, 2, 4, 8)
+AUTOTUNE_MIN_MICRO_BATCH = 8
+# 每个参数需要的优化器状态份数（Adam: exp_avg + exp_avg_sq）
+OPTIMIZER_STATE_COPIES = {'adam': 2, 'sgd': 0}
+# 训练后导出阶段可选的变体 (trainingParams.exportVariants)，见 cnn_engine.ModelExporter
+EXPORT_VARIANTS = ('torchscript', 'dynamic', 'static', 'onnx')
+
+
+class ArchitectureCostError(ValueError):
+    """架构配置无效，或估算的资源占用超出准入预算。"""
+
+
+class _CostWalker:
+    """
+    沿网络结构逐层推进 (C, H, W) 形状并累计参数量、FLOPs 和需要为反向传播保存的激活元素数（均按单个样本计）。
+    在 layer() 上下文内的算子会合并为一行（用于 ResNet/DenseNet 的块），否则每个算子单独成行。
+    """
+
+    def __init__(self, input_shape: Tuple[int, ...] = MNIST_INPUT_SHAPE):
+        self.shape: Tuple[int, ...] = tuple(input_shape)
+        self.layers: List[Dict[str, Any]] = []
+        self._group: Optional[Dict[str, Any]] = None
+
+    @contextlib.contextmanager
+    def layer(self, name: str, kind: str):
+        self._group = {'name': name, 'type': kind, 'params': 0, 'flops': 0, 'activations': 0}
+        try:
+            yield
+        finally:
+            group, self._group = self._group, None
+        group['outputShape'] = list(self.shape)
+        self.layers.append(group)
+
+    def _record(self, name: str, kind: str, params: int, flops: int, activations: int):
+        if self._group is not None:
+            self._group['params'] += params
+            self._group['flops'] += flops
+            self._group['activations'] += activations
+        else:
+            self.layers.append({'name': name, 'type': kind, 'params': params, 'flops': flops,
+                                'activations': activations, 'outputShape': list(self.shape)})
+
+    def _spatial(self) -> Tuple[int, int, int]:
+        if len(self.shape) != 3:
+            raise ArchitectureCostError(f"期望 (C, H, W) 形状的特征图，实际为 {list(self.shape)}")
+        return self.shape  # type: ignore[return-value]
+
+    @staticmethod
+    def _out_dim(name: str, size: int, kernel: int, stride: int, padding: int) -> int:
+        out = (size + 2 * padding - kernel) // stride + 1
+        if out <= 0:
+            raise ArchitectureCostError(
+                f"{name}: 输入尺寸 {size} 经过 kernel={kernel}, stride={stride}, padding={padding} 后输出尺寸为 {out}")
+        return out
+
+    def conv(self, name: str, out_channels: int, kernel: int, stride: int = 1, padding: int = 0, bias: bool = True):
+        c, h, w = self._spatial()
+        oh, ow = self._out_dim(name, h, kernel, stride, padding), self._out_dim(name, w, kernel, stride, padding)
+        params = out_channels * c * kernel * kernel + (out_channels if bias else 0)
+        self.shape = (out_channels, oh, ow)
+        self._record(name, 'Conv2d', params, 2 * c * kernel * kernel * out_channels * oh * ow, out_channels * oh * ow)
+
+    def batch_norm(self, name: str):
+        c, h, w = self._spatial()
+        self._record(name, 'BatchNorm2d', 2 * c, 4 * c * h * w, c * h * w)
+
+    def activation(self, name: str, kind: str = 'ReLU', inplace: bool = False):
+        elements = 1
+        for dim in self.shape:
+            elements *= dim
+        # cnn_engine 构建的是 nn.PReLU()，所有通道共享 1 个参数
+        params = 1 if kind == 'PReLU' else 0
+        self._record(name, kind, params, elements, 0 if inplace else elements)
+
+    def pool(self, name: str, kernel: int, stride: int, padding: int = 0, kind: str = 'MaxPool2d'):
+        c, h, w = self._spatial()
+        oh, ow = self._out_dim(name, h, kernel, stride, padding), self._out_dim(name, w, kernel, stride, padding)
+        self.shape = (c, oh, ow)
+        self._record(name, kind, 0, c * oh * ow * kernel * kernel, c * oh * ow)
+
+    def global_avg_pool(self, name: str):
+        c, h, w = self._spatial()
+        self.shape = (c, 1, 1)
+        self._record(name, 'AdaptiveAvgPool2d', 0, c * h * w, c)
+
+    def flatten(self, name: str = 'flatten'):
+        elements = 1
+        for dim in self.shape:
+            elements *= dim
+        self.shape = (elements,)
+        self._record(name, 'Flatten', 0, 0, 0)
+
+    def linear(self, name: str, out_features: int, bias: bool = True):
+        if len(self.shape) != 1:
+            self.flatten()
+        in_features = self.shape[0]
+        self.shape = (out_features,)
+        self._record(name, 'Linear', in_features * out_features + (out_features if bias else 0),
+                     2 * in_features * out_features, out_features)
+
+    def squeeze_excitation(self, name: str, reduction: int):
+        c, h, w = self._spatial()
+        hidden = c // reduction
+        if hidden < 1:
+            raise ArchitectureCostError(f"{name}: 通道数 {c} 除以 reduction={reduction} 后为 0")
+        # 全局池化 -> Linear(c, c/r) -> ReLU -> Linear(c/r, c) -> Sigmoid -> 逐通道缩放
+        params = 2 * c * hidden
+        flops = c * h * w + 4 * c * hidden + 2 * c + c * h * w
+        self._record(name, 'SqueezeExcitation', params, flops, c * h * w + 2 * c + hidden)
+
+
+def _positive_int(value: Any, field: str, minimum: int = 1) -> int:
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or int(value) != value or value < minimum:
+        raise ArchitectureCostError(f"{field} 必须是不小于 {minimum} 的整数，实际为 {value!r}")
+    return int(value)
+
+
+def resolve_training_subset(training_params: Dict[str, Any], available: int = MNIST_TRAIN_SIZE) -> Tuple[int, str]:
+    """解析 trainingParams 中的 subsetSize（正整数或 'full'）与 samplingStrategy，返回 (样本数, 抽样方式)。"""
+    subset_size = training_params.get('subsetSize', DEFAULT_TRAINING_SUBSET_SIZE)
+    if subset_size == 'full':
+        subset_size = available
+    subset_size = min(_positive_int(subset_size, 'subsetSize'), available)
+    strategy = training_params.get('samplingStrategy', 'stratified')
+    if strategy not in TRAINING_SAMPLING_STRATEGIES:
+        raise ArchitectureCostError(f"不支持的抽样方式: {strategy}，可选 {', '.join(TRAINING_SAMPLING_STRATEGIES)}")
+    return subset_size, strategy
+
+
+def autotune_micro_batches(batch_size: int) -> List[int]:
+    """自动调优时可选的微批大小（从大到小），均能整除 batchSize。"""
+    batch_size = _positive_int(batch_size, 'batchSize')
+    return [batch_size // steps for steps in AUTOTUNE_ACCUMULATION_STEPS
+            if batch_size % steps == 0 and batch_size // steps >= min(AUTOTUNE_MIN_MICRO_BATCH, batch_size)]
+
+
+def _walk_custom_cnn(walker: _CostWalker, arch: Dict[str, Any]):
+    """与 cnn_engine.CustomCNN 的构建规则一致：Conv -> [BN] -> 激活 -> (尺寸 >= 2 时) MaxPool2d(2)。"""
+    layers = arch.get('customLayers', [])
+    if not isinstance(layers, list):
+        raise ArchitectureCostError("customLayers 必须是列表")
+    for i, layer in enumerate(layers, start=1):
+        if not isinstance(layer, dict):
+            raise ArchitectureCostError(f"第 {i} 层配置必须是对象")
+        try:
+            out_channels = _positive_int(layer['numFilters'], f"第 {i} 层 numFilters")
+            kernel = _positive_int(layer['kernelSize'], f"第 {i} 层 kernelSize")
+            stride = _positive_int(layer['stride'], f"第 {i} 层 stride")
+            padding = _positive_int(layer['padding'], f"第 {i} 层 padding", minimum=0)
+            activation = layer['activation']
+            batch_norm = bool(layer['batchNorm'])
+        except KeyError as e:
+            raise ArchitectureCostError(f"第 {i} 层缺少字段 {e.args[0]}")
+        walker.conv(f'conv{i}', out_channels, kernel, stride, padding)
+        if batch_norm:
+            walker.batch_norm(f'bn{i}')
+        walker.activation(f'act{i}', activation if activation in KNOWN_ACTIVATIONS else 'ReLU')
+        if walker.shape[1] >= 2:
+            walker.pool(f'pool{i}', 2, 2)
+    walker.flatten()
+
+
+def _walk_resnet18(walker: _CostWalker):
+    walker.conv('conv1', 64, 7, stride=2, padding=3, bias=False)
+    walker.batch_norm('bn1')
+    walker.activation('relu', inplace=True)
+    walker.pool('maxpool', 3, 2, padding=1)
+    in_channels = 64
+    for stage, (channels, stride) in enumerate([(64, 1), (128, 2), (256, 2), (512, 2)], start=1):
+        for block in range(2):
+            block_stride = stride if block == 0 else 1
+            with walker.layer(f'layer{stage}.{block}', 'BasicBlock'):
+                c, h, w = walker._spatial()
+                walker.conv('conv1', channels, 3, stride=block_stride, padding=1, bias=False)
+                walker.batch_norm('bn1')
+                walker.activation('relu', inplace=True)
+                walker.conv('conv2', channels, 3, padding=1, bias=False)
+                walker.batch_norm('bn2')
+                if block_stride != 1 or in_channels != channels:
+                    main_shape = walker.shape
+                    walker.shape = (c, h, w)
+                    walker.conv('downsample.0', channels, 1, stride=block_stride, bias=False)
+                    walker.batch_norm('downsample.1')
+                    walker.shape = main_shape
+                walker.activation('relu', inplace=True)
+            in_channels = channels
+    walker.global_avg_pool('avgpool')
+    walker.flatten()
+
+
+def _walk_densenet121(walker: _CostWalker, growth_rate: int = 32, bn_size: int = 4):
+    # 与 PretrainedModel 中对 28x28 输入的改造一致：conv0 为 3x3/s1，保留 pool0
+    walker.conv('features.conv0', 64, 3, stride=1, padding=1, bias=False)
+    walker.batch_norm('features.norm0')
+    walker.activation('features.relu0', inplace=True)
+    walker.pool('features.pool0', 3, 2, padding=1)
+    block_config = (6, 12, 24, 16)
+    for block_index, num_layers in enumerate(block_config, start=1):
+        for layer_index in range(1, num_layers + 1):
+            with walker.layer(f'features.denseblock{block_index}.denselayer{layer_index}', 'DenseLayer'):
+                c, h, w = walker._spatial()
+                walker.batch_norm('norm1')
+                walker.activation('relu1', inplace=True)
+                walker.conv('conv1', bn_size * growth_rate, 1, bias=False)
+                walker.batch_norm('norm2')
+                walker.activation('relu2', inplace=True)
+                walker.conv('conv2', growth_rate, 3, padding=1, bias=False)
+                # 新特征与输入在通道维拼接
+                walker.shape = (c + growth_rate, h, w)
+                walker._record('concat', 'Concat', 0, 0, (c + growth_rate) * h * w)
+        if block_index != len(block_config):
+            with walker.layer(f'features.transition{block_index}', 'Transition'):
+                walker.batch_norm('norm')
+                walker.activation('relu', inplace=True)
+                walker.conv('conv', walker.shape[0] // 2, 1, bias=False)
+                walker.pool('pool', 2, 2, kind='AvgPool2d')
+    walker.batch_norm('features.norm5')
+    walker.activation('features.relu5')
+    walker.global_avg_pool('avgpool')
+    walker.flatten()
+
+
+def _walk_senet(walker: _CostWalker, reduction: int):
+    for i, channels in enumerate((32, 64)):
+        base = i * 5
+        walker.conv(f'model.{base}', channels, 3, padding=1)
+        walker.batch_norm(f'model.{base + 1}')
+        walker.activation(f'model.{base + 2}', inplace=True)
+        walker.squeeze_excitation(f'model.{base + 3}', reduction)
+        walker.pool(f'model.{base + 4}', 2, 2)
+    walker.flatten('model.10')
+
+
+def estimate_architecture_cost(config: Dict[str, Any], batch_size: int = 1) -> Dict[str, Any]:
+    """
+    估算单个模型的代价。返回逐层形状/参数/FLOPs、参数总量、单样本前向 FLOPs，
+    以及 batch_size 下为反向传播保存的激活内存。配置无效时抛出 ArchitectureCostError。
+    """
+    arch = config.get('modelArchitecture', {}) or {}
+    base_arch = arch.get('baseArchitecture', 'CustomCNN')
+    fc_neurons = _positive_int((arch.get('fcLayer') or {}).get('numNeurons', 64), 'fcLayer.numNeurons')
+    batch_size = _positive_int(batch_size, 'batchSize')
+
+    walker = _CostWalker()
+    if base_arch == 'CustomCNN':
+        _walk_custom_cnn(walker, arch)
+    elif base_arch == 'ResNet18':
+        _walk_resnet18(walker)
+    elif base_arch == 'DenseNet121':
+        _walk_densenet121(walker)
+    elif base_arch == 'SENet':
+        reduction = _positive_int((arch.get('senetConfig') or {}).get('reduction', 8), 'senetConfig.reduction')
+        _walk_senet(walker, reduction)
+    else:
+        raise ArchitectureCostError(f"未知模型架构: {base_arch}")
+
+    # 所有架构共用的分类头：Linear -> ReLU -> Linear(num_classes)
+    walker.linear('fc1', fc_neurons)
+    walker.activation('fc_act')
+    walker.linear('fc2', NUM_CLASSES)
+
+    params = sum(layer['params'] for layer in walker.layers)
+    flops = sum(layer['flops'] for layer in walker.layers)
+    activations = sum(layer['activations'] for layer in walker.layers)
+    input_elements = MNIST_INPUT_SHAPE[0] * MNIST_INPUT_SHAPE[1] * MNIST_INPUT_SHAPE[2]
+    return {
+        'baseArchitecture': base_arch,
+        'layers': [{k: v for k, v in layer.items() if k != 'activations'} for layer in walker.layers],
+        'totalParams': params,
+        'flopsPerSample': flops,
+        'batchSize': batch_size,
+        'peakActivationBytes': (activations + input_elements) * batch_size * BYTES_PER_ELEMENT,
+    }
+
+
+def estimate_training_cost(config: Dict[str, Any]) -> Dict[str, Any]:
+    """在 estimate_architecture_cost 的基础上，按 trainingParams 估算整个训练任务的内存峰值和总计算量。"""
+    training = config.get('trainingParams', {}) or {}
+    batch_size = training.get('batchSize', 128)
+    epochs = _positive_int(training.get('epochs', 5), 'epochs')
+    optimizer = training.get('optimizer', 'adam')
+    if optimizer not in OPTIMIZER_STATE_COPIES:
+        raise ArchitectureCostError(f"不支持的优化器: {optimizer}")
+    export_variants = training.get('exportVariants') or []
+    if not isinstance(export_variants, list):
+        raise ArchitectureCostError("exportVariants 必须是列表")
+    unknown_variants = [v for v in export_variants if v not in EXPORT_VARIANTS]
+    if unknown_variants:
+        raise ArchitectureCostError(f"不支持的导出变体: {unknown_variants}，可选 {', '.join(EXPORT_VARIANTS)}")
+    max_accuracy_drop = training.get('exportMaxAccuracyDrop', 0.5)
+    if isinstance(max_accuracy_drop, bool) or not isinstance(max_accuracy_drop, (int, float)) \
+            or not max_accuracy_drop >= 0:
+        raise ArchitectureCostError(f"exportMaxAccuracyDrop 必须是不小于 0 的数，实际为 {max_accuracy_drop!r}")
+
+    # 开启自动调优时可以用梯度累积降低激活内存，按最小的候选微批估算内存峰值
+    micro_batch_size = min(autotune_micro_batches(batch_size)) if training.get('autotune') else batch_size
+    estimate = estimate_architecture_cost(config, micro_batch_size)
+    estimate['batchSize'] = batch_size
+    estimate['microBatchSize'] = micro_batch_size
+    # 权重 + 梯度 + 优化器状态
+    parameter_bytes = estimate['totalParams'] * BYTES_PER_ELEMENT * (2 + OPTIMIZER_STATE_COPIES[optimizer])
+    estimate['parameterStateBytes'] = parameter_bytes
+    estimate['trainingMemoryBytes'] = parameter_bytes + estimate['peakActivationBytes']
+    # 反向传播约为前向的 2 倍
+    subset_size, _ = resolve_training_subset(training)
+    estimate['trainingFlops'] = 3 * estimate['flopsPerSample'] * subset_size * epochs
+    return estimate
+
+
+def check_admission(estimate: Dict[str, Any], max_memory_mb: float = ADMISSION_MAX_MEMORY_MB,
+                    max_training_tflops: float = ADMISSION_MAX_TRAINING_TFLOPS):
+    """估算超出预算时抛出 ArchitectureCostError。"""
+    memory_mb = estimate['trainingMemoryBytes'] / (1024 * 1024)
+    if memory_mb > max_memory_mb:
+        raise ArchitectureCostError(
+            f"预计内存占用 {memory_mb:.0f} MB 超出预算 {max_memory_mb:.0f} MB，请减小批大小或模型规模")
+    training_tflops = estimate['trainingFlops'] / 1e12
+    if training_tflops > max_training_tflops:
+        raise ArchitectureCostError(
+            f"预计训练计算量 {training_tflops:.1f} TFLOPs 超出预算 {max_training_tflops:.0f} TFLOPs，请减少 epoch 数或模型规模")
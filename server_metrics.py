@@ -0,0 +1,163 @@
+"""
+训练服务的运行指标：计数器、仪表和直方图，以 Prometheus 文本格式 (0.0.4) 输出给 /metrics。
+所有记录操作都只是字典和列表上的加法，不加锁——主进程中只在事件循环线程里记录；
+训练工作进程用本地的 Histogram 先累计训练步耗时，随进度消息批量发回主进程合并。
+本模块不依赖 torch，也不依赖 prometheus_client。
+"""
+import os
+import bisect
+import resource
+import sys
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+# 直方图桶上界（秒或字节），+Inf 桶隐含在最后
+STEP_SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+EMIT_SECONDS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+PAYLOAD_BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+BUILD_SECONDS_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_label(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Tuple[Tuple[str, Any], ...]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in labels) + '}'
+
+
+class Histogram:
+    """
+    固定桶的累积直方图。counts[i] 为落在第 i 个桶（含 +Inf 桶）内的次数，输出时再转为累积计数。
+    drain() 取出并清零，用于工作进程把一段时间内的观测增量发回主进程；merge() 合并这样的增量。
+    """
+
+    def __init__(self, bounds: Iterable[float]):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def drain(self) -> Optional[Dict[str, Any]]:
+        if not self.count:
+            return None
+        snapshot = {'counts': self.counts, 'sum': self.sum, 'count': self.count}
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum, self.count = 0.0, 0
+        return snapshot
+
+    def merge(self, snapshot: Dict[str, Any]):
+        if len(snapshot['counts']) != len(self.counts):
+            raise ValueError("直方图桶数不一致")
+        for i, count in enumerate(snapshot['counts']):
+            self.counts[i] += count
+        self.sum += snapshot['sum']
+        self.count += snapshot['count']
+
+
+class MetricsRegistry:
+    """按名称登记指标族，每个族下按标签组合保存一个取值（计数器/仪表为 float，直方图为 Histogram）。"""
+
+    def __init__(self):
+        # name -> (type, help, bounds, {labels: value})
+        self._families: Dict[str, Tuple[str, str, Optional[Tuple[float, ...]], Dict[tuple, Any]]] = {}
+
+    def _family(self, name: str, kind: str, help_text: str, bounds: Optional[Iterable[float]] = None):
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = (kind, help_text, tuple(bounds) if bounds else None, {})
+        elif family[0] != kind:
+            raise ValueError(f"指标 {name} 已登记为 {family[0]}")
+        return family
+
+    def describe(self, name: str, kind: str, help_text: str, bounds: Optional[Iterable[float]] = None):
+        """预先登记指标族，使其在没有任何观测时也出现在输出中。"""
+        self._family(name, kind, help_text, bounds)
+
+    def inc(self, name: str, amount: float = 1.0, **labels):
+        values = self._family(name, 'counter', '')[3]
+        key = tuple(sorted(labels.items()))
+        values[key] = values.get(key, 0.0) + amount
+
+    def set(self, name: str, value: float, **labels):
+        self._family(name, 'gauge', '')[3][tuple(sorted(labels.items()))] = value
+
+    def remove(self, name: str, **labels):
+        family = self._families.get(name)
+        if family is not None:
+            family[3].pop(tuple(sorted(labels.items())), None)
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        family = self._families.get(name)
+        if family is None or family[0] != 'histogram':
+            raise KeyError(f"直方图 {name} 未登记")
+        key = tuple(sorted(labels.items()))
+        histogram = family[3].get(key)
+        if histogram is None:
+            histogram = family[3][key] = Histogram(family[2])
+        return histogram
+
+    def observe(self, name: str, value: float, **labels):
+        self.histogram(name, **labels).observe(value)
+
+    def render(self, extra: Iterable[Tuple[str, str, str, Dict[tuple, float]]] = ()) -> str:
+        """extra 为抓取时才计算的仪表：(name, type, help, {labels: value})。"""
+        lines: List[str] = []
+        families = [(name, *family) for name, family in self._families.items()]
+        families += [(name, kind, help_text, None, values) for name, kind, help_text, values in extra]
+        for name, kind, help_text, bounds, values in families:
+            if help_text:
+                lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in values.items():
+                if kind != 'histogram':
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip((*value.bounds, float('inf')), value.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_format_labels((*labels, ("le", _format_value(bound))))} '
+                                 f'{cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(value.sum)}')
+                lines.append(f'{name}_count{_format_labels(labels)} {value.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def payload_size(value: Any) -> int:
+    """update 负载按紧凑 JSON 计的近似字节数（二进制附件按原始长度），只遍历结构，不做实际序列化。"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value) + 2
+    if isinstance(value, dict):
+        return 2 + sum(len(key) + 4 + payload_size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return 2 + sum(payload_size(item) + 1 for item in value)
+    return len(str(value))
+
+
+def process_rss_bytes(pid: Any = 'self') -> Optional[int]:
+    """进程当前的常驻内存；没有 /proc 的平台上对本进程退回到峰值 RSS，其余情况返回 None。"""
+    try:
+        with open(f'/proc/{pid}/statm', encoding='ascii') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        if pid != 'self':
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 以 KB 为单位，macOS 以字节为单位
+        return peak if sys.platform == 'darwin' else peak * 1024
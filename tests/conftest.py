@@ -0,0 +1,57 @@
+import os
+import sys
+
+import pytest
+
+# 服务端模块位于仓库根目录，不是可安装的包
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def synthetic_mnist(monkeypatch):
+    """用随机像素代替 MNIST：训练集 128 张、测试集 96 张，不下载数据集。"""
+    import numpy as np
+    import torch
+    from cnn_engine import MNISTTensorCache
+    from model_artifacts import LRUArtifactCache
+
+    generator = np.random.default_rng(0)
+    splits = {train: (generator.integers(0, 256, (count, 28, 28), dtype=np.uint8),
+                      torch.from_numpy(generator.integers(0, 10, count)))
+              for train, count in ((True, 128), (False, 96))}
+    monkeypatch.setattr(MNISTTensorCache, '_splits', splits)
+    monkeypatch.setattr(MNISTTensorCache, '_class_indices', {})
+    monkeypatch.setattr(MNISTTensorCache, '_subsets', LRUArtifactCache(8))
+    return splits
+
+
+@pytest.fixture
+def training_dirs(tmp_path, monkeypatch):
+    """模型注册表、训练检查点和自动调优缓存都写到临时目录。"""
+    import cnn_engine
+    import model_artifacts
+
+    registry = model_artifacts.ModelRegistry(root=str(tmp_path / 'registry'))
+    monkeypatch.setattr(cnn_engine, 'model_registry', registry)
+    monkeypatch.setattr(model_artifacts, 'TRAINING_CHECKPOINT_DIR', str(tmp_path / 'checkpoints'))
+    monkeypatch.setattr(cnn_engine, 'AUTOTUNE_CACHE_DIR', str(tmp_path / 'autotune'))
+    return tmp_path
+
+
+@pytest.fixture
+def run_trainer(synthetic_mnist, training_dirs):
+    """在当前进程中同步运行一次训练，返回发往客户端的 update 列表。"""
+    import queue
+    from cnn_engine import CNNTrainer
+    from model_artifacts import architecture_config_hash
+
+    def run(config, job_id='0123456789ab', **kwargs):
+        progress = queue.Queue()
+        CNNTrainer(job_id, 'sid', progress).run_training(config, architecture_config_hash(config),
+                                                         skip_analysis=True, **kwargs)
+        messages = []
+        while not progress.empty():
+            messages.append(progress.get())
+        return [message[3] for message in messages if message[2] == 'update']
+
+    return run
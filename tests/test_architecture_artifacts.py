@@ -0,0 +1,91 @@
+import asyncio
+import gzip
+import json
+
+import pytest
+from fastapi import HTTPException, Request
+
+import main
+from model_artifacts import ContentAddressedStore, LRUArtifactCache
+
+GRAPH = {'nodes': [{'id': 'conv1', 'label': 'Conv2d'}], 'edges': []}
+TEXT = 'Conv2d(1, 4, kernel_size=(3, 3))'
+
+
+@pytest.fixture(autouse=True)
+def stores(monkeypatch):
+    monkeypatch.setattr(main, 'artifact_store', ContentAddressedStore(4))
+    monkeypatch.setattr(main, 'architecture_artifact_cache', LRUArtifactCache(2))
+
+
+def store(arch_hash='a' * 64):
+    return main.store_architecture_artifacts(arch_hash, {'modelArchitectureText': TEXT, 'modelGraphData': GRAPH})
+
+
+def test_content_store_is_keyed_by_canonical_json():
+    content_store = ContentAddressedStore(4)
+    first = content_store.put({'b': 1, 'a': [1, 2]})
+    assert content_store.put({'a': [1, 2], 'b': 1}) == first
+    entry = content_store.get(first)
+    assert json.loads(gzip.decompress(entry['gzip'])) == {'a': [1, 2], 'b': 1}
+    assert entry['size'] == len(b'{"a":[1,2],"b":1}')
+    assert content_store.get('0' * 64) is None
+
+
+def test_identical_artifacts_of_different_architectures_are_stored_once():
+    refs = store('a' * 64)
+    assert store('b' * 64) == refs
+    assert main.artifact_store.stats()['size'] == 2
+    assert main.architecture_artifact_cache.get('b' * 64) == refs
+
+
+def test_legacy_clients_get_inline_fields():
+    refs = store()
+    rendered = main.render_architecture_artifacts(refs)
+    assert rendered == {'artifactRefs': refs, 'modelArchitectureText': TEXT, 'modelGraphData': GRAPH}
+
+
+def test_gzip_clients_only_receive_artifacts_they_do_not_hold():
+    refs = store()
+    rendered = main.render_architecture_artifacts(refs, 'gzip', known={refs['modelArchitectureText']})
+
+    assert rendered['artifactRefs'] == refs
+    assert list(rendered['artifacts']) == [refs['modelGraphData']]
+    attachment = rendered['artifacts'][refs['modelGraphData']]
+    assert attachment['encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(attachment['data'])) == GRAPH
+    assert attachment['size'] == len(json.dumps(GRAPH, sort_keys=True, separators=(',', ':')))
+
+    as_json = main.render_architecture_artifacts(refs, 'json')
+    assert as_json['artifacts'][refs['modelArchitectureText']] == {'encoding': 'json', 'size': len(TEXT) + 2,
+                                                                   'data': TEXT}
+
+
+def test_evicted_content_cannot_be_rendered():
+    refs = store()
+    main.artifact_store._cache._entries.pop(refs['modelGraphData'])
+    assert main.render_architecture_artifacts(refs) is None
+
+
+def get_artifact(content_hash, **headers):
+    request = Request({'type': 'http', 'method': 'GET', 'path': '/',
+                       'headers': [(name.replace('_', '-').encode(), value.encode()) for name, value in headers.items()]})
+    return asyncio.run(main.get_artifact(content_hash, request))
+
+
+def test_artifact_endpoint_serves_immutable_content():
+    content_hash = store()['modelGraphData']
+
+    compressed = get_artifact(content_hash, accept_encoding='gzip, br')
+    assert compressed.headers['content-encoding'] == 'gzip'
+    assert compressed.headers['etag'] == f'"{content_hash}"'
+    assert 'immutable' in compressed.headers['cache-control']
+    assert json.loads(gzip.decompress(compressed.body)) == GRAPH
+
+    plain = get_artifact(content_hash)
+    assert 'content-encoding' not in plain.headers and json.loads(plain.body) == GRAPH
+
+    assert get_artifact(content_hash, if_none_match=f'"{content_hash}"').status_code == 304
+    with pytest.raises(HTTPException) as error:
+        get_artifact('f' * 64)
+    assert error.value.status_code == 404
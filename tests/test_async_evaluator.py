@@ -0,0 +1,79 @@
+import threading
+
+import torch
+
+from cnn_engine import AsyncEvaluator, ModelBuilder
+from model_artifacts import architecture_config_hash
+
+CONFIG = {'modelArchitecture': {'baseArchitecture': 'CustomCNN', 'fcLayer': {'numNeurons': 16}, 'customLayers': [
+    {'kernelSize': 3, 'numFilters': 4, 'stride': 1, 'padding': 1, 'activation': 'ReLU', 'batchNorm': False}]}}
+
+
+def num_threads_in_new_thread():
+    seen = []
+    thread = threading.Thread(target=lambda: seen.append(torch.get_num_threads()))
+    thread.start()
+    thread.join()
+    return seen[0]
+
+
+def test_evaluation_runs_with_its_own_thread_budget_and_restores_it(synthetic_mnist):
+    previous = torch.get_num_threads()
+    torch.set_num_threads(2)
+    seen = []
+    evaluator = AsyncEvaluator(CONFIG, architecture_config_hash(CONFIG), 'cpu',
+                               lambda update: seen.append(torch.get_num_threads()), batch_size=32, num_threads=1)
+    try:
+        evaluator.submit(1, ModelBuilder.build_model(CONFIG))
+        evaluator._futures[0].result()
+
+        # 评估期间使用 num_threads，结束后评估线程、训练线程和之后新建的线程都回到任务的线程数
+        assert seen == [1]
+        assert evaluator._executor.submit(torch.get_num_threads).result() == 2
+        assert torch.get_num_threads() == 2
+        assert num_threads_in_new_thread() == 2
+    finally:
+        evaluator.close()
+        torch.set_num_threads(previous)
+
+
+def test_finish_returns_last_epoch_and_records_wait_time(synthetic_mnist):
+    updates = []
+    evaluator = AsyncEvaluator(CONFIG, architecture_config_hash(CONFIG), 'cpu', updates.append, batch_size=32)
+    model = ModelBuilder.build_model(CONFIG)
+    evaluator.submit(1, model)
+    evaluator.submit(2, model)
+
+    result = evaluator.finish()
+
+    assert result['epoch'] == 2
+    assert [u['validation']['epoch'] for u in updates] == [1, 2]
+    assert 0 <= result['accuracy'] <= 100
+    assert evaluator.wait_ms >= 0
+
+
+def test_submit_snapshots_weights_before_training_continues(synthetic_mnist):
+    updates = []
+    evaluator = AsyncEvaluator(CONFIG, architecture_config_hash(CONFIG), 'cpu', updates.append, batch_size=32)
+    model = ModelBuilder.build_model(CONFIG)
+    expected = AsyncEvaluator(CONFIG, architecture_config_hash(CONFIG), 'cpu', lambda update: None, batch_size=32)
+    expected.submit(1, model)
+    expected = expected.finish()
+
+    evaluator.submit(1, model)
+    # 训练线程随即修改权重，不影响已提交的评估
+    with torch.no_grad():
+        for parameter in model.parameters():
+            parameter.zero_()
+    result = evaluator.finish()
+
+    assert result['loss'] == expected['loss'] and result['accuracy'] == expected['accuracy']
+
+
+def test_evaluation_error_is_logged_and_returns_none(synthetic_mnist):
+    updates = []
+    evaluator = AsyncEvaluator(CONFIG, architecture_config_hash(CONFIG), 'cpu', updates.append, batch_size=32)
+    evaluator._futures.append(evaluator._executor.submit(evaluator._evaluate, 1, {'missing': torch.zeros(1)}))
+
+    assert evaluator.finish() is None
+    assert updates == []
@@ -0,0 +1,80 @@
+import os
+import queue
+
+import pytest
+import torch
+
+import cnn_engine
+from cnn_engine import CNNTrainer, MNISTTensorCache, ModelBuilder
+from model_artifacts import architecture_config_hash
+from model_cost import ArchitectureCostError, autotune_micro_batches
+
+CONFIG = {
+    'modelArchitecture': {'baseArchitecture': 'CustomCNN', 'fcLayer': {'numNeurons': 16}, 'customLayers': [
+        {'kernelSize': 3, 'numFilters': 4, 'stride': 1, 'padding': 1, 'activation': 'ReLU', 'batchNorm': True}]},
+    'trainingParams': {'epochs': 1, 'batchSize': 32, 'subsetSize': 96, 'validateEachEpoch': False,
+                       'checkpointIntervalSec': 0},
+}
+
+
+@pytest.mark.parametrize('batch_size, micro_batches', [
+    (128, [128, 64, 32, 16]), (100, [100, 50, 25]), (12, [12]), (4, [4]), (1, [1])])
+def test_micro_batches_divide_the_batch_and_respect_the_minimum(batch_size, micro_batches):
+    assert autotune_micro_batches(batch_size) == micro_batches
+
+
+def test_micro_batches_reject_invalid_batch_size():
+    with pytest.raises(ArchitectureCostError):
+        autotune_micro_batches(0)
+
+
+def autotune(training_dirs, **kwargs):
+    model = ModelBuilder.build_model(CONFIG)
+    before = {k: v.clone() for k, v in model.state_dict().items()}
+    images, labels = MNISTTensorCache.get_split(train=True)
+    result = CNNTrainer('0' * 12, 'sid', queue.Queue())._autotune_batching(
+        model, torch.nn.CrossEntropyLoss(), CONFIG, architecture_config_hash(CONFIG), images, labels,
+        torch.arange(96), 'cpu', None, torch.contiguous_format, steps=1, **kwargs)
+    return result, model, before
+
+
+def test_autotune_measures_candidates_and_caches_the_choice(synthetic_mnist, training_dirs):
+    result, model, before = autotune(training_dirs)
+
+    assert result['cached'] is False and result['batchSize'] == 32
+    assert result['microBatchSize'] * result['accumulationSteps'] == 32
+    measured = [c for c in result['candidates'] if c['prefetch'] == 0]
+    assert [c['microBatchSize'] for c in measured] == [32, 16, 8]
+    assert all(c['samplesPerSec'] > 0 for c in result['candidates'])
+    # 最优微批再测量一次后台预取
+    assert result['candidates'][-1]['prefetch'] == cnn_engine.AUTOTUNE_PREFETCH
+    assert result['prefetch'] in (0, cnn_engine.AUTOTUNE_PREFETCH)
+    for name, value in model.state_dict().items():
+        assert torch.equal(value, before[name]), name
+    assert len(os.listdir(training_dirs / 'autotune')) == 1
+
+    cached, _, _ = autotune(training_dirs)
+    assert cached == {**result, 'cached': True}
+
+
+def test_autotune_fails_when_no_candidate_fits_in_memory(synthetic_mnist, training_dirs, monkeypatch):
+    monkeypatch.setattr(cnn_engine, 'AUTOTUNE_MAX_MEMORY_MB', 0.001)
+    with pytest.raises(RuntimeError, match='自动调优失败'):
+        autotune(training_dirs)
+    assert not os.path.exists(training_dirs / 'autotune')
+
+
+def test_training_uses_the_tuned_micro_batch(run_trainer, training_dirs, monkeypatch):
+    def tuned(*args, **kwargs):
+        return {'batchSize': 32, 'microBatchSize': 8, 'accumulationSteps': 4, 'prefetch': 2,
+                'samplesPerSec': 1000.0, 'candidates': [], 'machine': 'test', 'cached': False}
+
+    monkeypatch.setattr(CNNTrainer, '_autotune_batching', tuned)
+    config = {**CONFIG, 'trainingParams': {**CONFIG['trainingParams'], 'autotune': True, 'reportEveryBatches': 4}}
+    updates = run_trainer(config)
+
+    assert next(u['autotune'] for u in updates if 'autotune' in u)['microBatchSize'] == 8
+    # 96 个样本按微批 8 共 12 个批次
+    assert [u['progress']['batch'] for u in updates if 'progress' in u] == [4, 8, 12]
+    assert {u['progress']['totalBatches'] for u in updates if 'progress' in u} == {12}
+    assert updates[-1]['isTrainingComplete'] is True
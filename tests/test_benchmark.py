@@ -0,0 +1,59 @@
+import json
+
+import pytest
+import torch
+
+import benchmark
+
+
+@pytest.fixture(autouse=True)
+def restore_num_threads():
+    # _run_point 本应在独立子进程中运行，会修改进程的 intra-op 线程数
+    num_threads = torch.get_num_threads()
+    yield
+    torch.set_num_threads(num_threads)
+
+
+def test_run_point_reports_train_and_inference_metrics():
+    point = benchmark._run_point('CustomCNN', batch_size=4, num_threads=1, steps=2, warmup=1)
+    assert 'error' not in point
+    assert (point['architecture'], point['batchSize'], point['threads']) == ('CustomCNN', 4, 1)
+    for metric in ('trainSamplesPerSec', 'forwardMs', 'backwardMs', 'optimizerStepMs', 'trainStepMs',
+                   'inferSamplesPerSec', 'inferBatchMs', 'buildMs', 'peakRssMb'):
+        assert point[metric] > 0, metric
+    assert point['trainStepMs'] == point['forwardMs'] + point['backwardMs'] + point['optimizerStepMs']
+
+
+def test_run_point_records_errors_instead_of_raising():
+    point = benchmark._run_point('NoSuchNet', batch_size=4, num_threads=1, steps=1, warmup=0)
+    assert point['error'].startswith('KeyError')
+    assert 'peakRssMb' in point
+
+
+def _write_report(path, commit, train, infer, extra=()):
+    results = [{'architecture': 'CustomCNN', 'batchSize': 32, 'threads': 1,
+                'trainSamplesPerSec': train, 'inferSamplesPerSec': infer}, *extra]
+    path.write_text(json.dumps({'meta': {'commit': commit}, 'results': results}), encoding='utf-8')
+    return str(path)
+
+
+def test_compare_counts_only_drops_beyond_threshold(tmp_path, capsys):
+    old = _write_report(tmp_path / 'old.json', 'aaa', train=1000.0, infer=4000.0)
+    new = _write_report(tmp_path / 'new.json', 'bbb', train=850.0, infer=3800.0, extra=[
+        # 新增的测量点和出错的测量点都不参与对比
+        {'architecture': 'SENet', 'batchSize': 32, 'threads': 1, 'trainSamplesPerSec': 1.0,
+         'inferSamplesPerSec': 1.0},
+        {'architecture': 'CustomCNN', 'batchSize': 32, 'threads': 1, 'error': 'boom'},
+    ])
+
+    assert benchmark.compare_results(old, new, threshold=0.1) == 1
+    output = capsys.readouterr().out
+    assert 'aaa -> bbb' in output
+    assert output.count('REGRESSION') == 1
+    assert 'SENet' not in output
+
+    assert benchmark.compare_results(old, new, threshold=0.2) == 0
+
+
+def test_int_list_ignores_empty_items():
+    assert benchmark._int_list('32,128,') == [32, 128]
@@ -0,0 +1,60 @@
+import pytest
+import torch
+
+import cnn_engine
+from model_artifacts import LRUArtifactCache, architecture_config_hash
+
+CONFIG = {
+    'modelArchitecture': {'baseArchitecture': 'CustomCNN', 'fcLayer': {'numNeurons': 16}, 'customLayers': [
+        {'kernelSize': 3, 'numFilters': 4, 'stride': 1, 'padding': 1, 'activation': 'ReLU', 'batchNorm': True}]},
+    'trainingParams': {'epochs': 1, 'batchSize': 32, 'subsetSize': 64, 'validateEachEpoch': False,
+                       'checkpointIntervalSec': 0, 'compileMode': 'trace'},
+}
+
+
+@pytest.fixture
+def compile_cache(monkeypatch):
+    cache = LRUArtifactCache(4)
+    monkeypatch.setattr(cnn_engine, 'compiled_model_cache', cache)
+    return cache
+
+
+def _compile_update(updates):
+    return next(u['compileMode'] for u in updates if 'compileMode' in u)
+
+
+def test_traced_model_is_compiled_once_per_architecture(run_trainer, compile_cache):
+    first = _compile_update(run_trainer(CONFIG))
+    assert first['requested'] == 'trace' and first['used'] == 'trace'
+    assert first['cached'] is False and first['compileMs'] > 0
+
+    key = f"{architecture_config_hash(CONFIG)}:trace:cpu:0:0"
+    entry = compile_cache.get(key)
+    assert isinstance(entry['compiled'], torch.jit.ScriptModule)
+
+    updates = run_trainer(CONFIG, job_id='0123456789ac')
+    second = _compile_update(updates)
+    assert second['cached'] is True
+    assert second['cacheStats']['hits'] >= 1
+    assert compile_cache.get(key)['compiled'] is entry['compiled']
+    assert updates[-1]['isTrainingComplete'] is True
+
+
+def test_cached_model_restarts_from_initial_weights(run_trainer, compile_cache):
+    torch.manual_seed(0)
+    first_loss = next(u['loss'] for u in run_trainer(CONFIG) if u.get('epoch') == 1)
+    model = next(iter(compile_cache._entries.values()))['model']
+    pristine = cnn_engine.pristine_state_dict(CONFIG, architecture_config_hash(CONFIG))
+    assert any(not torch.equal(value, pristine[name]) for name, value in model.state_dict().items())
+
+    # 复用编译产物时原地装入初始权重：同一任务的第一个 epoch 结果与首次训练相同
+    torch.manual_seed(0)
+    again_loss = next(u['loss'] for u in run_trainer(CONFIG) if u.get('epoch') == 1)
+    assert again_loss == pytest.approx(first_loss)
+
+
+def test_compile_key_separates_execution_modes(run_trainer, compile_cache):
+    run_trainer(CONFIG)
+    run_trainer({**CONFIG, 'trainingParams': {**CONFIG['trainingParams'], 'channelsLast': True,
+                                              'executionProbeSteps': 1}})
+    assert compile_cache.stats()['size'] == 2
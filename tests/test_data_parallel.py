@@ -0,0 +1,89 @@
+import queue
+import socket
+import time
+
+import pytest
+import torch
+import torch.distributed as dist
+
+import cnn_engine
+from cnn_engine import BatchIndexSampler, CNNTrainer
+from model_artifacts import architecture_config_hash, checkpoint_owner, load_checkpoint_meta
+
+CONFIG = {
+    'modelArchitecture': {'baseArchitecture': 'CustomCNN', 'fcLayer': {'numNeurons': 16}, 'customLayers': [
+        {'kernelSize': 3, 'numFilters': 4, 'stride': 1, 'padding': 1, 'activation': 'ReLU', 'batchNorm': False}]},
+    'trainingParams': {'epochs': 2, 'batchSize': 32, 'subsetSize': 64, 'validateEachEpoch': False,
+                       'dataParallelWorkers': 2},
+}
+
+
+def _updates(progress):
+    messages = [progress.get() for _ in range(progress.qsize())]
+    return [message[3] for message in messages if message[2] == 'update']
+
+
+@pytest.mark.parametrize('num_replicas', [2, 3])
+def test_replicas_get_disjoint_equal_shards_of_the_same_permutation(num_replicas):
+    indices = torch.arange(100, 110)
+    samplers = [BatchIndexSampler(indices, batch_size=2, num_replicas=num_replicas, rank=rank, seed=7)
+                for rank in range(num_replicas)]
+    for sampler in samplers:
+        sampler.set_epoch(1)
+    shards = [torch.cat(list(sampler)).tolist() for sampler in samplers]
+
+    # 每个 rank 的批次数相同，否则 all_reduce 会在最后一个批次上阻塞
+    assert len({len(sampler) for sampler in samplers}) == 1
+    assert len({len(shard) for shard in shards}) == 1
+    flat = [index for shard in shards for index in shard]
+    assert len(flat) == len(set(flat)) == 10 // num_replicas * num_replicas
+
+    # 按 rank 交错分片同一个打乱顺序
+    order = indices[torch.randperm(10, generator=torch.Generator().manual_seed(8))].tolist()
+    for rank, shard in enumerate(shards):
+        assert shard == order[rank:num_replicas * (10 // num_replicas):num_replicas]
+
+
+def test_rank_loop_trains_and_registers_on_rank_zero(synthetic_mnist, training_dirs):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        init_method = f"tcp://127.0.0.1:{s.getsockname()[1]}"
+    progress = queue.Queue()
+    dist.init_process_group('gloo', init_method=init_method, rank=0, world_size=1)
+    try:
+        CNNTrainer('0123456789ab', 'sid', progress).run_data_parallel_rank(
+            CONFIG, architecture_config_hash(CONFIG), True, rank=0, world_size=1, seed=5)
+    finally:
+        dist.destroy_process_group()
+
+    updates = _updates(progress)
+    assert [u['epoch'] for u in updates if 'epoch' in u] == [1, 2]
+    assert any('progress' in u for u in updates)
+    assert updates[-1]['isTrainingComplete'] is True
+    assert cnn_engine.model_registry.latest_model_id() == updates[-1]['modelId']
+
+
+def test_data_parallel_falls_back_to_single_process_without_spare_cores(synthetic_mnist, training_dirs, monkeypatch):
+    progress = queue.Queue()
+    monkeypatch.setattr(cnn_engine, '_worker_progress_queue', progress)
+    monkeypatch.setattr(cnn_engine, '_worker_cores', [0])
+    job_id, owner, arch_hash = '0123456789ab', checkpoint_owner('client-token'), architecture_config_hash(CONFIG)
+    # 第 3 次检查取消标记（第 1 个 epoch 的第 2 个批次开始前）时停止
+    checks = []
+    monkeypatch.setattr(cnn_engine, 'is_job_cancelled', lambda _: checks.append(1) or len(checks) >= 3)
+
+    cnn_engine.run_training_job(job_id, 'sid', CONFIG, arch_hash, True, submitted_at=time.time(),
+                                checkpoint_id=job_id, owner=owner)
+
+    updates = _updates(progress)
+    assert not any('数据并行训练' in u.get('status', '') for u in updates)
+    assert any('firstStepMs' in u for u in updates)
+    assert updates[-1]['checkpointId'] == job_id
+    # 退化路径写出的检查点属于提交任务的客户端，可以被恢复
+    assert load_checkpoint_meta(job_id, owner)['batch'] == 1
+
+    monkeypatch.setattr(cnn_engine, 'is_job_cancelled', lambda _: False)
+    cnn_engine.run_training_job(job_id, 'sid', CONFIG, arch_hash, True, checkpoint_id=job_id, resume=True,
+                                owner=owner)
+
+    assert _updates(progress)[-1]['isTrainingComplete'] is True
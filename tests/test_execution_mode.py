@@ -0,0 +1,56 @@
+import queue
+
+import pytest
+import torch
+
+from cnn_engine import CNNTrainer, MNISTBatchLoader, MNISTTensorCache, ModelBuilder
+
+CONFIG = {
+    'modelArchitecture': {'baseArchitecture': 'CustomCNN', 'fcLayer': {'numNeurons': 16}, 'customLayers': [
+        {'kernelSize': 3, 'numFilters': 4, 'stride': 1, 'padding': 1, 'activation': 'ReLU', 'batchNorm': True}]},
+    'trainingParams': {'epochs': 1, 'batchSize': 32, 'subsetSize': 64, 'validateEachEpoch': False,
+                       'checkpointIntervalSec': 0},
+}
+
+
+def _loader(synthetic_mnist):
+    images, labels = MNISTTensorCache.get_split(train=True)
+    return MNISTBatchLoader(images, labels, torch.arange(64), 32, shuffle=False)
+
+
+def test_speedup_probe_restores_state_and_converts_memory_format(synthetic_mnist):
+    model = ModelBuilder.build_model(CONFIG)
+    before = {k: v.clone() for k, v in model.state_dict().items()}
+    trainer = CNNTrainer('0' * 12, 'sid', queue.Queue())
+
+    result = trainer._measure_execution_speedup(model, torch.nn.CrossEntropyLoss(), _loader(synthetic_mnist),
+                                                'cpu', torch.bfloat16, channels_last=True, steps=1)
+
+    assert result['label'] == 'bfloat16 + channels_last'
+    assert result['mixedPrecision'] == 'bfloat16' and result['channelsLast'] is True
+    assert result['fp32StepMs'] > 0 and result['modeStepMs'] > 0
+    # speedup 由未取整的耗时算出，与取整后的耗时之比可能相差最后一位
+    assert result['speedup'] == pytest.approx(result['fp32StepMs'] / result['modeStepMs'], abs=2e-3)
+    # BatchNorm 的运行统计量和权重都恢复为测量前的值
+    for name, value in model.state_dict().items():
+        assert torch.equal(value, before[name]), name
+    assert model.features[0].weight.is_contiguous(memory_format=torch.channels_last)
+    assert all(p.grad is None for p in model.parameters())
+
+
+def test_training_with_mixed_precision_and_channels_last(run_trainer):
+    config = {**CONFIG, 'trainingParams': {**CONFIG['trainingParams'], 'mixedPrecision': True,
+                                           'channelsLast': True, 'executionProbeSteps': 1}}
+    updates = run_trainer(config)
+
+    modes = [u['executionMode'] for u in updates if 'executionMode' in u]
+    assert len(modes) == 1 and modes[0]['label'] == 'bfloat16 + channels_last'
+    assert updates[-1]['isTrainingComplete'] is True
+    epoch = next(u for u in updates if u.get('epoch') == 1)
+    assert torch.isfinite(torch.tensor(epoch['loss']))
+
+
+def test_default_execution_mode_is_not_probed(run_trainer):
+    updates = run_trainer(CONFIG)
+    assert not any('executionMode' in u for u in updates)
+    assert updates[-1]['isTrainingComplete'] is True
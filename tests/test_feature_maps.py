@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+import torch
+
+import cnn_engine
+from cnn_engine import FeatureMapStreamer, ModelBuilder
+
+CONFIG = {'modelArchitecture': {'baseArchitecture': 'CustomCNN', 'fcLayer': {'numNeurons': 16}, 'customLayers': [
+    {'kernelSize': 3, 'numFilters': 20, 'stride': 1, 'padding': 1, 'activation': 'ReLU', 'batchNorm': True},
+    {'kernelSize': 3, 'numFilters': 6, 'stride': 1, 'padding': 1, 'activation': 'ReLU', 'batchNorm': False}]}}
+
+
+@pytest.fixture
+def model():
+    torch.manual_seed(0)
+    return ModelBuilder.build_model(CONFIG)
+
+
+def conv_names(model):
+    return [name for name, module in model.named_modules() if isinstance(module, torch.nn.Conv2d)]
+
+
+def test_disabled_streamer_registers_nothing(model):
+    streamer = FeatureMapStreamer(model, 'cpu', every_steps=0)
+    assert not streamer.enabled and not streamer.is_due(10)
+
+
+def test_capture_quantizes_selected_layers_without_leaving_hooks(synthetic_mnist, model):
+    streamer = FeatureMapStreamer(model, 'cpu', every_steps=5, min_interval_ms=0, max_channels=16)
+    assert [name for name, _ in streamer.layers] == conv_names(model)
+    assert streamer.probe_label == int(synthetic_mnist[False][1][0])
+    assert [streamer.is_due(step) for step in (4, 5, 10)] == [False, True, True]
+
+    model.train()
+    running_mean = model.features[1].running_mean.clone()
+    update = streamer.capture(model, epoch=2, step=5)
+
+    assert (update['epoch'], update['step'], update['probeIndex']) == (2, 5, 0)
+    first, second = update['layers']
+    # 28x28 的特征图平均池化到 14x14，通道数截断到 max_channels
+    assert (first['totalChannels'], first['channels'], first['sourceHeight'], first['height']) == (20, 16, 28, 14)
+    assert len(first['data']) == 16 * 14 * 14
+    assert (second['totalChannels'], second['channels'], second['sourceHeight'], second['height']) == (6, 6, 14, 14)
+
+    # 反量化后与直接前向得到的特征图一致（误差不超过半个量化步长）
+    captured = {}
+    handle = dict(model.named_modules())[conv_names(model)[1]].register_forward_hook(
+        lambda module, inputs, output: captured.setdefault('out', output))
+    with torch.no_grad():
+        model.eval()(streamer.probe)
+    handle.remove()
+    data = np.frombuffer(second['data'], dtype=np.uint8).reshape(6, 14, 14)
+    restored = second['min'] + torch.from_numpy(data.astype(np.float32)) * second['scale']
+    assert torch.allclose(restored, captured['out'][0], atol=second['scale'] / 2 + 1e-6)
+
+    # 钩子已移除，训练模式与 BatchNorm 统计量保持不变
+    model.train()
+    assert all(not module._forward_hooks for module in model.modules())
+    assert torch.equal(model.features[1].running_mean, running_mean)
+
+
+def test_named_layers_and_minimum_interval(synthetic_mnist, model, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cnn_engine.time, 'perf_counter', lambda: now[0])
+    streamer = FeatureMapStreamer(model, 'cpu', every_steps=1, layer_names=[conv_names(model)[1], 'missing'],
+                                  min_interval_ms=500)
+    assert [name for name, _ in streamer.layers] == [conv_names(model)[1]]
+
+    assert streamer.is_due(1)
+    streamer.capture(model, 1, 1)
+    now[0] += 0.4
+    assert not streamer.is_due(2)
+    now[0] += 0.1
+    assert streamer.is_due(3)
+
+
+def test_constant_feature_map_quantizes_to_zero():
+    streamer = FeatureMapStreamer.__new__(FeatureMapStreamer)
+    streamer.max_channels = 4
+    quantized = streamer._quantize(torch.full((1, 2, 3, 3), 7.0))
+    assert quantized['min'] == 7.0 and quantized['scale'] == 1.0
+    assert set(quantized['data']) == {0}
+
+
+def test_training_streams_feature_maps_on_sampled_steps(run_trainer):
+    config = {**CONFIG, 'trainingParams': {'epochs': 1, 'batchSize': 16, 'subsetSize': 64, 'validateEachEpoch': False,
+                                           'checkpointIntervalSec': 0, 'featureMapEverySteps': 2,
+                                           'featureMapIntervalMs': 0}}
+    streamed = [u['featureMaps'] for u in run_trainer(config) if 'featureMaps' in u]
+    assert [update['step'] for update in streamed] == [2, 4]
@@ -0,0 +1,163 @@
+import asyncio
+import math
+import os
+import random
+
+import pytest
+
+import main
+from main import HyperparameterSweep, apply_search_value, sample_search_value
+
+BASE_CONFIG = {'modelArchitecture': {'baseArchitecture': 'CustomCNN'}, 'trainingParams': {'batchSize': 32}}
+
+
+class RecordingSio:
+    def __init__(self):
+        self.events = []
+
+    async def emit(self, event, data, to=None):
+        self.events.append((event, to, data))
+
+
+class FakeTrialScheduler:
+    """按学习率直接给出验证准确率，并像工作进程一样写出试验检查点。"""
+
+    def __init__(self, max_workers=1, failing=()):
+        self.max_workers = max_workers
+        self.failing = set(failing)
+        self.segments = []
+
+    async def run_trial_segment(self, sid, config, start_epoch, end_epoch, checkpoint_path):
+        await asyncio.sleep(0)
+        learning_rate = config['trainingParams']['learningRate']
+        self.segments.append((learning_rate, start_epoch, end_epoch))
+        if learning_rate in self.failing:
+            raise RuntimeError('boom')
+        with open(checkpoint_path, 'w') as f:
+            f.write(str(end_epoch))
+        return {'valAccuracy': learning_rate * 100, 'valLoss': 1 - learning_rate}
+
+
+@pytest.fixture(autouse=True)
+def sweep_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'SWEEP_CHECKPOINT_DIR', str(tmp_path))
+    return tmp_path
+
+
+def make_sweep(scheduler, **request):
+    request = {'baseConfig': BASE_CONFIG, 'seed': 1, 'numTrials': 9, 'minEpochs': 1, 'maxEpochs': 9,
+               'reductionFactor': 3, 'parallelism': 1,
+               'searchSpace': {'trainingParams.learningRate': {'type': 'uniform', 'low': 0.0, 'high': 1.0}},
+               **request}
+    return HyperparameterSweep(scheduler, RecordingSio(), 'sid', request)
+
+
+def test_sample_search_value_kinds():
+    rng = random.Random(0)
+    assert sample_search_value([16, 32], rng) in (16, 32)
+    assert sample_search_value({'type': 'choice', 'values': ['adam']}, rng) == 'adam'
+    assert 0.5 <= sample_search_value({'type': 'uniform', 'low': 0.5, 'high': 0.6}, rng) <= 0.6
+    value = sample_search_value({'type': 'loguniform', 'low': 1e-4, 'high': 1e-2}, rng)
+    assert math.log(1e-4) <= math.log(value) <= math.log(1e-2)
+    assert sample_search_value({'type': 'int', 'low': 3, 'high': 3}, rng) == 3
+
+    # 候选值被深拷贝，修改采样结果不影响搜索空间
+    layers = [[{'numFilters': 8}]]
+    sample_search_value(layers, rng)[0]['numFilters'] = 99
+    assert layers[0][0]['numFilters'] == 8
+
+
+@pytest.mark.parametrize('spec', [[], 'adam', {'type': 'uniform', 'low': 2, 'high': 1},
+                                  {'type': 'loguniform', 'low': 0, 'high': 1}, {'type': 'normal', 'low': 0, 'high': 1}])
+def test_sample_search_value_rejects_invalid_specs(spec):
+    with pytest.raises(ValueError):
+        sample_search_value(spec, random.Random(0))
+
+
+def test_apply_search_value_creates_nested_keys_and_rejects_other_roots():
+    config = {'trainingParams': {'epochs': 2}}
+    apply_search_value(config, 'trainingParams.learningRate', 0.01)
+    apply_search_value(config, 'modelArchitecture.fcLayer.numNeurons', 64)
+    assert config == {'trainingParams': {'epochs': 2, 'learningRate': 0.01},
+                      'modelArchitecture': {'fcLayer': {'numNeurons': 64}}}
+    with pytest.raises(ValueError):
+        apply_search_value(config, 'seed', 1)
+
+
+def test_rung_budgets_and_request_validation():
+    scheduler = FakeTrialScheduler(max_workers=2)
+    assert make_sweep(scheduler).rung_epochs == [1, 3, 9]
+    assert make_sweep(scheduler, minEpochs=2, maxEpochs=10, reductionFactor=2).rung_epochs == [2, 4, 8, 10]
+    # 并发度不超过调度器的工作进程数
+    assert make_sweep(scheduler, parallelism=8).parallelism == 2
+    with pytest.raises(ValueError):
+        make_sweep(scheduler, searchSpace={})
+    with pytest.raises(ValueError):
+        make_sweep(scheduler, numTrials=main.SWEEP_MAX_TRIALS + 1)
+
+
+def test_asha_promotes_top_trials_and_keeps_only_best_checkpoint(sweep_dir):
+    scheduler = FakeTrialScheduler()
+    sweep = make_sweep(scheduler)
+    asyncio.run(sweep.run())
+
+    best = max(sweep.trials, key=lambda t: t.params['trainingParams.learningRate'])
+    statuses = [t.status for t in sweep.trials]
+    assert statuses.count('completed') == 1 and best.status == 'completed' and best.epochs == 9
+    assert statuses.count('stopped') == 8
+    # 9 个试验训练 1 个 epoch，3 个晋级到 3 个 epoch，1 个晋级到 9 个 epoch
+    assert sorted(t.epochs for t in sweep.trials) == [1] * 6 + [3] * 2 + [9]
+    assert sweep.epochs_used == 9 * 1 + 3 * 2 + 1 * 6
+    # 晋级的试验从上一梯级的检查点继续训练
+    assert {(start, end) for _, start, end in scheduler.segments} == {(0, 1), (1, 3), (3, 9)}
+    assert [(start, end) for lr, start, end in scheduler.segments if lr == best.params[
+        'trainingParams.learningRate']] == [(0, 1), (1, 3), (3, 9)]
+
+    assert os.listdir(sweep.checkpoint_dir) == [os.path.basename(best.checkpoint_path)]
+    event, to, final = sweep.sio.events[-1]
+    assert (event, to, final['status']) == ('sweep_update', 'sid', 'completed')
+    assert final['best']['trialId'] == best.trial_id
+    assert final['exhaustiveEpochs'] == 81 and final['epochsUsed'] == 21
+    assert final['leaderboard'][0]['trialId'] == best.trial_id
+
+
+def test_failed_trials_are_reported_and_never_promoted():
+    probe = make_sweep(FakeTrialScheduler())
+    best_lr = max(t.params['trainingParams.learningRate'] for t in probe.trials)
+    scheduler = FakeTrialScheduler(failing={best_lr})
+    sweep = make_sweep(scheduler)
+    asyncio.run(sweep.run())
+
+    failed = [t for t in sweep.trials if t.status == 'failed']
+    assert len(failed) == 1 and failed[0].error == 'boom' and failed[0].epochs == 0
+    assert failed[0].to_dict()['error'] == 'boom'
+    assert [seg for seg in scheduler.segments if seg[0] == best_lr] == [(best_lr, 0, 1)]
+    assert sum(t.status == 'completed' for t in sweep.trials) == 1
+
+
+def test_default_sweep_keeps_best_trial_of_highest_rung_reached(sweep_dir):
+    request = {'baseConfig': BASE_CONFIG, 'seed': 3,
+               'searchSpace': {'trainingParams.learningRate': {'type': 'uniform', 'low': 0.0, 'high': 1.0}}}
+    sweep = HyperparameterSweep(FakeTrialScheduler(max_workers=8), RecordingSio(), 'sid', request)
+    asyncio.run(sweep.run())
+
+    # 默认 8 个试验、reductionFactor 3 且全部并发：梯级 1 只有 2 个试验，没有试验晋级到最高梯级
+    assert sweep.rung_epochs == [1, 3, 4]
+    assert [len(rung) for rung in sweep.rungs] == [8, 2, 0]
+    leaders = [t for t in sweep.trials if t.rung == 1]
+    best = max(leaders, key=lambda t: t.metrics['valAccuracy'])
+    assert os.listdir(sweep.checkpoint_dir) == [os.path.basename(best.checkpoint_path)]
+    final = sweep.sio.events[-1][2]
+    assert final['status'] == 'completed'
+    assert (final['best']['trialId'], final['best']['epochs']) == (best.trial_id, 3)
+    assert final['bestCheckpoint'] == best.checkpoint_path
+
+
+def test_sweep_without_any_finished_trial_fails():
+    probe = make_sweep(FakeTrialScheduler(), numTrials=2)
+    sweep = make_sweep(FakeTrialScheduler(failing={t.params['trainingParams.learningRate'] for t in probe.trials}),
+                       numTrials=2)
+    asyncio.run(sweep.run())
+
+    final = sweep.sio.events[-1][2]
+    assert final['status'] == 'failed' and 'best' not in final
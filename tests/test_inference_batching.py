@@ -0,0 +1,156 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import torch
+
+from cnn_engine import ModelBuilder, summarize_predictions
+from main import DynamicBatcher, InferenceService
+from model_artifacts import ModelRegistry
+
+CONFIG = {'modelArchitecture': {'baseArchitecture': 'CustomCNN', 'fcLayer': {'numNeurons': 16}, 'customLayers': [
+    {'kernelSize': 3, 'numFilters': 4, 'stride': 1, 'padding': 1, 'activation': 'ReLU', 'batchNorm': False}]}}
+
+
+class RecordingModel(torch.nn.Module):
+    """logits 取每张图片左上角的 10 个像素，记录每次前向的批大小。"""
+
+    def __init__(self, fail=False):
+        super().__init__()
+        self.batch_sizes = []
+        self.fail = fail
+
+    def forward(self, inputs):
+        self.batch_sizes.append(len(inputs))
+        if self.fail:
+            raise RuntimeError('forward failed')
+        return inputs[:, 0, 0, :10], None
+
+
+def images(count, label):
+    batch = torch.zeros(count, 1, 28, 28)
+    batch[:, 0, 0, label] = 10.0
+    return batch
+
+
+async def predict_concurrently(batcher, requests):
+    try:
+        return await asyncio.gather(*(batcher.predict(r) for r in requests), return_exceptions=True)
+    finally:
+        batcher.close()
+
+
+def test_concurrent_requests_share_one_forward_and_get_their_own_rows():
+    model = RecordingModel()
+    with ThreadPoolExecutor(1) as executor:
+        batcher = DynamicBatcher(model, executor, max_batch_size=8, max_wait_ms=200)
+        results = asyncio.run(predict_concurrently(batcher, [images(1, 3), images(2, 5), images(3, 7)]))
+
+    assert model.batch_sizes == [6]
+    assert [tuple(r.shape) for r in results] == [(1, 10), (2, 10), (3, 10)]
+    assert [r.argmax(dim=1).tolist() for r in results] == [[3], [5, 5], [7, 7, 7]]
+    assert torch.allclose(results[1].sum(dim=1), torch.ones(2))
+    stats = batcher.stats()
+    assert (stats['requests'], stats['images'], stats['meanBatchSize']) == (3, 6, 6)
+    assert stats['p50LatencyMs'] is not None and stats['maxWaitMs'] == 200
+
+
+def test_request_that_would_overflow_the_batch_starts_the_next_one():
+    model = RecordingModel()
+    with ThreadPoolExecutor(1) as executor:
+        batcher = DynamicBatcher(model, executor, max_batch_size=4, max_wait_ms=200)
+        results = asyncio.run(predict_concurrently(batcher, [images(3, 1), images(3, 2), images(6, 4)]))
+
+    # 单个请求超过 max_batch_size 时单独成批
+    assert model.batch_sizes == [3, 3, 6]
+    assert [r.argmax(dim=1).tolist() for r in results] == [[1] * 3, [2] * 3, [4] * 6]
+    assert batcher.stats()['meanBatchSize'] == 4
+
+
+def test_forward_error_fails_every_request_in_the_batch():
+    with ThreadPoolExecutor(1) as executor:
+        batcher = DynamicBatcher(RecordingModel(fail=True), executor, max_batch_size=8, max_wait_ms=100)
+        results = asyncio.run(predict_concurrently(batcher, [images(1, 0), images(1, 1)]))
+
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert batcher.stats()['requests'] == 0
+
+
+def test_summarize_predictions():
+    rows = summarize_predictions(torch.tensor([[0.1, 0.7, 0.2], [0.6, 0.3, 0.1]]))
+    assert [(r['label'], r['confidence']) for r in rows] == [(1, pytest.approx(0.7)), (0, pytest.approx(0.6))]
+    assert rows[0]['probabilities'] == pytest.approx([0.1, 0.7, 0.2])
+
+
+def test_inference_service_serves_latest_registered_model(tmp_path):
+    registry = ModelRegistry(root=str(tmp_path), max_resident=1)
+    service = InferenceService(registry)
+
+    async def scenario():
+        with pytest.raises(FileNotFoundError):
+            await service.predict({'pixels': torch.zeros(28, 28).tolist()})
+        model_id = registry.register(ModelBuilder.build_model(CONFIG), CONFIG, 'hash', {}, 1.0, 'a' * 12)
+        result = await service.predict({'pixels': torch.zeros(2, 28, 28).tolist()})
+        with pytest.raises(FileNotFoundError):
+            await service.predict({'pixels': torch.zeros(28, 28).tolist(), 'modelId': 'missing'})
+        return model_id, result
+
+    try:
+        model_id, result = asyncio.run(scenario())
+    finally:
+        service.shutdown()
+
+    assert result['modelId'] == model_id
+    assert len(result['predictions']) == 2 and result['latencyMs'] >= 0
+    assert sum(result['predictions'][0]['probabilities']) == pytest.approx(1.0)
+    assert service.stats()['models'] == {}
+
+
+def test_close_finishes_queued_requests_and_rejects_new_ones():
+    model = RecordingModel()
+
+    async def scenario():
+        batcher = DynamicBatcher(model, executor, max_batch_size=8, max_wait_ms=10_000)
+        requests = [asyncio.ensure_future(batcher.predict(images(1, label))) for label in (2, 4)]
+        await asyncio.sleep(0.05)
+        batcher.close()
+        results = await asyncio.wait_for(asyncio.gather(*requests), 5)
+        with pytest.raises(RuntimeError):
+            await batcher.predict(images(1, 0))
+        return results
+
+    with ThreadPoolExecutor(1) as executor:
+        results = asyncio.run(scenario())
+
+    # 等待窗口尚未结束，close() 使已入队的请求立即成批执行
+    assert model.batch_sizes == [2]
+    assert [r.argmax(dim=1).tolist() for r in results] == [[2], [4]]
+
+
+def test_evicting_a_model_completes_its_in_flight_request(tmp_path, monkeypatch):
+    import functools
+    import main
+
+    monkeypatch.setattr(main, 'DynamicBatcher', functools.partial(DynamicBatcher, max_wait_ms=10_000))
+    registry = ModelRegistry(root=str(tmp_path), max_resident=1)
+    service = InferenceService(registry)
+    first = registry.register(ModelBuilder.build_model(CONFIG), CONFIG, 'hash', {}, 1.0, 'a' * 12)
+    second = registry.register(ModelBuilder.build_model(CONFIG), CONFIG, 'hash', {}, 1.0, 'b' * 12)
+    payload = {'pixels': torch.zeros(28, 28).tolist()}
+
+    async def scenario():
+        in_flight = asyncio.ensure_future(service.predict({**payload, 'modelId': first}))
+        await asyncio.sleep(0.2)
+        # 加载第二个模型会把第一个模型淘汰出常驻集合，并关闭其批处理队列
+        other = asyncio.ensure_future(service.predict({**payload, 'modelId': second}))
+        result = await asyncio.wait_for(in_flight, 5)
+        assert list(service._batchers) == [second]
+        other.cancel()
+        return result
+
+    try:
+        result = asyncio.run(scenario())
+    finally:
+        service.shutdown()
+
+    assert result['modelId'] == first and len(result['predictions']) == 1
@@ -0,0 +1,39 @@
+import base64
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from cnn_engine import decode_inference_images
+
+
+def encode_png(array):
+    buffer = io.BytesIO()
+    Image.fromarray(array).save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def test_decodes_and_resizes_images():
+    batch = decode_inference_images({'images': [encode_png(np.zeros((28, 28), np.uint8)),
+                                                encode_png(np.full((56, 56), 255, np.uint8))]})
+    assert tuple(batch.shape) == (2, 1, 28, 28)
+    assert batch[1].mean() > batch[0].mean()
+
+
+@pytest.mark.parametrize('encoded', [base64.b64encode(b'not an image').decode('ascii'), 'abc', 42],
+                         ids=['valid-base64-not-image', 'bad-padding', 'not-a-string'])
+def test_undecodable_images_raise_value_error(encoded):
+    with pytest.raises(ValueError, match='第 2 张图片无法解码'):
+        decode_inference_images({'images': [encode_png(np.zeros((28, 28), np.uint8)), encoded]})
+
+
+@pytest.mark.parametrize('payload', [{}, {'images': []}, {'pixels': np.zeros((27, 28)).tolist()}])
+def test_invalid_payloads_raise_value_error(payload):
+    with pytest.raises(ValueError):
+        decode_inference_images(payload)
+
+
+def test_pixels_are_clipped_and_batched():
+    batch = decode_inference_images({'pixels': np.full((28, 28), 300.0).tolist()})
+    assert tuple(batch.shape) == (1, 1, 28, 28)
@@ -0,0 +1,51 @@
+import io
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from cnn_engine import CNNTrainer
+
+
+@pytest.fixture
+def trainer():
+    return CNNTrainer('0' * 12, 'sid', progress_queue=None)
+
+
+def kernels(count, size=3, channels=2):
+    return torch.arange(count * channels * size * size, dtype=torch.float32).reshape(count, channels, size, size)
+
+
+def test_raw_sprite_lays_out_normalized_first_channel_tiles(trainer):
+    weights = kernels(5)
+    sprite = trainer._render_kernel_sprite(weights, 'raw')
+
+    assert (sprite['count'], sprite['cols'], sprite['rows']) == (5, 3, 2)
+    assert (sprite['width'], sprite['height']) == (9, 6)
+    assert sprite['tiles'] == [[0, 0], [3, 0], [6, 0], [0, 3], [3, 3]]
+    grid = np.frombuffer(sprite['image'], dtype=np.uint8).reshape(sprite['height'], sprite['width'])
+    x, y = sprite['tiles'][4]
+    tile = grid[y:y + 3, x:x + 3]
+    # 每个卷积核单独归一化到 0..255，只取第一个输入通道
+    assert tile.min() == 0 and tile.max() == 255
+    assert np.array_equal(np.argsort(tile, axis=None), np.argsort(weights[4, 0].numpy(), axis=None))
+    # 网格中多出的空位保持为 0
+    assert not grid[3:, 6:].any()
+
+
+def test_png_sprite_decodes_to_the_same_pixels(trainer):
+    weights = kernels(4)
+    raw = trainer._render_kernel_sprite(weights, 'raw')
+    png = trainer._render_kernel_sprite(weights, 'png')
+
+    assert png['mimeType'] == 'image/png'
+    decoded = np.asarray(Image.open(io.BytesIO(png['image'])))
+    assert decoded.tobytes() == raw['image']
+
+
+def test_constant_kernels_render_black_and_unsupported_shapes_are_skipped(trainer):
+    sprite = trainer._render_kernel_sprite(torch.ones(2, 1, 3, 3), 'raw')
+    assert sprite['image'] == bytes(2 * 9)
+    assert trainer._render_kernel_sprite(torch.ones(3, 3), 'raw') is None
+    assert trainer._render_kernel_sprite(None) is None
@@ -0,0 +1,80 @@
+import threading
+
+import numpy as np
+import pytest
+import torch
+
+import cnn_engine
+from cnn_engine import BatchIndexSampler, MNISTBatchLoader, MNISTTensorCache, normalize_mnist_batch
+
+
+def test_get_split_memory_maps_the_exported_cache(tmp_path, monkeypatch):
+    images = np.arange(3 * 28 * 28, dtype=np.uint8).reshape(3, 28, 28)
+    np.save(tmp_path / 'test_images_u8.npy', images)
+    np.save(tmp_path / 'test_labels.npy', np.array([7, 1, 4], dtype=np.int64))
+    monkeypatch.setattr(cnn_engine, 'MNIST_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(MNISTTensorCache, '_splits', {})
+
+    cached_images, labels = MNISTTensorCache.get_split(train=False)
+
+    assert isinstance(cached_images, np.memmap) and not cached_images.flags.writeable
+    np.testing.assert_array_equal(cached_images, images)
+    assert labels.tolist() == [7, 1, 4]
+    assert MNISTTensorCache.get_split(train=False)[0] is cached_images
+
+
+def test_normalize_matches_to_tensor_and_normalize():
+    batch = normalize_mnist_batch(torch.tensor([[[0, 255]]], dtype=torch.uint8).expand(1, 28, 2).contiguous())
+    assert tuple(batch.shape) == (1, 1, 28, 2)
+    assert batch[0, 0, 0].tolist() == pytest.approx([-1.0, 1.0])
+
+
+@pytest.mark.parametrize('drop_last', [False, True])
+def test_sampler_visits_every_index_once_per_epoch(drop_last):
+    sampler = BatchIndexSampler(torch.arange(10, 20), batch_size=4, drop_last=drop_last, seed=3)
+    batches = list(sampler)
+
+    assert len(batches) == len(sampler) == (2 if drop_last else 3)
+    seen = torch.cat(batches).tolist()
+    assert len(seen) == len(set(seen)) == (8 if drop_last else 10)
+    assert set(seen) <= set(range(10, 20))
+
+
+def test_seeded_sampler_is_reproducible_and_changes_per_epoch():
+    first, second = (BatchIndexSampler(torch.arange(32), batch_size=8, seed=5) for _ in range(2))
+    assert [b.tolist() for b in first] == [b.tolist() for b in second]
+    epoch0 = torch.cat(list(first)).tolist()
+    first.set_epoch(1)
+    assert torch.cat(list(first)).tolist() != epoch0
+
+
+def test_loader_returns_images_and_labels_for_sampled_indices(synthetic_mnist):
+    images, labels = synthetic_mnist[True]
+    loader = MNISTBatchLoader(images, labels, torch.arange(16, 40), batch_size=10, shuffle=False)
+
+    batches = list(loader)
+
+    assert [len(targets) for _, targets in batches] == [10, 10, 4]
+    inputs, targets = batches[1]
+    assert torch.equal(targets, labels[26:36])
+    assert torch.equal(inputs, normalize_mnist_batch(torch.from_numpy(images[26:36])))
+
+
+def test_prefetching_yields_the_same_batches(synthetic_mnist):
+    images, labels = synthetic_mnist[True]
+    plain = MNISTBatchLoader(images, labels, torch.arange(64), batch_size=16, seed=1)
+    prefetched = MNISTBatchLoader(images, labels, torch.arange(64), batch_size=16, seed=1, prefetch=2)
+
+    for (a_inputs, a_targets), (b_inputs, b_targets) in zip(plain, prefetched, strict=True):
+        assert torch.equal(a_inputs, b_inputs) and torch.equal(a_targets, b_targets)
+
+
+def test_breaking_out_of_a_prefetching_loader_stops_the_producer(synthetic_mnist):
+    images, labels = synthetic_mnist[True]
+    loader = MNISTBatchLoader(images, labels, torch.arange(128), batch_size=8, prefetch=1)
+
+    iterator = iter(loader)
+    next(iterator)
+    iterator.close()
+
+    assert not any(t.name == 'mnist-prefetch' and t.is_alive() for t in threading.enumerate())
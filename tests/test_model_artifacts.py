@@ -0,0 +1,123 @@
+import json
+import os
+
+import pytest
+
+import model_artifacts
+from model_artifacts import checkpoint_owner, load_checkpoint_meta
+
+
+@pytest.fixture
+def checkpoint_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_artifacts, 'TRAINING_CHECKPOINT_DIR', str(tmp_path))
+    return tmp_path
+
+
+def write_checkpoint_meta(root, checkpoint_id, **meta):
+    directory = root / checkpoint_id
+    directory.mkdir()
+    (directory / 'meta.json').write_text(json.dumps({'checkpointId': checkpoint_id, **meta}), encoding='utf-8')
+    return directory
+
+
+def test_load_checkpoint_meta_only_returns_own_checkpoints(checkpoint_root):
+    owner = checkpoint_owner('client-token-aaaaaaaa')
+    write_checkpoint_meta(checkpoint_root, 'a' * 12, owner=owner, epoch=1, batch=20)
+
+    assert load_checkpoint_meta('a' * 12, owner)['batch'] == 20
+    with pytest.raises(KeyError):
+        load_checkpoint_meta('a' * 12, checkpoint_owner('client-token-bbbbbbbb'))
+
+
+def test_checkpoint_without_owner_cannot_be_resumed_by_anyone(checkpoint_root):
+    write_checkpoint_meta(checkpoint_root, 'b' * 12, epoch=0, batch=5)
+
+    with pytest.raises(KeyError):
+        load_checkpoint_meta('b' * 12, checkpoint_owner('some-sid'))
+
+
+def test_checkpoint_owner_does_not_store_raw_token():
+    token = 'client-token-cccccccc'
+    assert token not in checkpoint_owner(token)
+    assert checkpoint_owner(token) == checkpoint_owner(token)
+
+
+def write_checkpoint(root, checkpoint_id, size, updated):
+    directory = write_checkpoint_meta(root, checkpoint_id)
+    (directory / 'checkpoint.pt').write_bytes(b'\0' * size)
+    for path in (directory / 'meta.json', directory / 'checkpoint.pt', directory):
+        os.utime(path, (updated, updated))
+
+
+def test_sweep_removes_checkpoints_older_than_ttl(checkpoint_root):
+    now = 1_000_000.0
+    write_checkpoint(checkpoint_root, '1' * 12, 10, now - 7200)
+    write_checkpoint(checkpoint_root, '2' * 12, 10, now - 60)
+
+    removed = model_artifacts.sweep_training_checkpoints(max_age_s=3600, max_bytes=0, now=now)
+
+    assert removed == ['1' * 12]
+    assert sorted(os.listdir(checkpoint_root)) == ['2' * 12]
+
+
+def test_sweep_evicts_least_recently_written_until_under_size_cap(checkpoint_root):
+    now = 1_000_000.0
+    write_checkpoint(checkpoint_root, '1' * 12, 1000, now - 300)
+    write_checkpoint(checkpoint_root, '2' * 12, 1000, now - 200)
+    write_checkpoint(checkpoint_root, '3' * 12, 1000, now - 100)
+
+    removed = model_artifacts.sweep_training_checkpoints(max_age_s=0, max_bytes=2200, now=now)
+
+    assert removed == ['1' * 12]
+    assert sorted(os.listdir(checkpoint_root)) == ['2' * 12, '3' * 12]
+
+
+def test_sweep_keeps_active_checkpoints_and_foreign_entries(checkpoint_root):
+    now = 1_000_000.0
+    write_checkpoint(checkpoint_root, '1' * 12, 10, now - 7200)
+    (checkpoint_root / 'notes').mkdir()
+
+    removed = model_artifacts.sweep_training_checkpoints(active_ids=['1' * 12], max_age_s=3600, now=now)
+
+    assert removed == []
+    assert sorted(os.listdir(checkpoint_root)) == ['1' * 12, 'notes']
+
+
+def test_sweep_without_checkpoint_dir_is_a_no_op(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_artifacts, 'TRAINING_CHECKPOINT_DIR', str(tmp_path / 'missing'))
+    assert model_artifacts.sweep_training_checkpoints() == []
+
+
+def test_architecture_hash_ignores_key_order_and_unused_fields():
+    from model_artifacts import architecture_config_hash
+
+    layers = [{'kernelSize': 3, 'numFilters': 8, 'stride': 1, 'padding': 1, 'activation': 'ReLU', 'batchNorm': True}]
+    config = {'modelArchitecture': {'baseArchitecture': 'CustomCNN', 'customLayers': layers,
+                                    'fcLayer': {'numNeurons': 64}}, 'trainingParams': {'epochs': 3}}
+    reordered = {'trainingParams': {'epochs': 9},
+                 'modelArchitecture': {'fcLayer': {'numNeurons': 64}, 'senetConfig': {'reduction': 2},
+                                       'customLayers': [dict(reversed(list(layers[0].items())))],
+                                       'baseArchitecture': 'CustomCNN'}}
+
+    assert architecture_config_hash(config) == architecture_config_hash(reordered)
+    # fcLayer 缺省为 64 个神经元
+    assert architecture_config_hash(config) == architecture_config_hash(
+        {'modelArchitecture': {'baseArchitecture': 'CustomCNN', 'customLayers': layers}})
+    resnet = {'modelArchitecture': {'baseArchitecture': 'ResNet18', 'customLayers': layers}}
+    assert architecture_config_hash(resnet) == architecture_config_hash(
+        {'modelArchitecture': {'baseArchitecture': 'ResNet18'}})
+    assert architecture_config_hash(resnet) != architecture_config_hash(config)
+
+
+def test_lru_cache_evicts_least_recently_used_and_counts_hits():
+    from model_artifacts import LRUArtifactCache
+
+    cache = LRUArtifactCache(max_entries=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1  # a 变为最近使用
+    cache.put('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.contains('a') and cache.contains('c')
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'size': 2, 'maxEntries': 2}
@@ -0,0 +1,108 @@
+import pytest
+import torch
+
+from cnn_engine import ModelBuilder
+from model_cost import (ArchitectureCostError, check_admission, estimate_architecture_cost, estimate_training_cost,
+                        KNOWN_ACTIVATIONS)
+
+
+def custom_cnn_config(activation):
+    return {'modelArchitecture': {'baseArchitecture': 'CustomCNN', 'fcLayer': {'numNeurons': 32}, 'customLayers': [
+        {'kernelSize': 3, 'numFilters': 8, 'stride': 1, 'padding': 1, 'activation': activation, 'batchNorm': True},
+        {'kernelSize': 3, 'numFilters': 16, 'stride': 2, 'padding': 0, 'activation': activation, 'batchNorm': False},
+        {'kernelSize': 3, 'numFilters': 4, 'stride': 1, 'padding': 0, 'activation': activation, 'batchNorm': True},
+    ]}}
+
+
+ARCHITECTURE_CONFIGS = [pytest.param(custom_cnn_config(activation), id=f'CustomCNN-{activation}')
+                        for activation in (*KNOWN_ACTIVATIONS, 'Unknown')]
+ARCHITECTURE_CONFIGS += [
+    pytest.param({'modelArchitecture': {'baseArchitecture': 'ResNet18', 'fcLayer': {'numNeurons': 128}}},
+                 id='ResNet18'),
+    pytest.param({'modelArchitecture': {'baseArchitecture': 'DenseNet121', 'fcLayer': {'numNeurons': 128}}},
+                 id='DenseNet121'),
+    pytest.param({'modelArchitecture': {'baseArchitecture': 'SENet', 'fcLayer': {'numNeurons': 64},
+                                        'senetConfig': {'reduction': 4}}}, id='SENet'),
+]
+
+
+@pytest.mark.parametrize('config', ARCHITECTURE_CONFIGS)
+def test_estimated_params_match_built_model(config):
+    with torch.device('meta'):
+        model = ModelBuilder.build_model(config, num_classes=10)
+
+    assert estimate_architecture_cost(config)['totalParams'] == sum(p.numel() for p in model.parameters())
+
+
+SMALL_CONFIG = {'modelArchitecture': {'baseArchitecture': 'CustomCNN', 'fcLayer': {'numNeurons': 16}, 'customLayers': [
+    {'kernelSize': 3, 'numFilters': 4, 'stride': 1, 'padding': 1, 'activation': 'ReLU', 'batchNorm': False}]},
+    'trainingParams': {'epochs': 2, 'batchSize': 8, 'optimizer': 'adam', 'subsetSize': 100}}
+
+
+def test_small_custom_cnn_cost_by_hand():
+    estimate = estimate_architecture_cost(SMALL_CONFIG, batch_size=8)
+
+    assert [(layer['name'], layer['outputShape']) for layer in estimate['layers']] == [
+        ('conv1', [4, 28, 28]), ('act1', [4, 28, 28]), ('pool1', [4, 14, 14]), ('flatten', [784]),
+        ('fc1', [16]), ('fc_act', [16]), ('fc2', [10])]
+    assert estimate['totalParams'] == (4 * 9 + 4) + (784 * 16 + 16) + (16 * 10 + 10)
+    # conv + ReLU + MaxPool + fc1 + ReLU + fc2
+    assert estimate['flopsPerSample'] == 2 * 9 * 4 * 784 + 3136 + 4 * 196 * 4 + 2 * 784 * 16 + 16 + 2 * 16 * 10
+    # 保存的激活：conv、ReLU、pool 输出、fc 输出，加上输入图片本身
+    assert estimate['peakActivationBytes'] == (3136 + 3136 + 784 + 16 + 16 + 10 + 784) * 8 * 4
+
+
+def test_training_cost_adds_parameter_state_and_scales_with_epochs_and_subset():
+    estimate = estimate_training_cost(SMALL_CONFIG)
+    # Adam：权重 + 梯度 + 两份动量
+    assert estimate['parameterStateBytes'] == estimate['totalParams'] * 4 * 4
+    assert estimate['trainingMemoryBytes'] == estimate['parameterStateBytes'] + estimate['peakActivationBytes']
+    assert estimate['trainingFlops'] == 3 * estimate['flopsPerSample'] * 100 * 2
+
+    sgd = estimate_training_cost({**SMALL_CONFIG, 'trainingParams': {**SMALL_CONFIG['trainingParams'],
+                                                                     'optimizer': 'sgd'}})
+    assert sgd['parameterStateBytes'] == estimate['totalParams'] * 4 * 2
+
+
+def test_autotune_estimates_memory_at_the_smallest_micro_batch():
+    config = {**SMALL_CONFIG, 'trainingParams': {**SMALL_CONFIG['trainingParams'], 'batchSize': 64,
+                                                 'autotune': True}}
+    estimate = estimate_training_cost(config)
+    assert (estimate['batchSize'], estimate['microBatchSize']) == (64, 8)
+    assert estimate['peakActivationBytes'] == estimate_architecture_cost(config, 8)['peakActivationBytes']
+
+
+@pytest.mark.parametrize('arch, message', [
+    ({'baseArchitecture': 'VGG'}, '未知模型架构'),
+    ({'customLayers': {'numFilters': 4}}, '必须是列表'),
+    ({'customLayers': [{'kernelSize': 3, 'numFilters': 4, 'stride': 1, 'padding': 0, 'activation': 'ReLU'}]},
+     '缺少字段 batchNorm'),
+    ({'customLayers': [{'kernelSize': 3, 'numFilters': True, 'stride': 1, 'padding': 0, 'activation': 'ReLU',
+                        'batchNorm': False}]}, 'numFilters'),
+    ({'customLayers': [{'kernelSize': 29, 'numFilters': 4, 'stride': 1, 'padding': 0, 'activation': 'ReLU',
+                        'batchNorm': False}]}, '输出尺寸'),
+    ({'baseArchitecture': 'SENet', 'senetConfig': {'reduction': 512}}, 'reduction'),
+    ({'fcLayer': {'numNeurons': 0}}, 'numNeurons'),
+])
+def test_invalid_architectures_are_rejected(arch, message):
+    with pytest.raises(ArchitectureCostError, match=message):
+        estimate_architecture_cost({'modelArchitecture': arch})
+
+
+@pytest.mark.parametrize('training, message', [
+    ({'optimizer': 'rmsprop'}, '优化器'),
+    ({'epochs': 0}, 'epochs'),
+    ({'exportVariants': ['tflite']}, '导出变体'),
+])
+def test_invalid_training_params_are_rejected(training, message):
+    with pytest.raises(ArchitectureCostError, match=message):
+        estimate_training_cost({**SMALL_CONFIG, 'trainingParams': training})
+
+
+def test_admission_rejects_memory_and_compute_over_budget():
+    estimate = {'trainingMemoryBytes': 300 * 1024 * 1024, 'trainingFlops': 5e12}
+    check_admission(estimate, max_memory_mb=300, max_training_tflops=5)
+    with pytest.raises(ArchitectureCostError, match='内存'):
+        check_admission(estimate, max_memory_mb=299, max_training_tflops=5)
+    with pytest.raises(ArchitectureCostError, match='TFLOPs'):
+        check_admission(estimate, max_memory_mb=300, max_training_tflops=4.9)
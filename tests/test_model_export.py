@@ -0,0 +1,92 @@
+import importlib.util
+
+import pytest
+import torch
+
+from cnn_engine import ModelBuilder, ModelExporter
+from model_cost import ArchitectureCostError, estimate_training_cost
+
+CONFIG = {'modelArchitecture': {'baseArchitecture': 'CustomCNN', 'fcLayer': {'numNeurons': 16}, 'customLayers': [
+    {'kernelSize': 3, 'numFilters': 4, 'stride': 1, 'padding': 1, 'activation': 'ReLU', 'batchNorm': True}]}}
+
+
+@pytest.fixture
+def without_onnx(monkeypatch):
+    find_spec = importlib.util.find_spec
+    monkeypatch.setattr(importlib.util, 'find_spec',
+                        lambda name, *args: None if name in ('onnx', 'onnxruntime') else find_spec(name, *args))
+
+
+def export(tmp_path, variants, max_accuracy_drop=0.5):
+    torch.manual_seed(0)
+    model = ModelBuilder.build_model(CONFIG).eval()
+    torch.save(model.state_dict(), tmp_path / 'weights.pth')
+    exporter = ModelExporter(model, torch.arange(64), variants, calibration_samples=32, eval_samples=96,
+                             benchmark_runs=1, max_accuracy_drop=max_accuracy_drop)
+    return exporter, exporter.run(str(tmp_path))
+
+
+def test_missing_onnx_dependency_is_reported_as_skipped(tmp_path, synthetic_mnist, without_onnx):
+    _, report = export(tmp_path, ['torchscript', 'onnx'])
+
+    onnx = next(v for v in report['variants'] if v['variant'] == 'onnx')
+    assert 'onnx' in onnx['skipped']
+    assert 'error' not in onnx and 'accuracy' not in onnx
+    assert onnx['servable'] is False
+    torchscript = next(v for v in report['variants'] if v['variant'] == 'torchscript')
+    assert torchscript['accuracyDrop'] == 0 and torchscript['servable'] is True
+
+
+def test_negative_accuracy_drop_is_clamped_and_float32_stays_servable(tmp_path, synthetic_mnist, without_onnx):
+    exporter, report = export(tmp_path, ['onnx'], max_accuracy_drop=-1)
+
+    assert exporter.max_accuracy_drop == 0
+    assert report['selected'] == 'float32'
+
+
+def test_float32_is_selected_when_no_variant_meets_the_target():
+    baseline = {'variant': 'float32', 'accuracy': 99.0, 'latencyMs': {'1': 1.0, '64': 10.0}, 'sizeBytes': 100}
+    faster = {'variant': 'static', 'accuracy': 97.0, 'latencyMs': {'1': 0.5, '64': 2.0}, 'sizeBytes': 30}
+    failed = {'variant': 'dynamic', 'error': 'RuntimeError: boom'}
+
+    selected = ModelExporter.select_variant([baseline, faster, failed], 100, max_accuracy_drop=0.5)
+
+    assert selected is baseline
+    assert faster['meetsAccuracyTarget'] is False and faster['speedup'] == 5.0
+    assert failed['servable'] is False
+
+
+def test_fastest_variant_within_target_is_selected():
+    baseline = {'variant': 'float32', 'accuracy': 99.0, 'latencyMs': {'1': 1.0, '64': 10.0}, 'sizeBytes': 100}
+    static = {'variant': 'static', 'accuracy': 98.8, 'latencyMs': {'1': 0.5, '64': 2.0}, 'sizeBytes': 30}
+    scripted = {'variant': 'torchscript', 'accuracy': 99.0, 'latencyMs': {'1': 0.8, '64': 8.0}, 'sizeBytes': 100}
+
+    assert ModelExporter.select_variant([baseline, static, scripted], 100, 0.5) is static
+
+
+@pytest.mark.parametrize('value', [-0.1, 'loose', True, float('nan')])
+def test_admission_rejects_invalid_max_accuracy_drop(value):
+    config = {**CONFIG, 'trainingParams': {'exportVariants': ['static'], 'exportMaxAccuracyDrop': value}}
+    with pytest.raises(ArchitectureCostError, match='exportMaxAccuracyDrop'):
+        estimate_training_cost(config)
+
+
+def test_unknown_variant_is_rejected():
+    with pytest.raises(ValueError, match='未知的导出变体'):
+        ModelExporter(ModelBuilder.build_model(CONFIG), torch.arange(8), ['int4'])
+
+
+def test_quantized_variants_are_saved_as_loadable_torchscript(tmp_path, synthetic_mnist):
+    _, report = export(tmp_path, ['dynamic', 'static', 'dynamic'])
+
+    variants = {v['variant']: v for v in report['variants']}
+    assert list(variants) == ['float32', 'dynamic', 'static']
+    assert report['calibrationSamples'] == 32 and report['quantizedEngine']
+    for name in ('dynamic', 'static'):
+        entry = variants[name]
+        assert 'error' not in entry, entry.get('error')
+        assert entry['servable'] is True and entry['sizeRatio'] > 0
+        assert set(entry['latencyMs']) == {str(size) for size in report['benchmarkBatchSizes']}
+        scripted = torch.jit.load(str(tmp_path / entry['file']))
+        assert scripted(torch.zeros(2, 1, 28, 28)).shape == (2, 10)
+    assert report['selected'] in variants
@@ -0,0 +1,52 @@
+import torch
+
+from cnn_engine import ModelBuilder, model_to_json_graph
+from model_cost import estimate_architecture_cost
+
+CONFIG = {'modelArchitecture': {'baseArchitecture': 'CustomCNN', 'fcLayer': {'numNeurons': 32}, 'customLayers': [
+    {'kernelSize': 3, 'numFilters': 8, 'stride': 1, 'padding': 1, 'activation': 'ReLU', 'batchNorm': True},
+    {'kernelSize': 5, 'numFilters': 16, 'stride': 1, 'padding': 0, 'activation': 'Tanh', 'batchNorm': False}]}}
+
+
+def nodes_by_name(graph):
+    return {node['full_name']: node for node in graph['nodes']}
+
+
+def test_graph_shapes_come_from_one_forward_pass_and_match_the_cost_model():
+    model = ModelBuilder.build_model(CONFIG)
+    model.train()
+
+    nodes = nodes_by_name(model_to_json_graph(model))
+
+    assert model.training
+    # CustomCNN 的 features 子模块与代价模型的逐层记录同名 (conv1, bn1, act1, pool1, ...)
+    feature_layers = [layer for layer in estimate_architecture_cost(CONFIG)['layers']
+                      if layer['name'] not in ('flatten', 'fc1', 'fc_act', 'fc2')]
+    assert len(feature_layers) == 7
+    for layer in feature_layers:
+        assert nodes[f"features.{layer['name']}"]['output_shape'] == layer['outputShape'], layer['name']
+    assert nodes['classifier.3']['output_shape'] == [10]
+    assert nodes['features.conv1']['input_shape'] == [1, 28, 28]
+    assert nodes['features.conv1']['output_shape'] == [8, 28, 28]
+
+
+def test_siblings_are_chained_in_call_order_and_parameters_add_up():
+    model = ModelBuilder.build_model(CONFIG)
+    graph = model_to_json_graph(model)
+    ids = {node['id']: node['full_name'] for node in graph['nodes']}
+
+    flow = [(ids[e['from']], ids[e['to']]) for e in graph['edges'] if e['type'] == 'sequential_flow']
+    assert ('Input', 'features') in flow and ('features', 'classifier') in flow
+    assert ('features.conv1', 'features.bn1') in flow and ('features.bn1', 'features.act1') in flow
+    assert sum(node['parameters'] for node in graph['nodes']) == sum(p.numel() for p in model.parameters())
+
+
+def test_reused_modules_record_their_first_call():
+    model = ModelBuilder.build_model({'modelArchitecture': {'baseArchitecture': 'ResNet18',
+                                                            'fcLayer': {'numNeurons': 16}}})
+    nodes = nodes_by_name(model_to_json_graph(model))
+
+    # BasicBlock 中的 relu 被调用两次，记录的是第一次 (bn1 之后) 的形状
+    assert nodes['layer2.0.relu']['input_shape'] == [128, 4, 4]
+    assert nodes['conv1']['call_order'] < nodes['layer1']['call_order'] < nodes['fc']['call_order']
+    assert nodes['fc.2']['output_shape'] == [10]
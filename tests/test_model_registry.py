@@ -0,0 +1,143 @@
+import os
+
+import pytest
+import torch
+
+from cnn_engine import ModelBuilder
+from model_artifacts import ModelRegistry
+
+CONFIG = {'modelArchitecture': {'baseArchitecture': 'CustomCNN', 'fcLayer': {'numNeurons': 16}, 'customLayers': [
+    {'kernelSize': 3, 'numFilters': 4, 'stride': 1, 'padding': 1, 'activation': 'ReLU', 'batchNorm': True}]}}
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return ModelRegistry(root=str(tmp_path), max_resident=2)
+
+
+def register(registry, job_id, **metrics):
+    model = ModelBuilder.build_model(CONFIG)
+    return registry.register(model, CONFIG, 'arch-hash', metrics, 1.5, job_id), model
+
+
+def test_register_list_and_metadata(registry):
+    first, model = register(registry, 'a' * 12, accuracy=90.0)
+    assert first.endswith('-' + 'a' * 12)
+    assert sorted(os.listdir(os.path.join(registry.root, first))) == ['meta.json', 'weights.pth']
+
+    [entry] = registry.list_models()
+    assert entry['modelId'] == first and entry['metrics'] == {'accuracy': 90.0}
+    assert entry['parameters'] == sum(p.numel() for p in model.parameters())
+    assert entry['resident'] is False and 'config' not in entry
+    assert registry.get_metadata(first)['config'] == CONFIG
+    assert registry.latest_model_id() == first
+    with pytest.raises(KeyError):
+        registry.get_metadata('missing')
+
+
+def test_loaded_model_matches_registered_weights(registry):
+    model_id, model = register(registry, 'b' * 12)
+    loaded = registry.load(model_id)
+
+    assert not loaded.training
+    for name, value in model.state_dict().items():
+        assert torch.equal(loaded.state_dict()[name], value), name
+    inputs = torch.randn(2, 1, 28, 28)
+    with torch.inference_mode():
+        assert torch.allclose(loaded(inputs)[0], model.eval()(inputs)[0])
+    assert registry.load(model_id) is loaded and registry.is_resident(model_id)
+
+
+def test_resident_models_are_evicted_least_recently_used_first(registry):
+    ids = [register(registry, job_id * 12)[0] for job_id in 'cde']
+    registry.load(ids[0])
+    registry.load(ids[1])
+    registry.load(ids[0])
+    registry.load(ids[2])
+
+    assert [registry.is_resident(model_id) for model_id in ids] == [True, False, True]
+    assert registry.stats()['size'] == 2
+
+
+def test_failed_registration_leaves_no_visible_entry(registry):
+    def failing_exports(directory):
+        assert os.path.basename(directory).startswith('.')
+        raise RuntimeError('export failed')
+
+    with pytest.raises(RuntimeError):
+        registry.register(ModelBuilder.build_model(CONFIG), CONFIG, 'arch-hash', {}, 1.0, 'f' * 12,
+                          write_exports=failing_exports)
+    # 暂存目录以 . 开头，不会出现在索引中
+    assert registry.list_models() == [] and registry.latest_model_id() is None
+
+
+def test_exports_are_recorded_in_metadata(registry):
+    def write_exports(directory):
+        with open(os.path.join(directory, 'extra.bin'), 'wb') as f:
+            f.write(b'x')
+        return {'selected': 'float32', 'variants': []}
+
+    model_id = registry.register(ModelBuilder.build_model(CONFIG), CONFIG, 'arch-hash', {}, 1.0, 'e' * 12,
+                                 write_exports=write_exports)
+    assert registry.get_metadata(model_id)['export'] == {'selected': 'float32', 'variants': []}
+    assert os.path.exists(os.path.join(registry.root, model_id, 'extra.bin'))
+
+
+def test_index_picks_up_models_registered_by_another_process(tmp_path):
+    reader = ModelRegistry(root=str(tmp_path))
+    assert reader.list_models() == []
+    writer = ModelRegistry(root=str(tmp_path))
+    model_id, _ = register(writer, '1' * 12)
+    # 目录 mtime 的精度可能不足以区分两次写入，强制刷新
+    os.utime(tmp_path, (0, 0))
+    assert [m['modelId'] for m in reader.list_models()] == [model_id]
+
+
+def test_unreadable_metadata_is_skipped(registry):
+    model_id, _ = register(registry, '2' * 12)
+    broken = os.path.join(registry.root, 'broken')
+    os.makedirs(broken)
+    with open(os.path.join(broken, 'meta.json'), 'w') as f:
+        f.write('{not json')
+    os.utime(registry.root, (1, 1))
+    assert [m['modelId'] for m in registry.list_models()] == [model_id]
+
+
+def register_dynamic_export(registry, job_id, engine):
+    from cnn_engine import LogitsOnly, ModelExporter
+
+    def write_exports(directory):
+        torch.backends.quantized.engine = engine
+        quantized = torch.ao.quantization.quantize_dynamic(ModelBuilder.build_model(CONFIG).eval(),
+                                                           {torch.nn.Linear}, dtype=torch.qint8)
+        os.makedirs(os.path.join(directory, 'exports'))
+        ModelExporter._save_torchscript(LogitsOnly(quantized), torch.zeros(1, 1, 28, 28),
+                                        os.path.join(directory, 'exports', 'dynamic.pt'))
+        return {'selected': 'dynamic', 'quantizedEngine': engine, 'variants': [
+            {'variant': 'dynamic', 'format': 'torchscript', 'file': 'exports/dynamic.pt'}]}
+
+    model = ModelBuilder.build_model(CONFIG)
+    return registry.register(model, CONFIG, 'arch-hash', {}, 1.0, job_id, write_exports=write_exports)
+
+
+def test_quantized_engine_is_chosen_once_by_the_registry(registry):
+    from cnn_engine import ExportedModel
+
+    previous = torch.backends.quantized.engine
+    engines = [e for e in ('x86', 'fbgemm', 'qnnpack') if e in torch.backends.quantized.supported_engines]
+    if len(engines) < 2:
+        pytest.skip('需要两个可用的量化后端')
+    try:
+        first = register_dynamic_export(registry, 'f' * 12, engines[0])
+        second = register_dynamic_export(registry, 'e' * 12, engines[1])
+        torch.backends.quantized.engine = engines[1]
+
+        assert isinstance(registry.load(first), ExportedModel)
+        assert torch.backends.quantized.engine == engines[0]
+        # 第二个模型以另一个后端导出：不切换全局后端，退回 float32 权重
+        fallback = registry.load(second)
+        assert not isinstance(fallback, ExportedModel)
+        assert torch.backends.quantized.engine == engines[0]
+        assert fallback(torch.zeros(2, 1, 28, 28))[0].shape == (2, 10)
+    finally:
+        torch.backends.quantized.engine = previous
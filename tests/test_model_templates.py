@@ -0,0 +1,39 @@
+import pytest
+import torch
+
+import cnn_engine
+from cnn_engine import build_model_from_template
+from model_artifacts import architecture_config_hash, LRUArtifactCache
+
+CONFIG = {'modelArchitecture': {'baseArchitecture': 'CustomCNN', 'fcLayer': {'numNeurons': 16}, 'customLayers': [
+    {'kernelSize': 3, 'numFilters': 4, 'stride': 1, 'padding': 1, 'activation': 'PReLU', 'batchNorm': True}]}}
+
+
+@pytest.fixture
+def template_cache(monkeypatch):
+    cache = LRUArtifactCache(4)
+    monkeypatch.setattr(cnn_engine, 'model_template_cache', cache)
+    return cache
+
+
+def test_rebuilt_models_start_from_the_cached_initial_weights(template_cache):
+    arch_hash = architecture_config_hash(CONFIG)
+    first = build_model_from_template(CONFIG, arch_hash)
+    second = build_model_from_template(CONFIG, arch_hash)
+
+    assert template_cache.stats()['hits'] == 1
+    for (name, a), b in zip(first.state_dict().items(), second.state_dict().values()):
+        assert torch.equal(a, b), name
+        assert b.device.type == 'cpu'
+
+
+def test_training_one_model_does_not_touch_the_template(template_cache):
+    arch_hash = architecture_config_hash(CONFIG)
+    build_model_from_template(CONFIG, arch_hash)
+    model = build_model_from_template(CONFIG, arch_hash)
+    with torch.no_grad():
+        for parameter in model.parameters():
+            parameter.add_(1.0)
+
+    fresh = build_model_from_template(CONFIG, arch_hash)
+    assert not torch.equal(next(model.parameters()), next(fresh.parameters()))
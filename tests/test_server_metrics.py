@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+
+from server_metrics import Histogram, MetricsRegistry, payload_size, process_rss_bytes
+
+
+def test_histogram_buckets_are_upper_inclusive_with_overflow_bucket():
+    histogram = Histogram((1, 5))
+    for value in (0.5, 1, 3, 5, 7):
+        histogram.observe(value)
+
+    assert histogram.counts == [2, 2, 1]
+    assert histogram.sum == 16.5 and histogram.count == 5
+
+
+def test_histogram_drain_resets_and_merge_accumulates():
+    worker, server = Histogram((1, 5)), Histogram((1, 5))
+    assert worker.drain() is None
+
+    worker.observe(2)
+    worker.observe(9)
+    server.merge(worker.drain())
+    worker.observe(0.5)
+    server.merge(worker.drain())
+
+    assert worker.drain() is None
+    assert server.counts == [1, 1, 1]
+    assert server.sum == 11.5 and server.count == 3
+    with pytest.raises(ValueError):
+        server.merge({'counts': [1, 0], 'sum': 1.0, 'count': 1})
+
+
+def test_render_outputs_cumulative_buckets_sum_and_count():
+    registry = MetricsRegistry()
+    registry.describe('step_seconds', 'histogram', '训练步耗时', bounds=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 2):
+        registry.observe('step_seconds', value, architecture='CustomCNN')
+
+    assert registry.render() == (
+        '# HELP step_seconds 训练步耗时\n'
+        '# TYPE step_seconds histogram\n'
+        'step_seconds_bucket{architecture="CustomCNN",le="0.1"} 1\n'
+        'step_seconds_bucket{architecture="CustomCNN",le="1"} 3\n'
+        'step_seconds_bucket{architecture="CustomCNN",le="+Inf"} 4\n'
+        'step_seconds_sum{architecture="CustomCNN"} 3.05\n'
+        'step_seconds_count{architecture="CustomCNN"} 4\n'
+    )
+
+
+def test_render_counters_gauges_and_extra_families():
+    registry = MetricsRegistry()
+    registry.describe('jobs_total', 'counter', '任务数')
+    registry.describe('idle', 'gauge', '')
+    registry.inc('jobs_total', outcome='completed')
+    registry.inc('jobs_total', 2, outcome='completed')
+    registry.set('samples_per_second', 12.5, job_id='a')
+    registry.set('samples_per_second', 3, job_id='b')
+    registry.remove('samples_per_second', job_id='b')
+    registry.remove('missing', job_id='b')
+
+    text = registry.render([('cores', 'gauge', '核心数', {(('state', 'free'),): 4})])
+
+    assert text.splitlines() == [
+        '# HELP jobs_total 任务数',
+        '# TYPE jobs_total counter',
+        'jobs_total{outcome="completed"} 3',
+        '# TYPE idle gauge',
+        '# TYPE samples_per_second gauge',
+        'samples_per_second{job_id="a"} 12.5',
+        '# HELP cores 核心数',
+        '# TYPE cores gauge',
+        'cores{state="free"} 4',
+    ]
+
+
+def test_label_values_are_escaped_and_sorted_by_name():
+    registry = MetricsRegistry()
+    registry.set('info', 1, path='a"b\\c\nd', kind='x')
+
+    assert 'info{kind="x",path="a\\"b\\\\c\\nd"} 1' in registry.render().splitlines()
+
+
+def test_registry_rejects_kind_conflicts_and_unregistered_histograms():
+    registry = MetricsRegistry()
+    registry.inc('requests_total')
+
+    with pytest.raises(ValueError):
+        registry.set('requests_total', 1)
+    with pytest.raises(KeyError):
+        registry.observe('latency_seconds', 0.1)
+    with pytest.raises(KeyError):
+        registry.histogram('requests_total')
+
+
+@pytest.mark.parametrize('value, size', [
+    (b'\0' * 10, 10),
+    ('abc', 5),
+    (12, 2),
+    (None, 4),
+    ([1, 'a'], 2 + 2 + 4),
+    ({'loss': 0.5, 'tags': ['x']}, 2 + (4 + 4 + 3) + (4 + 4 + 6)),
+])
+def test_payload_size_approximates_compact_json(value, size):
+    assert payload_size(value) == size
+
+
+def test_process_rss_bytes_reads_own_process_and_ignores_missing_pids():
+    assert process_rss_bytes() > 0
+    assert process_rss_bytes(2 ** 30) is None
+
+
+def test_metrics_endpoint_merges_worker_histograms_and_scraped_gauges(monkeypatch):
+    import main
+
+    registry = MetricsRegistry()
+    registry.describe('training_step_seconds', 'histogram', '', bounds=main.STEP_SECONDS_BUCKETS)
+    registry.describe('training_model_build_seconds', 'histogram', '', bounds=main.BUILD_SECONDS_BUCKETS)
+    monkeypatch.setattr(main, 'training_metrics', registry)
+    steps = Histogram(main.STEP_SECONDS_BUCKETS)
+    steps.observe(0.003)
+    steps.observe(0.2)
+
+    main.training_scheduler._record_worker_metrics('unknown-job', {'stepSeconds': steps.drain(),
+                                                                   'modelBuildSeconds': 0.02})
+    response = asyncio.run(main.metrics())
+    lines = response.body.decode().splitlines()
+
+    assert response.media_type.startswith('text/plain; version=0.0.4')
+    assert 'training_step_seconds_count{architecture="unknown"} 2' in lines
+    assert 'training_step_seconds_bucket{architecture="unknown",le="0.005"} 1' in lines
+    assert 'training_model_build_seconds_count{architecture="unknown"} 1' in lines
+    assert 'training_jobs{state="queued"} 0' in lines
+    assert any(line.startswith('process_resident_memory_bytes ') for line in lines)
@@ -0,0 +1,47 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import main
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_importing_the_server_does_not_import_torch():
+    script = ("import sys, main\n"
+              "heavy = sorted(m for m in ('torch', 'torchvision', 'numpy', 'cnn_engine') if m in sys.modules)\n"
+              "print(','.join(heavy))")
+    result = subprocess.run([sys.executable, '-c', script], cwd=REPO_ROOT, capture_output=True, text=True,
+                            timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == ''
+
+
+def test_startup_metrics_keep_the_first_occurrence(monkeypatch):
+    monkeypatch.setitem(main.startup_metrics, 'firstConnectSeconds', None)
+    main.record_startup_metric('firstConnectSeconds', 1.5)
+    main.record_startup_metric('firstConnectSeconds', 9.0)
+    assert main.startup_metrics['firstConnectSeconds'] == 1.5
+
+
+def test_warm_up_starts_every_worker_process(monkeypatch):
+    monkeypatch.setitem(main.startup_metrics, 'workerPoolWarmSeconds', None)
+    monkeypatch.setattr(main, 'WORKER_WARMUP', False)
+
+    async def scenario():
+        scheduler = main.TrainingJobScheduler(None, max_workers=2)
+        scheduler._progress_queue = scheduler._mp_context.Queue()
+        scheduler._pool = scheduler._create_pool()
+        try:
+            loop = asyncio.get_running_loop()
+            await scheduler._warm_up_pool()
+            return await loop.run_in_executor(scheduler._pool, main._run_in_engine, 'worker_ready')
+        finally:
+            scheduler._pool.shutdown(wait=True)
+
+    worker = asyncio.run(scenario())
+    assert worker['pid'] != os.getpid()
+    # 不启用 WORKER_WARMUP 时 initializer 不做预热
+    assert worker['warmupSeconds'] is None
+    assert main.startup_metrics['workerPoolWarmSeconds'] is not None
@@ -0,0 +1,190 @@
+import asyncio
+import os
+from concurrent.futures import Future
+
+import pytest
+import torch
+
+import cnn_engine
+from cnn_engine import AsyncCheckpointWriter, EpochTotals
+from model_artifacts import checkpoint_owner, load_checkpoint_meta, training_checkpoint_dir
+
+
+def logits_for(predictions, num_classes=10):
+    return torch.nn.functional.one_hot(torch.tensor(predictions), num_classes).float()
+
+
+def test_committed_totals_exclude_micro_batches_after_last_optimizer_step():
+    totals = EpochTotals('cpu')
+    labels = torch.tensor([1, 2])
+    # 累积组第一个微批：还没有优化器更新
+    totals.add(torch.tensor(0.5), logits_for([1, 2]), labels)
+    assert totals.committed() == {'lossSum': 0.0, 'correct': 0, 'samples': 0}
+
+    # 组末微批之后更新优化器
+    totals.add(torch.tensor(0.25), logits_for([1, 0]), labels)
+    totals.commit()
+    # 下一组的微批已计入实时累计值，但尚未提交
+    totals.add(torch.tensor(1.0), logits_for([0, 0]), labels)
+
+    assert totals.samples == 6
+    assert totals.committed() == {'lossSum': 1.5, 'correct': 3, 'samples': 4}
+
+
+def test_resumed_totals_continue_from_checkpoint_without_double_counting():
+    labels = torch.tensor([3, 4])
+    before_stop = EpochTotals('cpu')
+    before_stop.add(torch.tensor(0.5), logits_for([3, 4]), labels)
+    before_stop.commit()
+    before_stop.add(torch.tensor(2.0), logits_for([0, 0]), labels)  # 停止时被丢弃的半组
+
+    resumed = EpochTotals('cpu', before_stop.committed())
+    assert resumed.committed() == before_stop.committed()
+    # 恢复后重新训练被丢弃的微批，只计入一次
+    resumed.add(torch.tensor(2.0), logits_for([0, 0]), labels)
+    assert resumed.samples == 4
+    assert resumed.loss_sum.item() == 5.0
+    assert resumed.correct.item() == 2
+
+
+CONFIG = {
+    'modelArchitecture': {'baseArchitecture': 'CustomCNN', 'fcLayer': {'numNeurons': 16}, 'customLayers': [
+        {'kernelSize': 3, 'numFilters': 4, 'stride': 1, 'padding': 1, 'activation': 'ReLU', 'batchNorm': True}]},
+    'trainingParams': {'epochs': 2, 'batchSize': 16, 'subsetSize': 64, 'validateEachEpoch': False,
+                       'checkpointIntervalSec': 0},
+}
+JOB_ID = '0123456789ab'
+
+
+@pytest.mark.parametrize('checkpoint_id', ['../etc/passwd', 'ABCDEF012345', '0123456789a', 123, None])
+def test_checkpoint_dir_rejects_ids_that_are_not_job_ids(checkpoint_id):
+    with pytest.raises(KeyError):
+        training_checkpoint_dir(checkpoint_id)
+
+
+def test_writer_round_trip_and_skips_periodic_saves_while_busy(training_dirs):
+    writer = AsyncCheckpointWriter(JOB_ID, CONFIG, 'arch-hash', owner='owner-digest')
+    weights = torch.arange(4.0)
+    assert writer.save({'model': {'w': weights}}, {'epoch': 1, 'batch': 3})
+    writer.wait()
+    # 保存的是调用时的快照，之后的原地修改不影响检查点
+    weights.add_(1)
+    assert torch.equal(writer.load()['model']['w'], torch.arange(4.0))
+    meta = load_checkpoint_meta(JOB_ID, 'owner-digest')
+    assert (meta['epoch'], meta['batch'], meta['architectureHash']) == (1, 3, 'arch-hash')
+
+    busy = Future()
+    writer._future = busy
+    assert not writer.save({'model': {}}, {'epoch': 1, 'batch': 4})
+    assert writer.skipped == 1
+    busy.set_result(None)
+    assert writer.save({'model': {'w': weights}}, {'epoch': 1, 'batch': 5}, final=True)
+    writer.wait()
+    assert load_checkpoint_meta(JOB_ID)['batch'] == 5 and writer.written == 2
+
+    writer.discard()
+    writer.close()
+    assert not os.path.exists(writer.directory)
+
+
+def stop_after(monkeypatch, checks):
+    """第 checks 次检查取消标记时返回 True（每个 epoch 开始和每个批次开始前各检查一次）。"""
+    calls = []
+
+    def is_job_cancelled(job_id):
+        calls.append(job_id)
+        return len(calls) >= checks
+
+    monkeypatch.setattr(cnn_engine, 'is_job_cancelled', is_job_cancelled)
+
+
+def final_weights(model_id):
+    return cnn_engine.model_registry.load(model_id).state_dict()
+
+
+@pytest.mark.parametrize('accumulation', [1, 2])
+def test_stopped_and_resumed_training_matches_an_uninterrupted_run(run_trainer, training_dirs, monkeypatch,
+                                                                   accumulation):
+    config = CONFIG
+    if accumulation > 1:
+        def tuned(*args, **kwargs):
+            return {'batchSize': 16, 'microBatchSize': 16 // accumulation, 'accumulationSteps': accumulation,
+                    'prefetch': 0, 'samplesPerSec': 1.0, 'candidates': [], 'machine': 'test', 'cached': False}
+        monkeypatch.setattr(cnn_engine.CNNTrainer, '_autotune_batching', tuned)
+        config = {**CONFIG, 'trainingParams': {**CONFIG['trainingParams'], 'autotune': True}}
+
+    reference = run_trainer(config, job_id=JOB_ID)
+    reference_epochs = [u for u in reference if 'epoch' in u and 'loss' in u]
+
+    # 在第 2 个 epoch 的第 4 个微批开始前停止；梯度累积时正处在一组的中间，检查点回到该组开始的位置
+    stop_after(monkeypatch, 1 + 4 * accumulation + 1 + 4)
+    stopped = run_trainer(config, job_id=JOB_ID, owner='owner-digest')
+    assert stopped[-1]['cancelled'] is True and stopped[-1]['checkpointId'] == JOB_ID
+    meta = load_checkpoint_meta(JOB_ID, 'owner-digest')
+    assert meta['epoch'] == 1 and meta['batch'] == (3 if accumulation == 1 else 2)
+
+    monkeypatch.setattr(cnn_engine, 'is_job_cancelled', lambda job_id: False)
+    resumed = run_trainer(config, job_id='ba9876543210', checkpoint_id=JOB_ID, resume=True, owner='owner-digest')
+    resumed_epochs = [u for u in resumed if 'epoch' in u and 'loss' in u]
+
+    assert resumed[-1]['isTrainingComplete'] is True
+    assert [u['epoch'] for u in resumed_epochs] == [2]
+    # 恢复后的 epoch 累计值不重复计入停止前已训练的微批
+    assert resumed_epochs[0]['loss'] == pytest.approx(reference_epochs[1]['loss'], rel=1e-4)
+    assert resumed_epochs[0]['accuracy'] == pytest.approx(reference_epochs[1]['accuracy'])
+    reference_weights = final_weights(reference[-1]['modelId'])
+    for name, value in final_weights(resumed[-1]['modelId']).items():
+        assert torch.allclose(value, reference_weights[name], atol=1e-5), name
+    # 训练完成后删除检查点
+    with pytest.raises(KeyError):
+        load_checkpoint_meta(JOB_ID)
+
+
+def test_stop_before_the_first_optimizer_step_saves_no_checkpoint(run_trainer, training_dirs, monkeypatch):
+    stop_after(monkeypatch, 2)
+    updates = run_trainer(CONFIG, job_id=JOB_ID)
+
+    assert updates[-1]['cancelled'] is True and 'checkpointId' not in updates[-1]
+    assert not any('checkpoint' in u for u in updates)
+    with pytest.raises(KeyError):
+        load_checkpoint_meta(JOB_ID)
+
+
+def test_only_the_owning_client_token_can_resume(training_dirs, monkeypatch):
+    import main
+
+    submitted, emitted = [], []
+
+    class Scheduler:
+        async def submit(self, sid, config, checkpoint_id=None, owner=None):
+            submitted.append((sid, checkpoint_id, owner))
+
+        async def cancel(self, sid):
+            pass
+
+    async def emit(event, data, to=None):
+        emitted.append((to, data))
+
+    monkeypatch.setattr(main, 'training_scheduler', Scheduler())
+    monkeypatch.setattr(main.sio, 'emit', emit)
+    monkeypatch.setattr(main, 'client_tokens', {})
+    token = 'token-of-the-first-tab'
+
+    async def scenario():
+        await main.connect('sid-1', {}, {'clientToken': token})
+        writer = AsyncCheckpointWriter(JOB_ID, CONFIG, 'arch-hash', owner=main.client_checkpoint_owner('sid-1'))
+        writer.save({'model': {}}, {'epoch': 0, 'batch': 2}, final=True)
+        writer.close()
+        await main.disconnect('sid-1')
+
+        # 同一个 clientToken 重新连接后可以恢复，其他客户端（包括没有令牌的连接）不行
+        await main.connect('sid-2', {}, {'clientToken': token})
+        await main.connect('sid-3', {}, {'clientToken': 'token-of-another-tab'})
+        await main.connect('sid-4', {}, None)
+        for sid in ('sid-3', 'sid-4', 'sid-2'):
+            await main.resume_training(sid, {'jobId': JOB_ID})
+
+    asyncio.run(scenario())
+
+    assert submitted == [('sid-2', JOB_ID, checkpoint_owner(token))]
+    assert [to for to, data in emitted if data.get('error')] == ['sid-3', 'sid-4']
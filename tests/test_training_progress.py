@@ -0,0 +1,123 @@
+import pytest
+
+import cnn_engine
+from cnn_engine import PhaseProfiler, TrainingProgressReporter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cnn_engine.time, 'perf_counter', clock)
+    return clock
+
+
+def test_due_every_n_batches_without_interval(clock):
+    reporter = TrainingProgressReporter(every_batches=3, interval_ms=0)
+    reporter.start_epoch()
+    assert [reporter.is_due(i) for i in range(1, 4)] == [False, False, True]
+    reporter.report(1, 3, 10, 3.0, 3, 12)
+    assert not reporter.is_due(5)
+    assert reporter.is_due(6)
+    # 时间条件关闭：再久也不会到期
+    clock.now += 3600
+    assert not reporter.is_due(4)
+
+
+def test_due_after_interval_and_reset_by_report(clock):
+    reporter = TrainingProgressReporter(every_batches=0, interval_ms=500)
+    reporter.start_epoch()
+    clock.now += 0.4
+    assert not reporter.is_due(1)
+    clock.now += 0.1
+    assert reporter.is_due(1)
+    reporter.report(1, 1, 10, 1.0, 1, 4)
+    assert not reporter.is_due(2)
+
+
+def test_both_conditions_disabled_is_never_due(clock):
+    reporter = TrainingProgressReporter(every_batches=0, interval_ms=0)
+    clock.now += 3600
+    assert not reporter.is_due(1000)
+
+
+def test_report_averages_and_throughput_since_last_report(clock):
+    reporter = TrainingProgressReporter(every_batches=2, interval_ms=0)
+    reporter.start_epoch()
+    clock.now += 2.0
+    first = reporter.report(3, 2, 8, loss_sum=8.0, correct=12, samples=16)
+    assert first == {'epoch': 3, 'batch': 2, 'totalBatches': 8, 'loss': 0.5, 'accuracy': 75.0,
+                     'samplesPerSec': 8.0}
+
+    clock.now += 0.5
+    second = reporter.report(3, 4, 8, loss_sum=12.0, correct=24, samples=32)
+    # 吞吐只按两次汇报之间新增的样本计算，损失和准确率是轮次内的累计平均
+    assert second['samplesPerSec'] == 32.0
+    assert second['loss'] == pytest.approx(0.375)
+    assert second['accuracy'] == 75.0
+
+
+def test_start_epoch_resets_counters(clock):
+    reporter = TrainingProgressReporter(every_batches=2, interval_ms=0)
+    reporter.report(1, 6, 8, 1.0, 1, 48)
+    clock.now += 1.0
+    reporter.start_epoch()
+    assert reporter.is_due(2)
+    clock.now += 1.0
+    assert reporter.report(2, 2, 8, 1.0, 1, 16)['samplesPerSec'] == 16.0
+
+
+def test_report_with_no_samples_does_not_divide_by_zero(clock):
+    update = TrainingProgressReporter().report(1, 0, 8, 0.0, 0, 0)
+    assert update['loss'] == 0.0 and update['accuracy'] == 0.0
+
+
+def test_disabled_profiler_records_nothing(clock):
+    profiler = PhaseProfiler(enabled=False)
+    with profiler.phase('forward'):
+        clock.now += 1.0
+    assert profiler.phase('backward') is profiler.phase('data')
+    assert profiler.epoch_summary()['phases'] == {}
+
+
+def test_profiler_times_phases_and_data_since_last_step(clock):
+    profiler = PhaseProfiler(enabled=True)
+    profiler.start_epoch()
+    clock.now += 0.003
+    # data 阶段从上一步结束（mark_data_start）算起，而不是从进入 phase 算起
+    with profiler.phase('data'):
+        clock.now += 0.001
+    with profiler.phase('forward'):
+        clock.now += 0.012
+    profiler.mark_data_start()
+    clock.now += 0.004
+    with profiler.phase('data'):
+        pass
+
+    summary = profiler.epoch_summary()
+    assert summary['bucketBoundsMs'] == list(PhaseProfiler.BUCKET_BOUNDS_MS[:-1])
+    data, forward = summary['phases']['data'], summary['phases']['forward']
+    assert data['count'] == 2
+    assert data['totalMs'] == pytest.approx(8.0)
+    assert data['meanMs'] == pytest.approx(4.0)
+    assert data['maxMs'] == pytest.approx(4.0)
+    assert data['share'] == pytest.approx(0.4)
+    assert forward['count'] == 1 and forward['share'] == pytest.approx(0.6)
+    # 4ms 落在 (2.5, 5] 桶，12ms 落在 (10, 25] 桶
+    assert data['histogram'][PhaseProfiler.BUCKET_BOUNDS_MS.index(5)] == 2
+    assert forward['histogram'][PhaseProfiler.BUCKET_BOUNDS_MS.index(25)] == 1
+
+
+def test_profiler_overflow_bucket_and_epoch_reset():
+    profiler = PhaseProfiler(enabled=True)
+    profiler.record('emit', 10_000.0)
+    assert profiler.epoch_summary()['phases']['emit']['histogram'][-1] == 1
+    profiler.start_epoch()
+    assert profiler.epoch_summary()['phases'] == {}
@@ -0,0 +1,370 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import main
+
+CONFIG = {'modelArchitecture': {'baseArchitecture': 'CustomCNN', 'fcLayer': {'numNeurons': 16}, 'customLayers': [
+    {'kernelSize': 3, 'numFilters': 4, 'stride': 1, 'padding': 1, 'activation': 'ReLU', 'batchNorm': False}]},
+    'trainingParams': {'epochs': 1, 'batchSize': 32}}
+
+
+class RecordingSio:
+    def __init__(self):
+        self.updates = []
+
+    async def emit(self, event, data, to=None):
+        self.updates.append((to, data))
+
+    def for_client(self, sid):
+        return [data for to, data in self.updates if to == sid]
+
+
+class FakeEngine:
+    """代替工作进程中的 _run_job_in_engine：记录运行顺序，可按 job_id 阻塞或抛出异常。"""
+
+    def __init__(self):
+        self.started = []
+        self.gates = {}
+        self.failures = set()
+        self.lock = threading.Lock()
+
+    def __call__(self, function_name, cores, pin, job_id, *args):
+        with self.lock:
+            self.started.append(job_id)
+        if job_id in self.gates:
+            self.gates[job_id].wait(5)
+        if job_id in self.failures:
+            raise RuntimeError('boom')
+        return None, {'cpuSeconds': 0.0, 'wallSeconds': 0.01}
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    fake = FakeEngine()
+    monkeypatch.setattr(main, '_run_job_in_engine', fake)
+    return fake
+
+
+async def started_scheduler(max_workers=1):
+    scheduler = main.TrainingJobScheduler(RecordingSio(), max_workers=max_workers)
+    scheduler._pool = ThreadPoolExecutor(max_workers)
+    scheduler._pending = asyncio.Queue()
+    scheduler._tasks = [asyncio.create_task(scheduler._dispatch_loop()) for _ in range(max_workers)]
+    return scheduler
+
+
+async def stop_scheduler(scheduler):
+    for task in scheduler._tasks:
+        task.cancel()
+    await asyncio.gather(*scheduler._tasks, return_exceptions=True)
+    scheduler._pool.shutdown(wait=True)
+
+
+def test_jobs_run_in_submission_order(engine):
+    async def scenario():
+        scheduler = await started_scheduler()
+        jobs = [await scheduler.submit(sid, CONFIG) for sid in ('a', 'b', 'c')]
+        await asyncio.wait_for(scheduler._pending.join(), 5)
+        await stop_scheduler(scheduler)
+        return scheduler, jobs
+
+    scheduler, jobs = asyncio.run(scenario())
+
+    assert engine.started == [job.job_id for job in jobs]
+    assert all(job.status == 'finished' for job in jobs)
+    assert scheduler.stats()['queued'] == 0 and scheduler.stats()['running'] == 0
+
+
+def test_failed_job_reports_error_and_later_jobs_still_run(engine):
+    async def scenario():
+        scheduler = await started_scheduler()
+        first = await scheduler.submit('a', CONFIG)
+        engine.failures.add(first.job_id)
+        second = await scheduler.submit('b', CONFIG)
+        await asyncio.wait_for(scheduler._pending.join(), 5)
+        await stop_scheduler(scheduler)
+        return scheduler, first, second
+
+    scheduler, first, second = asyncio.run(scenario())
+
+    assert (first.status, second.status) == ('failed', 'finished')
+    assert any(data.get('error') for data in scheduler.sio.for_client('a'))
+    assert not any(data.get('error') for data in scheduler.sio.for_client('b'))
+
+
+def test_invalid_config_is_rejected_before_queueing(engine):
+    async def scenario():
+        scheduler = await started_scheduler()
+        job = await scheduler.submit('a', {**CONFIG, 'trainingParams': {'optimizer': 'lbfgs'}})
+        await stop_scheduler(scheduler)
+        return scheduler, job
+
+    scheduler, job = asyncio.run(scenario())
+
+    assert job is None
+    assert engine.started == []
+    assert scheduler.sio.for_client('a')[-1]['error'] is True
+
+
+def test_cached_architecture_artifacts_are_sent_on_submit(engine, monkeypatch):
+    monkeypatch.setattr(main, 'artifact_store', main.ContentAddressedStore(4))
+    monkeypatch.setattr(main, 'architecture_artifact_cache', main.LRUArtifactCache(2))
+    refs = main.store_architecture_artifacts(main.architecture_config_hash(CONFIG),
+                                             {'modelArchitectureText': 'summary', 'modelGraphData': {'nodes': []}})
+
+    async def scenario():
+        scheduler = await started_scheduler()
+        job = await scheduler.submit('a', {**CONFIG, 'artifactEncoding': 'gzip',
+                                           'knownArtifacts': [refs['modelArchitectureText']]})
+        await asyncio.wait_for(scheduler._pending.join(), 5)
+        await stop_scheduler(scheduler)
+        return scheduler, job
+
+    scheduler, job = asyncio.run(scenario())
+
+    assert job.artifacts_cached is True
+    cached = next(data for data in scheduler.sio.for_client('a') if 'artifactRefs' in data)
+    assert cached['architectureHash'] == job.arch_hash
+    # 客户端已持有文本摘要，只发送图结构
+    assert list(cached['artifacts']) == [refs['modelGraphData']]
+
+
+def job_for(sid, cores=None):
+    params = {**CONFIG['trainingParams'], **({'cpuCores': cores} if cores is not None else {})}
+    return main.TrainingJob(sid, {**CONFIG, 'trainingParams': params})
+
+
+def test_core_budget_defaults_overrides_and_client_cap():
+    allocator = main.CoreAllocator(list(range(8)), slots=4, max_cores_per_client=3)
+    assert allocator.default_budget == 2
+    assert allocator.budget_for(job_for('a').config) == 2
+    assert allocator.budget_for(job_for('a', cores=3).config) == 3
+    assert allocator.budget_for(job_for('a', cores=16).config) == 3
+    assert allocator.budget_for(job_for('a', cores='many').config) == 2
+    assert main.CoreAllocator([0], slots=4, max_cores_per_client=8).max_cores_per_client == 1
+
+
+def test_allocations_are_disjoint_and_wait_for_free_cores():
+    async def scenario():
+        allocator = main.CoreAllocator(list(range(4)), slots=2, max_cores_per_client=4)
+        first, second, third = job_for('a'), job_for('b'), job_for('c')
+        first_cores = await allocator.acquire(first)
+        second_cores = await allocator.acquire(second)
+        waiting = asyncio.create_task(allocator.acquire(third))
+        await asyncio.sleep(0.01)
+        assert not waiting.done() and allocator.stats()['freeCores'] == 0
+        await allocator.release(first)
+        third_cores = await asyncio.wait_for(waiting, 1)
+        return first_cores, second_cores, third_cores, allocator.stats()
+
+    first_cores, second_cores, third_cores, stats = asyncio.run(scenario())
+
+    assert (first_cores, second_cores) == ([0, 1], [2, 3])
+    # 释放的核心分配给等待中的任务
+    assert third_cores == [0, 1]
+    assert sorted(a['cores'] for a in stats['jobs'].values()) == [[0, 1], [2, 3]]
+
+
+def test_client_core_cap_holds_back_only_that_client():
+    async def scenario():
+        allocator = main.CoreAllocator(list(range(6)), slots=3, max_cores_per_client=2)
+        await allocator.acquire(job_for('a'))
+        capped = asyncio.create_task(allocator.acquire(job_for('a')))
+        other = await asyncio.wait_for(allocator.acquire(job_for('b')), 1)
+        await asyncio.sleep(0.01)
+        return capped.done(), other
+
+    capped_done, other = asyncio.run(scenario())
+    assert capped_done is False and other == [2, 3]
+
+
+def test_job_cancelled_while_waiting_for_cores_gets_none():
+    async def scenario():
+        allocator = main.CoreAllocator([0, 1], slots=1, max_cores_per_client=2)
+        await allocator.acquire(job_for('a'))
+        waiting_job = job_for('b')
+        waiting = asyncio.create_task(allocator.acquire(waiting_job))
+        await asyncio.sleep(0.01)
+        waiting_job.status = 'cancelled'
+        await allocator.wake()
+        return await asyncio.wait_for(waiting, 1), allocator.stats()['freeCores']
+
+    assert asyncio.run(scenario()) == ([], 0)
+
+
+def test_per_client_job_limit_rejects_extra_submissions(engine, monkeypatch):
+    monkeypatch.setattr(main, 'TRAINING_MAX_JOBS_PER_CLIENT', 1)
+
+    async def scenario():
+        scheduler = await started_scheduler()
+        first = await scheduler.submit('a', CONFIG)
+        engine.gates[first.job_id] = threading.Event()
+        rejected = await scheduler.submit('a', CONFIG)
+        other = await scheduler.submit('b', CONFIG)
+        engine.gates[first.job_id].set()
+        await asyncio.wait_for(scheduler._pending.join(), 5)
+        after = await scheduler.submit('a', CONFIG)
+        await asyncio.wait_for(scheduler._pending.join(), 5)
+        await stop_scheduler(scheduler)
+        return scheduler, rejected, other, after
+
+    scheduler, rejected, other, after = asyncio.run(scenario())
+
+    assert rejected is None and other is not None and after is not None
+    assert any('最多同时提交 1 个训练任务' in data.get('status', '') for data in scheduler.sio.for_client('a'))
+
+
+def test_dispatch_reports_the_core_allocation(engine):
+    async def scenario():
+        scheduler = await started_scheduler()
+        job = await scheduler.submit('a', CONFIG)
+        await asyncio.wait_for(scheduler._pending.join(), 5)
+        await stop_scheduler(scheduler)
+        return scheduler, job
+
+    scheduler, job = asyncio.run(scenario())
+
+    allocations = [data['coreAllocation'] for data in scheduler.sio.for_client('a') if 'coreAllocation' in data]
+    assert [a['jobId'] for a in allocations] == [job.job_id] * 2
+    assert allocations[0]['cores'] == allocations[1]['cores'] and 'utilization' in allocations[1]
+    # 任务结束后核心全部归还
+    assert scheduler.cores.stats()['freeCores'] == scheduler.cores.stats()['totalCores']
+
+
+def test_worker_applies_the_core_budget(monkeypatch):
+    import torch
+    import cnn_engine
+
+    monkeypatch.setattr(cnn_engine, '_worker_cores', None)
+    monkeypatch.setattr(cnn_engine, '_worker_cores_pinned', False)
+    num_threads = torch.get_num_threads()
+    try:
+        cnn_engine.apply_core_budget([0], pin=True)
+        assert torch.get_num_threads() == 1
+        assert cnn_engine._worker_cores == [0]
+        if hasattr(os, 'sched_getaffinity'):
+            assert os.sched_getaffinity(0) == {0}
+        # 不绑核的任务恢复为进程启动时的亲和性
+        cnn_engine.apply_core_budget([0], pin=False)
+        assert cnn_engine._worker_cores_pinned is False
+        if hasattr(os, 'sched_getaffinity'):
+            assert os.sched_getaffinity(0) == set(cnn_engine._WORKER_DEFAULT_AFFINITY)
+    finally:
+        torch.set_num_threads(num_threads)
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cnn_engine._WORKER_DEFAULT_AFFINITY)
+
+
+def with_cancel_flags(scheduler, monkeypatch):
+    import cnn_engine
+
+    scheduler._cancel_flags = scheduler._mp_context.Array('c', main.TRAINING_CANCEL_SLOTS * main._CANCEL_SLOT_BYTES,
+                                                          lock=False)
+    # 工作进程读取的是同一块共享内存
+    monkeypatch.setattr(cnn_engine, '_worker_cancel_flags', scheduler._cancel_flags)
+    return cnn_engine.is_job_cancelled
+
+
+def test_cancel_dequeues_waiting_jobs_and_flags_running_ones(engine, monkeypatch):
+    async def scenario():
+        scheduler = await started_scheduler()
+        is_job_cancelled = with_cancel_flags(scheduler, monkeypatch)
+        running = await scheduler.submit('a', CONFIG)
+        engine.gates[running.job_id] = threading.Event()
+        queued = await scheduler.submit('a', CONFIG)
+        other = await scheduler.submit('b', CONFIG)
+        while running.status != 'running':
+            await asyncio.sleep(0.01)
+
+        cancelled = await scheduler.cancel('a', queued.job_id)
+        assert cancelled == [queued.job_id] and queued.status == 'cancelled'
+        assert not is_job_cancelled(running.job_id)
+        assert await scheduler.cancel('a') == [running.job_id]
+        assert running.status == 'cancelling' and is_job_cancelled(running.job_id)
+        assert not is_job_cancelled(other.job_id)
+        # 其他客户端的任务不受影响
+        assert await scheduler.cancel('b', running.job_id) == []
+
+        engine.gates[running.job_id].set()
+        await asyncio.wait_for(scheduler._pending.join(), 5)
+        await stop_scheduler(scheduler)
+        return scheduler, running, queued, other
+
+    scheduler, running, queued, other = asyncio.run(scenario())
+
+    assert engine.started == [running.job_id, other.job_id]
+    assert (running.status, other.status) == ('cancelled', 'finished')
+    assert any(data.get('cancelled') and data.get('jobId') == queued.job_id for data in scheduler.sio.for_client('a'))
+
+
+def test_cancel_flag_slots_are_reused_round_robin(engine, monkeypatch):
+    async def scenario():
+        scheduler = await started_scheduler()
+        is_job_cancelled = with_cancel_flags(scheduler, monkeypatch)
+        jobs = [main.TrainingJob('a', CONFIG) for _ in range(main.TRAINING_CANCEL_SLOTS + 1)]
+        for job in jobs:
+            job.status = 'running'
+            scheduler._running_jobs[job.job_id] = job
+            await scheduler.cancel('a', job.job_id)
+        flags = [is_job_cancelled(job.job_id) for job in jobs]
+        scheduler._running_jobs.clear()
+        await stop_scheduler(scheduler)
+        return flags
+
+    flags = asyncio.run(scenario())
+    # 第一个槽位已被最后一个任务覆盖
+    assert flags == [False] + [True] * main.TRAINING_CANCEL_SLOTS
+
+
+def test_resume_is_submitted_under_the_original_checkpoint(engine):
+    async def scenario():
+        scheduler = await started_scheduler()
+        job = await scheduler.submit('a', CONFIG, checkpoint_id='0123456789ab', owner='owner-digest')
+        await asyncio.wait_for(scheduler._pending.join(), 5)
+        await stop_scheduler(scheduler)
+        return scheduler, job
+
+    scheduler, job = asyncio.run(scenario())
+
+    assert (job.checkpoint_id, job.resume, job.owner) == ('0123456789ab', True, 'owner-digest')
+    assert scheduler.sio.for_client('a')[0]['checkpointId'] == '0123456789ab'
+
+
+def test_broken_pool_is_rebuilt_once_for_all_dispatch_loops(monkeypatch):
+    from concurrent.futures.process import BrokenProcessPool
+
+    both_running = threading.Barrier(2, timeout=5)
+
+    def crash(function_name, cores, pin, job_id, *args):
+        # 两个任务都在同一个进程池上运行时，工作进程退出使两者同时失败
+        both_running.wait()
+        raise BrokenProcessPool('worker died')
+
+    monkeypatch.setattr(main, '_run_job_in_engine', crash)
+    pools = []
+
+    def create_pool():
+        pools.append(ThreadPoolExecutor(1))
+        return pools[-1]
+
+    async def scenario():
+        scheduler = await started_scheduler(max_workers=2)
+        scheduler.cores = main.CoreAllocator([0, 1], slots=2, max_cores_per_client=2)
+        broken = scheduler._pool
+        monkeypatch.setattr(scheduler, '_create_pool', create_pool)
+        jobs = [await scheduler.submit(sid, CONFIG) for sid in ('a', 'b')]
+        await asyncio.wait_for(scheduler._pending.join(), 5)
+        await stop_scheduler(scheduler)
+        broken.shutdown(wait=True)
+        return scheduler, jobs
+
+    scheduler, jobs = asyncio.run(scenario())
+
+    assert [job.status for job in jobs] == ['failed', 'failed']
+    assert len(pools) == 1 and scheduler._pool is pools[0]
+    for sid in ('a', 'b'):
+        assert any(data.get('error') for data in scheduler.sio.for_client(sid))
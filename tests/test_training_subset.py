@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+import torch
+
+from cnn_engine import MNISTTensorCache
+from model_artifacts import LRUArtifactCache
+from model_cost import ArchitectureCostError, resolve_training_subset
+
+# 类别 c 有 10 * (c + 1) 个样本，共 550 个，顺序打乱
+LABELS = torch.tensor([c for c in range(10) for _ in range(10 * (c + 1))])[
+    torch.randperm(550, generator=torch.Generator().manual_seed(0))]
+
+
+@pytest.fixture
+def imbalanced_mnist(monkeypatch):
+    images = np.zeros((len(LABELS), 28, 28), dtype=np.uint8)
+    monkeypatch.setattr(MNISTTensorCache, '_splits', {True: (images, LABELS)})
+    monkeypatch.setattr(MNISTTensorCache, '_class_indices', {})
+    monkeypatch.setattr(MNISTTensorCache, '_subsets', LRUArtifactCache(8))
+    return LABELS
+
+
+def test_stratified_subset_keeps_class_proportions(imbalanced_mnist):
+    indices = MNISTTensorCache.subset_indices(110, 'stratified')
+    counts = torch.bincount(imbalanced_mnist[indices], minlength=10).tolist()
+    # 每个类别按 110 / 550 = 1/5 的比例抽取
+    assert counts == [2 * (c + 1) for c in range(10)]
+    assert torch.equal(indices, indices.sort().values) and len(indices.unique()) == 110
+
+
+def test_stratified_quotas_use_largest_remainder(imbalanced_mnist):
+    indices = MNISTTensorCache.subset_indices(23, 'stratified')
+    counts = torch.bincount(imbalanced_mnist[indices], minlength=10)
+    assert counts.sum() == 23
+    exact = torch.arange(1, 11) * 10 * 23 / 550
+    assert torch.all((counts - exact).abs() < 1)
+
+
+def test_stratified_subset_only_draws_from_the_pool(imbalanced_mnist):
+    indices = MNISTTensorCache.subset_indices(50, 'stratified', pool_size=200)
+    assert len(indices) == 50 and indices.max() < 200
+
+
+def test_other_strategies_and_caching(imbalanced_mnist):
+    assert MNISTTensorCache.subset_indices(5, 'first').tolist() == [0, 1, 2, 3, 4]
+    random_indices = MNISTTensorCache.subset_indices(40, 'random')
+    assert len(random_indices.unique()) == 40 and torch.equal(random_indices, random_indices.sort().values)
+    # 相同参数返回缓存的同一份索引，不同种子得到不同的抽样
+    assert MNISTTensorCache.subset_indices(40, 'random') is random_indices
+    assert not torch.equal(MNISTTensorCache.subset_indices(40, 'random', seed=1), random_indices)
+    # 子集不小于样本池时直接使用全部样本
+    assert MNISTTensorCache.subset_indices(10_000, 'stratified').tolist() == list(range(len(LABELS)))
+    with pytest.raises(ValueError):
+        MNISTTensorCache.subset_indices(10, 'balanced')
+
+
+def test_resolve_training_subset():
+    assert resolve_training_subset({}, 60000) == (10000, 'stratified')
+    assert resolve_training_subset({'subsetSize': 'full', 'samplingStrategy': 'random'}, 60000) == (60000, 'random')
+    assert resolve_training_subset({'subsetSize': 70000}, 60000) == (60000, 'stratified')
+    for params in ({'subsetSize': 0}, {'subsetSize': 1.5}, {'subsetSize': 'all'}, {'samplingStrategy': 'balanced'}):
+        with pytest.raises(ArchitectureCostError):
+            resolve_training_subset(params, 60000)